@@ -0,0 +1,96 @@
+"""
+Async versions of the read-heavy drone endpoints, for the ASGI deployment (see the DRONES_ASYNC_VIEWS setting).
+
+They use the async ORM and share the cache of the sync views, so a slow client only holds a coroutine instead of a
+worker. Anything but GET requests on their URLs is passed on to the sync views.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.urls import path
+from rest_framework.exceptions import ValidationError
+
+from drones.cache import FLEET_VERSION_KEY, acached_drone_response, acached_response
+from drones.fieldsets import get_fieldset, only_columns
+from drones.models import Drone, Medication
+from drones.serializers import DroneSerializer, MedicationSerializer
+from drones.views import DroneViewSet
+
+
+def read_only(view, sync_view=None):
+    """
+    Serve the GET and HEAD requests with the async `view`, and the rest with `sync_view`, answering JSON 404 and 400
+    errors like the sync views when the object requested does not exist or the query is invalid.
+    """
+    @wraps(view)
+    async def dispatch(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            try:
+                return await view(request, *args, **kwargs)
+            except Http404:
+                return JsonResponse({'detail': 'Not found.'}, status=404)
+            except ValidationError as error:
+                return JsonResponse(error.detail, status=400, safe=False)
+        if sync_view is not None:
+            return await sync_to_async(sync_view)(request, *args, **kwargs)
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+
+    # Like the DRF views, authentication takes care of CSRF.
+    dispatch.csrf_exempt = True
+    return dispatch
+
+
+async def get_object_or_404(queryset, **kwargs):
+    try:
+        return await queryset.aget(**kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404
+
+
+def drones_with_medications(fieldset):
+    return only_columns(DroneViewSet.prefetch_medication_set(Drone.objects.all(), fieldset), fieldset)
+
+
+async def retrieve(request, pk):
+    fieldset = get_fieldset(request.GET, DroneSerializer)
+
+    async def render():
+        drone = await get_object_or_404(drones_with_medications(fieldset), id=pk)
+        return DroneSerializer(drone, context={'request': request, 'fieldset': fieldset}).data
+
+    return await acached_drone_response(request, pk, 'retrieve', render)
+
+
+async def check_battery_level(request, pk):
+    async def render():
+        drone = await get_object_or_404(Drone.objects.only('id', 'battery_capacity'), id=pk)
+        return {'battery_level': drone.battery_capacity}
+
+    return await acached_drone_response(request, pk, 'check_battery_level', render)
+
+
+async def check_loaded_medications(request, pk):
+    drone = await get_object_or_404(Drone.objects.only('id'), id=pk)
+    medications = [medication async for medication in Medication.objects.filter(drone=drone)]
+    return JsonResponse(MedicationSerializer(medications, many=True, context={'request': request}).data, safe=False)
+
+
+async def get_available_drones(request):
+    fieldset = get_fieldset(request.GET, DroneSerializer)
+
+    async def render():
+        drones = [drone async for drone in drones_with_medications(fieldset).available()]
+        return DroneSerializer(drones, many=True, context={'request': request, 'fieldset': fieldset}).data
+
+    return await acached_response(request, 'get_available_drones', [FLEET_VERSION_KEY], render)
+
+
+urlpatterns = [
+    path('drones/<int:pk>/', read_only(retrieve, DroneViewSet.as_view({
+        'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'
+    }))),
+    path('drones/<int:pk>/check_battery_level/', read_only(check_battery_level)),
+    path('drones/<int:pk>/check_loaded_medications/', read_only(check_loaded_medications)),
+    path('drones/get_available_drones/', read_only(get_available_drones)),
+]
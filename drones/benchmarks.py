@@ -0,0 +1,654 @@
+"""
+Benchmarks of the performance sensitive parts of the application.
+
+Run them with `python manage.py benchmark [name ...]`. Each benchmark is a function registered with `@benchmark` that
+returns a dict of measurements, e.g. {'seconds': 0.012}.
+"""
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connections, transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.test import modify_settings, override_settings
+from django.utils import timezone
+from django.urls import resolve, reverse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from drones import geo, metrics, schema, simulation
+from drones.dispatch import pack_medications
+from drones.models import BatteryLevelSnapshot, Drone, Medication
+from drones.renderers import FastJSONRenderer
+from drones.representations import drone_values, represent_drones
+from drones.serializers import DroneSerializer
+from drones.tasks import audit_battery_shard, battery_shards, log_drones_battery_levels, merge_battery_audit
+
+BENCHMARKS = {}
+
+
+def benchmark(function):
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+@benchmark
+def packing(medications=10000, drones=1000, seed=0):
+    """
+    Pack medications of 1-200g onto drones with 100-500g of free capacity.
+    """
+    rng = random.Random(seed)
+    medication_weights = [(i, rng.uniform(1, 200)) for i in range(medications)]
+    drone_capacities = [(i, rng.randint(100, 500)) for i in range(drones)]
+
+    start = time.perf_counter()
+    assignments, unassigned = pack_medications(medication_weights, drone_capacities)
+    seconds = time.perf_counter() - start
+
+    return {
+        'seconds': seconds,
+        'medications': medications,
+        'drones': drones,
+        'assigned': medications - len(unassigned),
+        'drones_used': len(assignments),
+    }
+
+
+@benchmark
+def assign_medications(medications=10000, drones=1000, seed=0):
+    """
+    Pack pending medications onto available drones through the API, including locking and writing the assignments.
+    """
+    rng = random.Random(seed)
+    Drone.objects.bulk_create(
+        Drone(serial_number=f'BENCH_ASSIGN_{i}', model='heavyweight', weight_limit=rng.randint(100, 500),
+              battery_capacity=90, state=Drone.STATE_IDLE)
+        for i in range(drones)
+    )
+    created = Medication.objects.bulk_create(
+        Medication(name=f'Bench-{i}', weight=rng.uniform(1, 200), code=f'BENCH_{i}', image='bench.jpg')
+        for i in range(medications)
+    )
+
+    client = APIClient(HTTP_HOST='localhost')
+    start = time.perf_counter()
+    response = client.post(reverse('drone-assign-medications'),
+                           {'medication_set': [medication.pk for medication in created]}, format='json')
+    seconds = time.perf_counter() - start
+
+    Medication.objects.filter(name__startswith='Bench-').delete()
+    Drone.objects.filter(serial_number__startswith='BENCH_ASSIGN_').delete()
+    return {
+        'seconds': seconds,
+        'medications': medications,
+        'drones': drones,
+        'assigned': medications - len(response.data['unassigned']),
+    }
+
+
+@benchmark
+def battery_check(drones=100000, seed=0):
+    """
+    Run the periodic battery check over the whole fleet, logging the levels and storing their snapshot.
+    """
+    rng = random.Random(seed)
+    Drone.objects.bulk_create(
+        (Drone(serial_number=f'BENCH_BATTERY_{i}', model='lightweight', weight_limit=250,
+               battery_capacity=rng.randint(0, 100), state=Drone.STATE_IDLE) for i in range(drones)),
+        batch_size=2000
+    )
+
+    logger = logging.getLogger('battery-level-check-logger')
+    disabled, logger.disabled = logger.disabled, True
+    start = time.perf_counter()
+    try:
+        totals = log_drones_battery_levels()
+    finally:
+        logger.disabled = disabled
+    seconds = time.perf_counter() - start
+
+    BatteryLevelSnapshot.objects.all().delete()
+    Drone.objects.filter(serial_number__startswith='BENCH_BATTERY_').delete()
+    return {'seconds': seconds, 'drones': drones, 'low_battery_drones': totals['low_battery_drones']}
+
+
+@benchmark
+def sharded_battery_check(drones=100000, shard_size=10000, seed=0):
+    """
+    Run the battery check over the whole fleet in a single task, then in shards. The tasks run one after the other
+    here, so the time of the sharded check with a worker per shard is estimated as the time of planning the shards,
+    plus the slowest one, plus merging their results.
+    """
+    rng = random.Random(seed)
+    Drone.objects.bulk_create(
+        (Drone(serial_number=f'BENCH_SHARD_{i}', model='lightweight', weight_limit=250,
+               battery_capacity=rng.randint(0, 100), state=Drone.STATE_IDLE) for i in range(drones)),
+        batch_size=2000
+    )
+
+    logger = logging.getLogger('battery-level-check-logger')
+    disabled, logger.disabled = logger.disabled, True
+    try:
+        start = time.perf_counter()
+        log_drones_battery_levels()
+        single_seconds = time.perf_counter() - start
+
+        taken_at = timezone.now().isoformat()
+        start = time.perf_counter()
+        shards = battery_shards(shard_size)
+        plan_seconds = time.perf_counter() - start
+        results = [audit_battery_shard(taken_at, shard_start, shard_stop) for shard_start, shard_stop in shards]
+        start = time.perf_counter()
+        report = merge_battery_audit(results, taken_at)
+        merge_seconds = time.perf_counter() - start
+    finally:
+        logger.disabled = disabled
+
+    BatteryLevelSnapshot.objects.all().delete()
+    Drone.objects.filter(serial_number__startswith='BENCH_SHARD_').delete()
+    shard_seconds = [shard['seconds'] for shard in report['shards']]
+    return {
+        'drones': drones,
+        'shards': len(shards),
+        'single_seconds': single_seconds,
+        'plan_seconds': plan_seconds,
+        'shards_total_seconds': sum(shard_seconds),
+        'slowest_shard_seconds': max(shard_seconds),
+        'merge_seconds': merge_seconds,
+        'parallel_seconds': plan_seconds + max(shard_seconds) + merge_seconds,
+    }
+
+
+@benchmark
+def bulk_create_drones(drones=5000, one_by_one=500):
+    """
+    Register a fleet through the bulk endpoint, and a smaller one with a request per drone for comparison.
+    """
+    def drone_data(prefix, i):
+        return {'serial_number': f'{prefix}_{i}', 'model': 'lightweight', 'weight_limit': 250, 'battery_capacity': 50,
+                'state': Drone.STATE_IDLE}
+
+    client = APIClient(HTTP_HOST='localhost')
+    start = time.perf_counter()
+    client.post(reverse('drone-bulk'), [drone_data('BENCH_BULK', i) for i in range(drones)], format='json')
+    bulk_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(one_by_one):
+        client.post(reverse('drone-list'), drone_data('BENCH_SINGLE', i), format='json')
+    single_seconds = time.perf_counter() - start
+
+    Drone.objects.filter(serial_number__startswith='BENCH_').delete()
+    return {
+        'seconds': bulk_seconds,
+        'drones': drones,
+        'drones_per_second': drones / bulk_seconds,
+        'one_by_one_drones_per_second': one_by_one / single_seconds,
+    }
+
+
+@benchmark
+def export_drones(drones=20000, medications_per_drone=2):
+    """
+    Stream the whole fleet with its loaded medications as NDJSON, measuring the peak memory it takes.
+    """
+    Drone.objects.bulk_create(
+        (Drone(serial_number=f'BENCH_EXPORT_{i}', model='lightweight', weight_limit=250, battery_capacity=50,
+               state=Drone.STATE_LOADED) for i in range(drones)),
+        batch_size=2000
+    )
+    drone_ids = Drone.objects.filter(serial_number__startswith='BENCH_EXPORT_').values_list('id', flat=True)
+    Medication.objects.bulk_create(
+        (Medication(name=f'Export-{drone_id}-{j}', weight=1, code=f'EXPORT_{drone_id}_{j}',
+                    image='medications/export.jpg', drone_id=drone_id)
+         for drone_id in drone_ids.iterator() for j in range(medications_per_drone)),
+        batch_size=2000
+    )
+
+    client = APIClient(HTTP_HOST='localhost')
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = 0
+    try:
+        response = client.get(reverse('drone-export'))
+        for chunk in response.streaming_content:
+            size += len(chunk)
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    Medication.objects.filter(code__startswith='EXPORT_').delete()
+    Drone.objects.filter(serial_number__startswith='BENCH_EXPORT_').delete()
+    return {
+        'seconds': seconds,
+        'drones': drones,
+        'drones_per_second': drones / seconds,
+        'megabytes': size / 2 ** 20,
+        'peak_memory_megabytes': peak / 2 ** 20,
+    }
+
+
+@benchmark
+def serialization(drones=10000, medications_per_drone=2):
+    """
+    Serialize and render a fleet with its loaded medications, with DroneSerializer and JSONRenderer, and with the fast
+    path of the lists and details: `values()` rows and the orjson renderer.
+    """
+    Drone.objects.bulk_create(
+        (Drone(serial_number=f'BENCH_SERIALIZE_{i}', model='lightweight', weight_limit=250, battery_capacity=50,
+               state=Drone.STATE_LOADED) for i in range(drones)),
+        batch_size=2000
+    )
+    drone_ids = Drone.objects.filter(serial_number__startswith='BENCH_SERIALIZE_').values_list('id', flat=True)
+    Medication.objects.bulk_create(
+        (Medication(name=f'Serialize-{drone_id}-{j}', weight=1, code=f'SERIALIZE_{drone_id}_{j}',
+                    image='medications/serialize.jpg', drone_id=drone_id)
+         for drone_id in drone_ids.iterator() for j in range(medications_per_drone)),
+        batch_size=2000
+    )
+    queryset = Drone.objects.filter(serial_number__startswith='BENCH_SERIALIZE_')
+    request = Request(APIRequestFactory().get('/drones/', HTTP_HOST='localhost'))
+
+    def serializers():
+        medications = Medication.objects.only('id', 'name', 'weight', 'code', 'image', 'thumbnail', 'preview', 'drone')
+        fleet = queryset.prefetch_related(Prefetch('medication_set', queryset=medications))
+        return JSONRenderer().render(DroneSerializer(fleet, many=True, context={'request': request}).data)
+
+    def fast_path():
+        return FastJSONRenderer().render(represent_drones(request, list(drone_values(queryset))))
+
+    timings = {}
+    for name, render in (('serializers', serializers), ('fast_path', fast_path)):
+        start = time.perf_counter()
+        timings[name] = render()
+        timings[f'{name}_seconds'] = time.perf_counter() - start
+    same_output = timings.pop('serializers') == timings.pop('fast_path')
+
+    Medication.objects.filter(code__startswith='SERIALIZE_').delete()
+    queryset.delete()
+    return {
+        'seconds': timings['fast_path_seconds'],
+        'drones': drones,
+        'serializers_seconds': timings['serializers_seconds'],
+        'speedup': timings['serializers_seconds'] / timings['fast_path_seconds'],
+        'same_output': same_output,
+    }
+
+
+def _write_load(alias, drone_ids, writers, transactions, seed):
+    """
+    Run `transactions` transactions on each of `writers` threads against the database `alias`, each one locking a
+    drone, changing its battery level and storing a snapshot of it, like loading a drone does. Return the transactions
+    committed, the ones that failed on a locked database, and the seconds taken.
+    """
+    counts = {'committed': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def writer(number):
+        rng = random.Random(seed + number)
+        committed = failed = 0
+        try:
+            for _ in range(transactions):
+                drone_id = rng.choice(drone_ids)
+                try:
+                    with transaction.atomic(using=alias):
+                        drones = Drone.objects.using(alias)
+                        battery_level = drones.select_for_update().get(pk=drone_id).battery_capacity
+                        battery_level = (battery_level + 1) % 101
+                        drones.filter(pk=drone_id).update(battery_capacity=battery_level)
+                        BatteryLevelSnapshot.objects.using(alias).create(drone_id=drone_id, battery_level=battery_level,
+                                                                         taken_at=timezone.now())
+                    committed += 1
+                except OperationalError:
+                    failed += 1
+        finally:
+            connections[alias].close()
+        with lock:
+            counts['committed'] += committed
+            counts['failed'] += failed
+
+    threads = [threading.Thread(target=writer, args=(number,)) for number in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts['committed'], counts['failed'], time.perf_counter() - start
+
+
+@benchmark
+def concurrent_writes(writers=8, transactions=200, drones=100, seed=0):
+    """
+    Write throughput of concurrent writers with SQLite as Django configures it by default, and with the configured
+    database profile: the tuned SQLite (WAL, busy timeout, immediate transactions) or PostgreSQL. SQLite databases are
+    files in a temporary folder, as an in-memory database has no journal nor locks between connections.
+    """
+    default = connections['default'].settings_dict
+    with tempfile.TemporaryDirectory() as directory:
+        profiles = {'sqlite_default': {**default, 'ENGINE': 'django.db.backends.sqlite3',
+                                       'NAME': os.path.join(directory, 'default.sqlite3'), 'OPTIONS': {}}}
+        if connections['default'].vendor == 'sqlite':
+            options = {**default['OPTIONS'], 'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}}
+            profiles['sqlite_tuned'] = {**default, 'NAME': os.path.join(directory, 'tuned.sqlite3'), 'OPTIONS': options}
+        else:
+            profiles[connections['default'].vendor] = default
+
+        results = {'writers': writers}
+        for name, settings_dict in profiles.items():
+            alias = f'benchmark_{name}'
+            connections.settings[alias] = settings_dict
+            try:
+                if settings_dict is not default:
+                    call_command('migrate', database=alias, verbosity=0)
+                Drone.objects.using(alias).bulk_create(
+                    Drone(serial_number=f'BENCH_WRITES_{i}', model='lightweight', weight_limit=250,
+                          battery_capacity=50, state=Drone.STATE_IDLE) for i in range(drones)
+                )
+                drone_ids = list(Drone.objects.using(alias).filter(serial_number__startswith='BENCH_WRITES_')
+                                 .values_list('id', flat=True))
+                committed, failed, seconds = _write_load(alias, drone_ids, writers, transactions, seed)
+                Drone.objects.using(alias).filter(serial_number__startswith='BENCH_WRITES_').delete()
+            finally:
+                connections[alias].close()
+                del connections.settings[alias]
+            results[f'{name}_transactions_per_second'] = committed / seconds
+            results[f'{name}_failed'] = failed
+    return results
+
+
+@benchmark
+def request_metrics(requests=5000, drones=10, rounds=10):
+    """
+    Overhead of the metrics middleware: the time per request of a drone list page, with and without it. Both run in
+    alternate rounds, keeping the fastest round of each, to cancel out the noise of the machine.
+    """
+    Drone.objects.bulk_create(
+        Drone(serial_number=f'BENCH_METRICS_{i}', model='lightweight', weight_limit=250, battery_capacity=50,
+              state=Drone.STATE_IDLE) for i in range(drones)
+    )
+    url = reverse('drone-list')
+    # The clients load the middleware on their first request.
+    clients = {'with_metrics': APIClient(HTTP_HOST='localhost', HTTP_ACCEPT='application/json')}
+    clients['with_metrics'].get(url)
+    with modify_settings(MIDDLEWARE={'remove': 'drones.metrics.metrics_middleware'}):
+        clients['without_metrics'] = APIClient(HTTP_HOST='localhost', HTTP_ACCEPT='application/json')
+        clients['without_metrics'].get(url)
+
+    timings = dict.fromkeys(clients, float('inf'))
+    for i in range(rounds):
+        # Alternate which one runs first too.
+        for name, client in sorted(clients.items(), reverse=i % 2 == 1):
+            start = time.perf_counter()
+            for _ in range(requests // rounds):
+                client.get(url)
+            timings[name] = min(timings[name], (time.perf_counter() - start) / (requests // rounds))
+
+    # The end to end difference is often below the noise, so time the work of the middleware alone too, around a view
+    # running two queries and rendering its response.
+    request = APIRequestFactory().get(url, HTTP_HOST='localhost')
+    request.resolver_match = resolve(url)
+
+    def view(request):
+        for _ in range(2):
+            metrics.query_wrapper(lambda *args: None, 'SELECT 1', (), False, {})
+        with metrics.serialization():
+            return HttpResponse(b'[]')
+
+    middleware = metrics.metrics_middleware(view)
+    start = time.perf_counter()
+    for _ in range(requests):
+        middleware(request)
+    middleware_seconds = (time.perf_counter() - start) / requests
+
+    Drone.objects.filter(serial_number__startswith='BENCH_METRICS_').delete()
+    return {
+        'seconds': timings['with_metrics'],
+        'without_metrics_seconds': timings['without_metrics'],
+        'overhead_microseconds': (timings['with_metrics'] - timings['without_metrics']) * 1e6,
+        'middleware_microseconds': middleware_seconds * 1e6,
+    }
+
+
+@benchmark
+def medication_search(medications=1000000, drones=100, repeat=20, seed=0):
+    """
+    Lookups of the medications list with each filter, over a large catalog: the median time of the request of a page.
+    """
+    rng = random.Random(seed)
+    names = ['Advil', 'Tylenol', 'Aspirin', 'Ibuprofen', 'Paracetamol', 'Amoxicillin', 'Lisinopril', 'Metformin',
+             'Omeprazole', 'Simvastatin', 'Losartan', 'Albuterol', 'Gabapentin', 'Sertraline', 'Prednisone']
+    Drone.objects.bulk_create(
+        Drone(serial_number=f'BENCH_SEARCH_{i}', model='heavyweight', weight_limit=500, battery_capacity=50,
+              state=Drone.STATE_LOADED) for i in range(drones)
+    )
+    drone_ids = list(Drone.objects.filter(serial_number__startswith='BENCH_SEARCH_').values_list('id', flat=True))
+    start = time.perf_counter()
+    for offset in range(0, medications, 100000):
+        Medication.objects.bulk_create(
+            (Medication(name=f'{name}-{i}', weight=rng.uniform(1, 500), code=f'{name[:3].upper()}_{i}',
+                        image='medications/search.jpg',
+                        # A tenth of the catalog is not loaded yet.
+                        drone_id=rng.choice(drone_ids) if rng.random() < 0.9 else None)
+             for i, name in ((i, rng.choice(names)) for i in range(offset, min(offset + 100000, medications)))),
+            batch_size=2000
+        )
+    load_seconds = time.perf_counter() - start
+
+    client = APIClient(HTTP_HOST='localhost', HTTP_ACCEPT='application/json')
+    url = reverse('medication-list')
+    lookups = {
+        'code_prefix': {'code': 'ADV_4242'},
+        'name_prefix': {'name': 'Tylenol-77'},
+        'weight_range': {'min_weight': 250, 'max_weight': 250.5},
+        'not_loaded': {'loaded': 'false'},
+        'search': {'search': 'enol-31415'},
+        'search_code': {'search': 'par_2718'},
+        'search_and_filters': {'search': 'advil-42', 'loaded': 'false', 'max_weight': 250},
+        # A text a fifteenth of the catalog contains: the search reads and sorts all the matches.
+        'search_broad': {'search': 'advil'},
+    }
+    results = {'medications': medications, 'load_seconds': load_seconds}
+    for name, query in lookups.items():
+        client.get(url, query)
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.get(url, query)
+            timings.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.content
+        results[f'{name}_milliseconds'] = sorted(timings)[len(timings) // 2] * 1000
+        results[f'{name}_results'] = len(response.data['results'])
+
+    Medication.objects.filter(image='medications/search.jpg').delete()
+    Drone.objects.filter(serial_number__startswith='BENCH_SEARCH_').delete()
+    return results
+
+
+@benchmark
+def simulation_tick(drones=100000, seed=0):
+    """
+    Advance the simulation a tick over a fleet in every state, the loaded and delivering drones carrying a medication.
+    """
+    rng = random.Random(seed)
+    models = list(simulation.DRAIN_PER_TICK)
+    fleet_states = [state for state, label in Drone.STATE_CHOICES]
+    Drone.objects.bulk_create(
+        (Drone(serial_number=f'BENCH_SIMULATION_{i}', model=rng.choice(models), weight_limit=500,
+               battery_capacity=rng.randint(0, 100), state=rng.choice(fleet_states)) for i in range(drones)),
+        batch_size=2000
+    )
+    carrying = Drone.objects.filter(serial_number__startswith='BENCH_SIMULATION_',
+                                    state__in=(Drone.STATE_LOADED, Drone.STATE_DELIVERING)).values_list('id', flat=True)
+    Medication.objects.bulk_create(
+        (Medication(name=f'BENCH_SIMULATION_{pk}', weight=100, code='BENCH', image='bench.jpg', drone_id=pk)
+         for pk in carrying.iterator()),
+        batch_size=2000
+    )
+
+    start = time.perf_counter()
+    result = simulation.tick()
+    seconds = time.perf_counter() - start
+
+    Medication.objects.filter(name__startswith='BENCH_SIMULATION_').delete()
+    Drone.objects.filter(serial_number__startswith='BENCH_SIMULATION_').delete()
+    return {'seconds': seconds, 'drones': drones, 'changed_drones': result['drones'],
+            'delivered_medications': result['delivered_medications']}
+
+
+@benchmark
+def nearest_drones(drones=100000, repeat=20, seed=0):
+    """
+    Look up the 5 available drones nearest to points of a city that can carry 200g, over a fleet spread across it in
+    every state: the median time of the request, and of the lookup through the grid index and by scanning all the
+    eligible drones.
+    """
+    rng = random.Random(seed)
+    models = list(simulation.DRAIN_PER_TICK)
+    fleet_states = [state for state, label in Drone.STATE_CHOICES]
+    # About 40 km by 40 km around Berlin.
+    south, west, north, east = 52.35, 13.1, 52.7, 13.7
+    Drone.objects.bulk_create(
+        (Drone(serial_number=f'BENCH_NEAREST_{i}', model=rng.choice(models), weight_limit=rng.randint(100, 500),
+               battery_capacity=rng.randint(0, 100), state=rng.choice(fleet_states),
+               latitude=rng.uniform(south, north), longitude=rng.uniform(west, east)) for i in range(drones)),
+        batch_size=2000
+    )
+    points = [(rng.uniform(south, north), rng.uniform(west, east)) for _ in range(repeat)]
+    eligible = Drone.objects.available().filter(weight_limit__gte=200)
+
+    def median_milliseconds(lookup):
+        timings = []
+        for latitude, longitude in points:
+            start = time.perf_counter()
+            lookup(latitude, longitude)
+            timings.append(time.perf_counter() - start)
+        return sorted(timings)[len(timings) // 2] * 1000
+
+    def scan(latitude, longitude):
+        return sorted((geo.distance(latitude, longitude, drone_latitude, drone_longitude), pk)
+                      for pk, drone_latitude, drone_longitude in eligible.values_list('id', 'latitude', 'longitude'))[:5]
+
+    for latitude, longitude in points:
+        assert eligible.nearest(latitude, longitude, 5) == scan(latitude, longitude)
+
+    client = APIClient(HTTP_HOST='localhost', HTTP_ACCEPT='application/json')
+    url = reverse('drone-nearest')
+
+    def request(latitude, longitude):
+        response = client.get(url, {'latitude': latitude, 'longitude': longitude, 'weight': 200, 'k': 5})
+        assert response.status_code == 200 and len(response.data) == 5, response.content
+
+    results = {
+        'drones': drones,
+        'eligible_drones': eligible.count(),
+        'request_milliseconds': median_milliseconds(request),
+        'index_milliseconds': median_milliseconds(lambda latitude, longitude: eligible.nearest(latitude, longitude, 5)),
+        'scan_milliseconds': median_milliseconds(scan),
+        # Away from the fleet, the rings come up empty and the lookup falls back to the scan.
+        'far_index_milliseconds': median_milliseconds(
+            lambda latitude, longitude: eligible.nearest(latitude - 10, longitude, 5)),
+    }
+    Drone.objects.filter(serial_number__startswith='BENCH_NEAREST_').delete()
+    return results
+
+
+@benchmark
+def sparse_responses(drones=5000, medications_per_drone=2, repeat=10):
+    """
+    Size and median time of the available drones response over a fleet with loaded medications, in full, with the
+    fields a dispatch client needs, and compressed. The cache is cleared before every request.
+    """
+    Drone.objects.bulk_create(
+        (Drone(serial_number=f'BENCH_SPARSE_{i}', model='lightweight', weight_limit=250, battery_capacity=90,
+               state=Drone.STATE_IDLE, latitude=52.5, longitude=13.4) for i in range(drones)),
+        batch_size=2000
+    )
+    drone_ids = Drone.objects.filter(serial_number__startswith='BENCH_SPARSE_').values_list('id', flat=True)
+    Medication.objects.bulk_create(
+        (Medication(name=f'Sparse-{drone_id}-{j}', weight=1, code=f'SPARSE_{drone_id}_{j}',
+                    image='medications/sparse.jpg', drone_id=drone_id)
+         for drone_id in drone_ids.iterator() for j in range(medications_per_drone)),
+        batch_size=2000
+    )
+    client = APIClient(HTTP_HOST='localhost', HTTP_ACCEPT='application/json')
+    url = reverse('drone-get-available-drones')
+    cases = {
+        'full': ({}, ''),
+        'sparse': ({'fields': 'id,state,battery_capacity'}, ''),
+        'full_gzip': ({}, 'gzip'),
+        'full_brotli': ({}, 'br'),
+        'sparse_brotli': ({'fields': 'id,state,battery_capacity'}, 'br'),
+    }
+    results = {'drones': drones}
+    for name, (query, encoding) in cases.items():
+        timings = []
+        for _ in range(repeat):
+            cache.clear()
+            start = time.perf_counter()
+            response = client.get(url, query, HTTP_ACCEPT_ENCODING=encoding)
+            timings.append(time.perf_counter() - start)
+        assert response.status_code == 200 and response.get('Content-Encoding', '') == encoding, response
+        results[f'{name}_bytes'] = len(response.content)
+        results[f'{name}_milliseconds'] = sorted(timings)[len(timings) // 2] * 1000
+
+    Medication.objects.filter(code__startswith='SPARSE_').delete()
+    Drone.objects.filter(serial_number__startswith='BENCH_SPARSE_').delete()
+    return results
+
+
+@benchmark
+def api_schema(repeat=20, startups=5):
+    """
+    Median time of a request of the API schema generated by drf_yasg, as it was served, and served from the file
+    written by `generate_schema`, from memory and with a 304. Then the fastest startup of a process importing the
+    URLs and views, with and without the docs.
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'api-schema.json')
+    client = APIClient(HTTP_HOST='localhost')
+    url = reverse('api-schema')
+    view = schema.SchemaView.without_ui()
+    request = APIRequestFactory().get('/api-docs/swagger/', {'format': 'openapi'}, HTTP_HOST='localhost')
+
+    def median(function):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = function()
+            timings.append(time.perf_counter() - start)
+        assert response.status_code in (200, 304), response
+        return sorted(timings)[len(timings) // 2] * 1000
+
+    results = {'generated_milliseconds': median(lambda: view(request).render())}
+    with override_settings(DRONES_API_SCHEMA_FILE=path):
+        call_command('generate_schema', stdout=open(os.devnull, 'w'))
+        results['bytes'] = os.path.getsize(path)
+        results['file_milliseconds'] = median(lambda: client.get(url))
+        etag = client.get(url)['ETag']
+        results['not_modified_milliseconds'] = median(lambda: client.get(url, HTTP_IF_NONE_MATCH=etag))
+        os.remove(path)
+        results['memory_milliseconds'] = median(lambda: client.get(url))
+    os.rmdir(directory)
+
+    code = 'import django; django.setup(); import drones_musala.urls'
+    for docs in ('1', '0'):
+        environment = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'drones_musala.settings', 'DRONES_API_DOCS': docs}
+        timings = []
+        for _ in range(startups):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], env=environment, cwd=settings.BASE_DIR, check=True)
+            timings.append(time.perf_counter() - start)
+        results[f'startup_{"with" if docs == "1" else "without"}_docs_milliseconds'] = min(timings) * 1000
+    return results
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+# Version of the whole fleet, for the responses that depend on every drone (e.g. the available ones).
+FLEET_VERSION_KEY = 'drones:fleet:version'
+
+
+def drone_version_key(drone_id):
+    return f'drones:drone:{drone_id}:version'
+
+
+def get_versions(keys):
+    """
+    Return the current version of each of the `keys`. Responses are cached under the versions they were rendered with,
+    so bumping a version invalidates all of them at once, and the stale entries just expire.
+    """
+    versions = cache.get_many(keys) or {}
+    missing = _new_versions(keys, versions)
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(keys):
+    versions = await cache.aget_many(keys) or {}
+    missing = _new_versions(keys, versions)
+    if missing:
+        await cache.aset_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def _new_versions(keys, versions):
+    # A version lost by the cache must never go back to a value responses were cached under.
+    return {key: time.time_ns() for key in keys if key not in versions}
+
+
+def _bump_versions(keys):
+    cache.set_many(dict.fromkeys(keys, time.time_ns()), timeout=None)
+
+
+def invalidate_drones(drone_ids):
+    """
+    Invalidate the cached responses of the given drones and of the whole fleet.
+
+    Inside a transaction the versions are bumped again on commit, as concurrent requests may cache the rows they still
+    see until then.
+    """
+    keys = [FLEET_VERSION_KEY, *{drone_version_key(drone_id) for drone_id in drone_ids if drone_id is not None}]
+    _bump_versions(keys)
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _bump_versions(keys))
+
+
+def cached_response(request, scope, version_keys, render):
+    """
+    Return the data built by `render()` for the requested URL, cached until one of the `version_keys` is bumped, with an
+    ETag so clients polling it get an empty 304 response while it does not change.
+    """
+    key = _response_key(request, scope, get_versions(version_keys))
+    entry = cache.get(key)
+    if entry is None:
+        entry = _entry(render())
+        cache.set(key, entry, settings.DRONES_CACHE_TIMEOUT)
+    return _conditional_response(request, entry, request.accepted_renderer.format, Response)
+
+
+async def acached_response(request, scope, version_keys, render):
+    """
+    Like `cached_response()`, for the async views, which render JSON with an async `render()`. The entries are shared
+    with the sync views.
+    """
+    key = _response_key(request, scope, await aget_versions(version_keys))
+    entry = await cache.aget(key)
+    if entry is None:
+        entry = _entry(await render())
+        await cache.aset(key, entry, settings.DRONES_CACHE_TIMEOUT)
+    return _conditional_response(request, entry, 'json',
+                                 lambda data: JsonResponse(data, encoder=JSONEncoder, safe=False))
+
+
+def cached_drone_response(request, pk, scope, render):
+    """
+    Like `cached_response()`, for a response that only depends on the drone `pk`.
+    """
+    try:
+        drone_id = int(pk)
+    except (TypeError, ValueError):
+        # Not a drone id, so `render()` raises the not found error.
+        return Response(render())
+    return cached_response(request, scope, [drone_version_key(drone_id)], render)
+
+
+async def acached_drone_response(request, pk, scope, render):
+    return await acached_response(request, scope, [drone_version_key(pk)], render)
+
+
+def _response_key(request, scope, versions):
+    return 'drones:response:' + hashlib.md5(
+        json.dumps([scope, versions, request.build_absolute_uri()]).encode('utf-8')
+    ).hexdigest()
+
+
+def _entry(data):
+    return data, hashlib.md5(json.dumps(data, cls=JSONEncoder, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _conditional_response(request, entry, format, make_response):
+    data, digest = entry
+    etag = f'"{digest}-{format}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = make_response(data)
+    response['ETag'] = etag
+    return response
@@ -0,0 +1,115 @@
+"""
+Compression of the responses, negotiated with the Accept-Encoding header of the request: Brotli when the brotli package
+is installed, or gzip.
+
+Like Django's GZipMiddleware, which it replaces, it leaves out short responses, which fit in a packet anyway, and the
+ones already encoded, keeps the compressed content only if it is shorter, compresses streamed responses chunk by chunk,
+and makes the ETags weak, which the conditional requests of the cached views still match.
+"""
+import asyncio
+import re
+
+from django.utils.cache import patch_vary_headers
+from django.utils.decorators import sync_and_async_middleware
+from django.utils.text import compress_sequence, compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Responses shorter than this, in bytes, are sent as they are.
+MIN_SIZE = 1024
+# Brotli's default quality, 11, is meant for static files: it is many times slower than gzip for a few percent less.
+BROTLI_QUALITY = 5
+# The encodings in order of preference, when the client accepts several ones as much.
+ENCODINGS = ('br', 'gzip')
+
+_coding_re = re.compile(r'^\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([\d.]+))?\s*$')
+
+
+def accepted_encodings(header):
+    """
+    Return the quality value of each encoding of an Accept-Encoding `header`.
+    """
+    qualities = {}
+    for coding in header.split(','):
+        match = _coding_re.match(coding)
+        if match is None:
+            continue
+        try:
+            qualities[match[1].lower()] = float(match[2]) if match[2] else 1.0
+        except ValueError:
+            continue
+    return qualities
+
+
+def choose_encoding(header):
+    """
+    Return the encoding of the response to a request with the Accept-Encoding `header`, or None to send it as it is.
+    """
+    qualities = accepted_encodings(header)
+    available = [encoding for encoding in ENCODINGS if encoding != 'br' or brotli is not None]
+    quality, encoding = max(((qualities.get(encoding, qualities.get('*', 0)), encoding) for encoding in available),
+                            key=lambda option: (option[0], -ENCODINGS.index(option[1])))
+    return encoding if quality > 0 else None
+
+
+def compress_brotli_sequence(sequence):
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    for item in sequence:
+        # Flushed on every chunk, so a streamed response keeps streaming.
+        data = compressor.process(item) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+COMPRESSORS = {
+    'br': (lambda content: brotli.compress(content, quality=BROTLI_QUALITY), compress_brotli_sequence),
+    'gzip': (compress_string, compress_sequence),
+}
+
+
+def compress_response(request, response):
+    if not response.streaming and len(response.content) < MIN_SIZE:
+        return response
+    if response.has_header('Content-Encoding'):
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if encoding is None:
+        return response
+
+    compress, compress_chunks = COMPRESSORS[encoding]
+    if response.streaming:
+        # The compressed length is only known at the end.
+        response.streaming_content = compress_chunks(response.streaming_content)
+        del response['Content-Length']
+    else:
+        content = compress(response.content)
+        if len(content) >= len(response.content):
+            return response
+        response.content = content
+        response['Content-Length'] = str(len(content))
+
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+        response['ETag'] = 'W/' + etag
+    response['Content-Encoding'] = encoding
+    return response
+
+
+@sync_and_async_middleware
+def compression_middleware(get_response):
+    """
+    Compress the responses. Put it before any middleware that reads or changes the content of the responses.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            return compress_response(request, await get_response(request))
+    else:
+        def middleware(request):
+            return compress_response(request, get_response(request))
+
+    return middleware
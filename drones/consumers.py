@@ -0,0 +1,48 @@
+import asyncio
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
+
+from .events import FLEET_GROUP, drone_group
+from .models import Drone
+
+
+class DroneConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Stream the changes of the state, battery level and loaded medications of a drone, or of the whole fleet when no
+    drone is given.
+
+    Deltas received within DRONES_STREAM_COALESCE_SECONDS of each other are merged and sent together, with a single
+    delta per drone, as a {"type": "deltas", "drones": [...]} message.
+    """
+
+    async def connect(self):
+        drone_id = self.scope['url_route']['kwargs'].get('pk')
+        if drone_id is not None and not await database_sync_to_async(Drone.objects.filter(pk=drone_id).exists)():
+            await self.close()
+            return
+
+        self.group = FLEET_GROUP if drone_id is None else drone_group(drone_id)
+        self.pending = {}
+        self.flush_task = None
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        await self.accept()
+
+    async def disconnect(self, code):
+        if not hasattr(self, 'group'):
+            return
+        await self.channel_layer.group_discard(self.group, self.channel_name)
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+
+    async def drones_deltas(self, event):
+        for delta in event['deltas']:
+            self.pending.setdefault(delta['id'], {}).update(delta)
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        await asyncio.sleep(settings.DRONES_STREAM_COALESCE_SECONDS)
+        deltas, self.pending, self.flush_task = list(self.pending.values()), {}, None
+        await self.send_json({'type': 'deltas', 'drones': deltas})
@@ -0,0 +1,62 @@
+from bisect import bisect_left, insort
+
+# Maximum number of parameters bound in a single `IN (...)` lookup, safely below the SQLite limit.
+BATCH_SIZE = 500
+
+
+def batches(items, size=BATCH_SIZE):
+    """
+    Split a sequence into consecutive lists of at most `size` items.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def assignment_batches(assignments, size=BATCH_SIZE):
+    """
+    Split a dict of drone ids to medication ids into dicts carrying about `size` medications each, so every batch can
+    be written with a single UPDATE.
+    """
+    batch, count = {}, 0
+    for drone_id, medication_ids in assignments.items():
+        batch[drone_id] = medication_ids
+        count += len(medication_ids)
+        if count >= size:
+            yield batch
+            batch, count = {}, 0
+    if batch:
+        yield batch
+
+
+def pack_medications(medications, drones):
+    """
+    Pack medications onto drones using the best-fit decreasing heuristic: medications are placed from heaviest to
+    lightest, each one onto the drone whose remaining capacity is the smallest that can still carry it.
+
+    `medications` is an iterable of (medication id, weight) pairs and `drones` an iterable of (drone id, remaining
+    capacity) pairs. Return a dict mapping drone ids to the list of medication ids assigned to them, and the list of
+    medication ids that did not fit on any drone.
+
+    Remaining capacities are kept sorted, so each medication costs a binary search instead of a scan of the fleet.
+    """
+    bins = sorted((capacity, drone_id) for drone_id, capacity in drones if capacity > 0)
+    capacities = [capacity for capacity, drone_id in bins]
+    assignments = {}
+    unassigned = []
+
+    for medication_id, weight in sorted(medications, key=lambda medication: medication[1], reverse=True):
+        index = bisect_left(capacities, weight)
+        if index == len(capacities):
+            unassigned.append(medication_id)
+            continue
+
+        capacity, drone_id = bins.pop(index)
+        del capacities[index]
+        assignments.setdefault(drone_id, []).append(medication_id)
+
+        capacity -= weight
+        if capacity > 0:
+            insort(bins, (capacity, drone_id))
+            insort(capacities, capacity)
+
+    return assignments, unassigned
@@ -0,0 +1,25 @@
+"""
+The parts of drf_yasg that the views use to document themselves, or inert replacements when the API docs are disabled
+(DRONES_API_DOCS=0), so the processes that serve no docs never import drf_yasg.
+"""
+from django.conf import settings
+
+if settings.DRONES_API_DOCS:
+    from drf_yasg import openapi
+    from drf_yasg.utils import swagger_auto_schema
+else:
+    class _Inert:
+        """
+        Stands for `drf_yasg.openapi`: any of its attributes, or the result of calling them, is itself.
+        """
+
+        def __getattr__(self, name):
+            return self
+
+        def __call__(self, *args, **kwargs):
+            return self
+
+    openapi = _Inert()
+
+    def swagger_auto_schema(*args, **kwargs):
+        return lambda view: view
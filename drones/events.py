@@ -0,0 +1,47 @@
+import asyncio
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+logger = logging.getLogger('drones.events')
+
+# Group of the clients following the whole fleet.
+FLEET_GROUP = 'drones.fleet'
+
+
+def drone_group(drone_id):
+    """
+    Group of the clients following a single drone.
+    """
+    return f'drones.drone.{drone_id}'
+
+
+def publish_deltas(deltas):
+    """
+    Send the changes of some drones to the clients following them, once the current transaction commits. Each delta is
+    a dict with the `id` of a drone and the fields that changed.
+
+    The fleet group gets all the deltas in a single message, however many drones changed.
+    """
+    deltas = list(deltas)
+    if deltas:
+        transaction.on_commit(lambda: _send_deltas(deltas))
+
+
+def _send_deltas(deltas):
+    try:
+        async_to_sync(_group_send_deltas)(deltas)
+    except Exception:
+        # The changes are saved already, clients missing them must not fail the request that made them.
+        logger.exception('Could not publish the changes of %s drones', len(deltas))
+
+
+async def _group_send_deltas(deltas):
+    channel_layer = get_channel_layer()
+    await asyncio.gather(
+        channel_layer.group_send(FLEET_GROUP, {'type': 'drones.deltas', 'deltas': deltas}),
+        *(channel_layer.group_send(drone_group(delta['id']), {'type': 'drones.deltas', 'deltas': [delta]})
+          for delta in deltas)
+    )
@@ -0,0 +1,146 @@
+"""
+Streaming exports of the fleet and the medications, as NDJSON (a JSON object per line) or CSV.
+
+Rows are read with `values_list()` and `iterator()`, and turned into text without serializers, building every URL from
+a template made once per export, so memory stays constant and millions of rows stream at a steady pace.
+"""
+import csv
+import json
+
+from django.http import StreamingHttpResponse
+
+from drones.models import Drone, Medication
+from drones.representations import URLBuilder
+
+# Rows fetched from the database at a time.
+CHUNK_SIZE = 2000
+# Bytes of output gathered before handing them to the server, instead of writing every row on its own.
+BUFFER_SIZE = 64 * 1024
+
+DRONE_FIELDS = ('id', 'serial_number', 'model', 'weight_limit', 'battery_capacity', 'state', 'latitude', 'longitude')
+MEDICATION_FIELDS = ('id', 'name', 'weight', 'code', 'image', 'thumbnail', 'preview')
+# Keys of the exported records, in order.
+DRONE_COLUMNS = ('id', 'url', *DRONE_FIELDS[1:])
+MEDICATION_COLUMNS = ('id', 'url', *MEDICATION_FIELDS[1:])
+
+
+def iter_drones():
+    """
+    Yield the (drone row, loaded medication rows) of every drone, ordered by id. The medications come from a second
+    query ordered by drone, merged with the drones as both are read, so no drone waits in memory for its medications.
+    """
+    drones = Drone.objects.order_by('id').values_list(*DRONE_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+    medications = Medication.objects.filter(drone__isnull=False).order_by('drone', 'id') \
+        .values_list('drone', *MEDICATION_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+    medication = next(medications, None)
+    for drone in drones:
+        loaded = []
+        while medication is not None and medication[0] <= drone[0]:
+            if medication[0] == drone[0]:
+                loaded.append(medication[1:])
+            medication = next(medications, None)
+        yield drone, loaded
+
+
+def iter_medications():
+    return Medication.objects.order_by('id').values_list(*MEDICATION_FIELDS, 'drone').iterator(chunk_size=CHUNK_SIZE)
+
+
+def medication_record(urls, row):
+    pk, name, weight, code, image, thumbnail, preview = row
+    return {'id': pk, 'url': urls.detail('medication-detail', pk), 'name': name, 'weight': weight, 'code': code,
+            'image': urls.file(image), 'thumbnail': urls.file(thumbnail), 'preview': urls.file(preview)}
+
+
+def drone_record(urls, row):
+    return {'id': row[0], 'url': urls.detail('drone-detail', row[0]), **dict(zip(DRONE_FIELDS[1:], row[1:]))}
+
+
+def drones_ndjson(request):
+    urls = URLBuilder(request)
+    for drone, medications in iter_drones():
+        record = drone_record(urls, drone)
+        record['medication_set'] = [medication_record(urls, medication) for medication in medications]
+        yield record
+
+
+def drones_csv(request):
+    """
+    A row per drone and loaded medication, with the medication columns empty for drones with nothing loaded.
+    """
+    urls = URLBuilder(request)
+    yield [*DRONE_COLUMNS, *(f'medication_{column}' for column in MEDICATION_COLUMNS)]
+    empty = [None] * len(MEDICATION_COLUMNS)
+    for drone, medications in iter_drones():
+        drone_values = list(drone_record(urls, drone).values())
+        for medication in medications:
+            yield drone_values + list(medication_record(urls, medication).values())
+        if not medications:
+            yield drone_values + empty
+
+
+def medications_ndjson(request):
+    urls = URLBuilder(request)
+    for row in iter_medications():
+        yield {**medication_record(urls, row[:-1]), 'drone': row[-1]}
+
+
+def medications_csv(request):
+    urls = URLBuilder(request)
+    yield [*MEDICATION_COLUMNS, 'drone']
+    for row in iter_medications():
+        yield [*medication_record(urls, row[:-1]).values(), row[-1]]
+
+
+class _Echo:
+    """
+    File-like object returning what is written to it, to get the lines of a CSV writer one by one.
+    """
+
+    def write(self, value):
+        return value
+
+
+def ndjson_lines(records):
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    for record in records:
+        yield encoder.encode(record) + '\n'
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def buffered(lines, size=BUFFER_SIZE):
+    """
+    Join lines into chunks of about `size` characters.
+    """
+    chunk, length = [], 0
+    for line in lines:
+        chunk.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(chunk)
+            chunk, length = [], 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+# Content type and lines writer of each export type.
+EXPORT_TYPES = {
+    'ndjson': ('application/x-ndjson', ndjson_lines),
+    'csv': ('text/csv', csv_lines),
+}
+
+
+def streaming_response(name, export_type, rows):
+    """
+    Stream the `rows` (records for NDJSON, lists of values for CSV) as an attachment named `name`.
+    """
+    content_type, lines = EXPORT_TYPES[export_type]
+    response = StreamingHttpResponse(buffered(lines(rows)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{name}.{export_type}"'
+    return response
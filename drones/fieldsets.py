@@ -0,0 +1,81 @@
+"""
+Sparse fieldsets of the drone and medication responses.
+
+`?fields=id,state,battery_capacity` returns only the fields listed, and `?expand=medication_set` nests the medications
+of the drones in full, where listing `medication_set` in the fields gives only their ids. Without `fields` the
+responses keep every field, with the medications in full.
+
+The fields left out are not read either: the views select only the columns they need, and skip the query of the
+medications when they are not requested.
+"""
+from rest_framework import serializers
+
+
+class Fieldset:
+    """
+    The fields requested of a response, or all of them if `fields` is None, and the relations to `expand`.
+    """
+
+    def __init__(self, fields=None, expand=()):
+        self.fields = None if fields is None else frozenset(fields)
+        self.expand = frozenset(expand)
+
+    def includes(self, field):
+        return self.fields is None or field in self.fields or field in self.expand
+
+    def expands(self, field):
+        """
+        Whether the relation `field` is nested in full, instead of as a list of ids.
+        """
+        return self.fields is None or field in self.expand
+
+    def columns(self, names, required=()):
+        """
+        Return the `required` names and the ones of `names` included, in order and without repeating any.
+        """
+        return list(dict.fromkeys([*required, *(name for name in names if self.includes(name))]))
+
+
+ALL = Fieldset()
+
+
+class FieldsetQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of a fieldset, checked against the fields of the `serializer_class` of the context.
+    """
+    fields = serializers.CharField(required=False, help_text='Comma-separated fields to return, all of them by default.')
+    expand = serializers.CharField(required=False, help_text='Comma-separated relations to nest in full.')
+
+    def validate_fields(self, value):
+        return self._names(value, self.context['serializer_class'].Meta.fields, 'Unknown fields')
+
+    def validate_expand(self, value):
+        return self._names(value, getattr(self.context['serializer_class'].Meta, 'expandable_fields', ()),
+                           'Cannot expand')
+
+    def _names(self, value, allowed, message):
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise serializers.ValidationError(f'{message}: {", ".join(unknown)}.')
+        return names
+
+
+def only_columns(queryset, fieldset, required=('id',)):
+    """
+    Defer the columns of the fields left out of the `fieldset`, except the `required` ones.
+    """
+    if fieldset.fields is None:
+        return queryset
+    names = [field.name for field in queryset.model._meta.concrete_fields]
+    return queryset.only(*fieldset.columns(names, required))
+
+
+def get_fieldset(query_params, serializer_class):
+    """
+    Return the `Fieldset` requested in the `query_params` of a response of the `serializer_class`, raising a
+    ValidationError if it has unknown fields.
+    """
+    query = FieldsetQuerySerializer(data=query_params, context={'serializer_class': serializer_class})
+    query.is_valid(raise_exception=True)
+    return Fieldset(query.validated_data.get('fields'), query.validated_data.get('expand', ()))
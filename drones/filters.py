@@ -0,0 +1,187 @@
+"""
+Filtering and search of the medications list.
+
+Every filter is backed by an index, so lookups stay fast however many medications are stored:
+
+- `name` and `code` prefixes: a range over the B-tree index of the column on SQLite, whose LIKE ignores case and so
+  cannot use it, and LIKE over a `varchar_pattern_ops` index on PostgreSQL, whose ranges follow the collation.
+- `search`, the medications whose name or code contain a text, ignoring case: trigram GIN indexes on PostgreSQL, and an
+  FTS5 table with the trigram tokenizer on SQLite 3.34 or later, kept up to date by triggers. Older SQLite versions
+  have no trigram tokenizer, and search with a LIKE scan instead.
+- `min_weight` and `max_weight`: the weight index, and `loaded`: the index of the medications of each drone.
+
+The indexes that depend on the database are created by `install_search_indexes()` after every migration, as they
+cannot be declared on the model, and SQLite drops the triggers when a migration rebuilds the table.
+"""
+import sqlite3
+import sys
+
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.encoding import force_str
+from rest_framework import serializers
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.filters import BaseFilterBackend
+
+from drones.models import Medication
+
+SEARCH_TABLE = 'drones_medication_search'
+# Shorter texts have no trigram to look up.
+SEARCH_MIN_LENGTH = 3
+# The first SQLite version with the trigram tokenizer of FTS5.
+SQLITE_TRIGRAM_VERSION = (3, 34, 0)
+
+
+def sqlite_trigram_available():
+    return sqlite3.sqlite_version_info >= SQLITE_TRIGRAM_VERSION
+
+
+def _sqlite_search_statements(table):
+    return {
+        SEARCH_TABLE: f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(name, code, content='{table}', "
+                      f"content_rowid='id', tokenize='trigram')",
+        f'{SEARCH_TABLE}_insert': f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_insert AFTER INSERT ON {table} BEGIN '
+                                  f'INSERT INTO {SEARCH_TABLE}(rowid, name, code) VALUES (new.id, new.name, new.code); '
+                                  f'END',
+        f'{SEARCH_TABLE}_delete': f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_delete AFTER DELETE ON {table} BEGIN '
+                                  f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name, code) "
+                                  f"VALUES ('delete', old.id, old.name, old.code); END",
+        # Only when the name or code change, not when the medication is loaded or unloaded.
+        f'{SEARCH_TABLE}_update': f'CREATE TRIGGER IF NOT EXISTS {SEARCH_TABLE}_update AFTER UPDATE OF name, code ON '
+                                  f'{table} BEGIN '
+                                  f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}, rowid, name, code) "
+                                  f"VALUES ('delete', old.id, old.name, old.code); "
+                                  f'INSERT INTO {SEARCH_TABLE}(rowid, name, code) VALUES (new.id, new.name, new.code); '
+                                  f'END',
+    }
+
+
+def _postgresql_search_statements(table):
+    return [
+        'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+        f'CREATE INDEX IF NOT EXISTS medication_name_trgm_idx ON {table} USING gin (name gin_trgm_ops)',
+        f'CREATE INDEX IF NOT EXISTS medication_code_trgm_idx ON {table} USING gin (code gin_trgm_ops)',
+        f'CREATE INDEX IF NOT EXISTS medication_name_pattern_idx ON {table} (name varchar_pattern_ops)',
+        f'CREATE INDEX IF NOT EXISTS medication_code_pattern_idx ON {table} (code varchar_pattern_ops)',
+    ]
+
+
+def install_search_indexes(using='default'):
+    """
+    Create the indexes of the filters that depend on the database, if missing. On SQLite the search table is filled
+    again when it or any of its triggers was missing, as the medications may have changed meanwhile, and skipped
+    without the trigram tokenizer.
+    """
+    connection = connections[using]
+    table = Medication._meta.db_table
+    if connection.vendor == 'sqlite' and not sqlite_trigram_available():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            statements = _sqlite_search_statements(table)
+            cursor.execute(f'SELECT name FROM sqlite_master WHERE name IN ({", ".join(["%s"] * len(statements))})',
+                           list(statements))
+            existing = {name for name, in cursor.fetchall()}
+            if existing != set(statements):
+                for statement in statements.values():
+                    cursor.execute(statement)
+                cursor.execute(f"INSERT INTO {SEARCH_TABLE}({SEARCH_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'postgresql':
+            for statement in _postgresql_search_statements(table):
+                cursor.execute(statement)
+
+
+def prefix_condition(vendor, field, prefix):
+    """
+    Condition of the values of `field` starting with `prefix`, matching case, that the index of the field can seek.
+    """
+    if vendor == 'sqlite':
+        # With the binary collation of SQLite, the values starting with a prefix are the ones between the prefix and
+        # the prefix with its last character incremented.
+        upper = _next_prefix(prefix)
+        if upper is None:
+            return Q(**{f'{field}__gte': prefix})
+        return Q(**{f'{field}__gte': prefix, f'{field}__lt': upper})
+    return Q(**{f'{field}__startswith': prefix})
+
+
+def _next_prefix(prefix):
+    """
+    Return the first string after every string starting with `prefix`, or None if there is none: the last character
+    that is not the highest code point, incremented past the surrogates, which cannot be stored.
+    """
+    prefix = prefix.rstrip(chr(sys.maxunicode))
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        code = 0xE000
+    return prefix[:-1] + chr(code)
+
+
+def search_condition(vendor, text):
+    """
+    Condition of the medications whose name or code contain `text`, ignoring case.
+    """
+    if vendor == 'sqlite' and sqlite_trigram_available():
+        # A quoted FTS5 string, matched as a substring by the trigram tokenizer.
+        query = '"{}"'.format(text.replace('"', '""'))
+        return Q(id__in=RawSQL(f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [query]))
+    return Q(name__icontains=text) | Q(code__icontains=text)
+
+
+class MedicationFilterSerializer(serializers.Serializer):
+    search = serializers.CharField(required=False, min_length=SEARCH_MIN_LENGTH, max_length=100,
+                                   help_text='Text the name or code contain, ignoring case.')
+    name = serializers.CharField(required=False, max_length=100, help_text='Prefix of the name, matching case.')
+    code = serializers.CharField(required=False, max_length=100, help_text='Prefix of the code, matching case.')
+    min_weight = serializers.FloatField(required=False, min_value=0, help_text='Minimum weight, in grams.')
+    max_weight = serializers.FloatField(required=False, min_value=0, help_text='Maximum weight, in grams.')
+    loaded = serializers.BooleanField(required=False, allow_null=True, default=None,
+                                      help_text='Whether the medications are loaded on a drone.')
+
+    def validate(self, data):
+        if data.get('min_weight', 0) > data.get('max_weight', float('inf')):
+            raise serializers.ValidationError({'min_weight': 'The minimum weight must not be above the maximum.'})
+        return data
+
+
+class MedicationFilter(BaseFilterBackend):
+    """
+    Filter the medications list with the query parameters of `MedicationFilterSerializer`, answering 400 to invalid
+    ones.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        if view.action != 'list':
+            return queryset
+        query = MedicationFilterSerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        data = query.validated_data
+        vendor = connections[queryset.db].vendor
+
+        condition = Q()
+        for field in ('name', 'code'):
+            if field in data:
+                condition &= prefix_condition(vendor, field, data[field])
+        if 'search' in data:
+            condition &= search_condition(vendor, data['search'])
+        if 'min_weight' in data:
+            condition &= Q(weight__gte=data['min_weight'])
+        if 'max_weight' in data:
+            condition &= Q(weight__lte=data['max_weight'])
+        if data['loaded'] is not None:
+            condition &= Q(drone__isnull=not data['loaded'])
+        return queryset.filter(condition)
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, 'coreapi must be installed to use `get_schema_fields()`'
+        assert coreschema is not None, 'coreschema must be installed to use `get_schema_fields()`'
+        schemas = {serializers.CharField: coreschema.String, serializers.FloatField: coreschema.Number,
+                   serializers.BooleanField: coreschema.Boolean}
+        return [
+            coreapi.Field(name=name, required=False, location='query',
+                          schema=schemas[type(field)](description=force_str(field.help_text)))
+            for name, field in MedicationFilterSerializer().fields.items()
+        ]
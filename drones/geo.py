@@ -0,0 +1,81 @@
+"""
+Geometry of the drone positions: a grid over the earth to index them, and distances.
+
+The grid splits latitudes and longitudes in cells of `CELL_DEGREES` (about 1.1 km north to south), numbered row by row
+from the south-west corner, so the cells of a row of a square around a position are a range of numbers. Looking up the
+drones near a position reads the cells of growing squares around it, through the B-tree index of the cell of the
+drones, which needs no GIS extension of the database.
+"""
+import math
+
+EARTH_RADIUS = 6371008.8  # Mean radius, in meters.
+CELL_DEGREES = 0.01
+ROWS = 18000
+COLUMNS = 36000
+# Half the side, in cells, of the squares searched in turn around a position. Beyond the last one, the search reads
+# every drone left, which only happens when fewer drones than requested are within about 70 km.
+SEARCH_RADII = (0, 1, 2, 4, 8, 16, 32, 64)
+
+
+def cell(latitude, longitude):
+    """
+    Return the number of the cell containing the position.
+    """
+    row = min(int((latitude + 90) / CELL_DEGREES), ROWS - 1)
+    column = int((longitude + 180) / CELL_DEGREES) % COLUMNS
+    return row * COLUMNS + column
+
+
+def ring_ranges(center, inner, outer):
+    """
+    Return the cells of the square of `outer` cells around the `center` cell that are out of the square of `inner`
+    cells (-1 for none), as (first, last) ranges of cell numbers. The squares wrap around the antimeridian, and stop at
+    the poles.
+    """
+    row, column = divmod(center, COLUMNS)
+    ranges = []
+    for square_row in range(max(row - outer, 0), min(row + outer, ROWS - 1) + 1):
+        if abs(square_row - row) > inner:
+            segments = [(column - outer, column + outer)]
+        else:
+            segments = [(column - outer, column - inner - 1), (column + inner + 1, column + outer)]
+        for first, last in segments:
+            ranges.extend(_row_ranges(square_row, first, last))
+    return ranges
+
+
+def _row_ranges(row, first, last):
+    start = row * COLUMNS
+    if last - first + 1 >= COLUMNS:
+        return [(start, start + COLUMNS - 1)]
+    first, last = first % COLUMNS, last % COLUMNS
+    if first <= last:
+        return [(start + first, start + last)]
+    return [(start + first, start + COLUMNS - 1), (start, start + last)]
+
+
+def distance(latitude1, longitude1, latitude2, longitude2):
+    """
+    Return the great-circle distance between two positions, in meters.
+    """
+    phi1, phi2 = math.radians(latitude1), math.radians(latitude2)
+    half_dphi = (phi2 - phi1) / 2
+    half_dlambda = math.radians(longitude2 - longitude1) / 2
+    a = math.sin(half_dphi) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(half_dlambda) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(math.sqrt(a), 1))
+
+
+def covered_distance(latitude, outer):
+    """
+    Return the distance from a position at `latitude` within which every position is in the square of `outer` cells
+    around its cell: the distance to the nearest side of the square.
+
+    Each side is at least `outer` cells away. The north and south sides are parallels, and any position beyond them is
+    that many degrees of latitude away. The east and west sides are meridians, great circles, so the distance to them
+    is the cross-track distance.
+    """
+    reach = math.radians(outer * CELL_DEGREES)
+    if reach >= math.pi / 2:
+        return EARTH_RADIUS * math.pi / 2
+    return min(EARTH_RADIUS * reach,
+               EARTH_RADIUS * math.asin(math.cos(math.radians(latitude)) * math.sin(reach)))
@@ -0,0 +1,34 @@
+def downsample(points, start, end, buckets):
+    """
+    Merge battery level points into `buckets` buckets of the same duration between `start` and `end`.
+
+    `points` is an iterable of (time, min level, max level, average level, samples) tuples, so raw snapshots (a single
+    sample) and hourly rollups can be merged alike. Return the non-empty buckets in order, each as a dict with its
+    time range and the min, average and max levels of its samples.
+    """
+    width = (end - start) / buckets
+    merged = {}
+    for time, min_level, max_level, avg_level, samples in points:
+        index = int((time - start) / width)
+        if not 0 <= index < buckets:
+            continue
+        bucket = merged.get(index)
+        if bucket is None:
+            merged[index] = [min_level, max_level, avg_level * samples, samples]
+        else:
+            bucket[0] = min(bucket[0], min_level)
+            bucket[1] = max(bucket[1], max_level)
+            bucket[2] += avg_level * samples
+            bucket[3] += samples
+
+    return [
+        {
+            'start': start + width * index,
+            'end': start + width * (index + 1),
+            'min': min_level,
+            'avg': round(total / samples, 2),
+            'max': max_level,
+            'samples': samples,
+        }
+        for index, (min_level, max_level, total, samples) in sorted(merged.items())
+    ]
@@ -0,0 +1,33 @@
+import io
+import os
+
+from django.core.files.base import ContentFile
+from PIL import Image
+
+DERIVATIVE_FORMAT = 'WEBP'
+DERIVATIVE_QUALITY = 80
+
+
+def render_derivatives(file, sizes):
+    """
+    Render resized and recompressed WebP copies of an image file.
+
+    `sizes` maps a name to the (width, height) box the copy must fit in, keeping its aspect ratio. Return a dict
+    mapping the same names to ContentFile objects.
+    """
+    base_name = os.path.splitext(os.path.basename(file.name))[0]
+    derivatives = {}
+
+    with Image.open(file) as image:
+        # Let JPEG decoding downscale on the fly to the biggest size needed, instead of decoding the whole picture.
+        image.draft('RGB', max(sizes.values()))
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+        for name, size in sizes.items():
+            derivative = image.copy()
+            derivative.thumbnail(size, Image.LANCZOS)
+            buffer = io.BytesIO()
+            derivative.save(buffer, format=DERIVATIVE_FORMAT, quality=DERIVATIVE_QUALITY, method=4)
+            derivatives[name] = ContentFile(buffer.getvalue(), name=f'{base_name}_{name}.webp')
+
+    return derivatives
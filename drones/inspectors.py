@@ -0,0 +1,26 @@
+from collections import OrderedDict
+
+from drf_yasg import openapi
+from drf_yasg.inspectors import PaginatorInspector
+
+from drones.pagination import KeysetPagination
+
+
+class KeysetPaginationInspector(PaginatorInspector):
+    """
+    Document the paginated responses of KeysetPagination, which have no count.
+    """
+
+    def get_paginated_response(self, paginator, response_schema):
+        if not isinstance(paginator, KeysetPagination):
+            return None
+
+        return openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties=OrderedDict((
+                ('next', openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_URI, x_nullable=True)),
+                ('previous', openapi.Schema(type=openapi.TYPE_STRING, format=openapi.FORMAT_URI, x_nullable=True)),
+                ('results', response_schema),
+            )),
+            required=['results']
+        )
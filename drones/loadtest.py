@@ -0,0 +1,138 @@
+"""
+Load test of the API served with WSGI (Django's threaded server, the one `runserver` uses with `wsgi.py`) and with ASGI
+(daphne, with the async views enabled).
+
+Run it with `python manage.py loadtest`. Each mode gets its own server process, hit by many concurrent keep-alive
+clients until a number of requests is done.
+"""
+import asyncio
+import itertools
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+WSGI_SERVER = (
+    'import sys\n'
+    'from django.core.servers.basehttp import run\n'
+    'from django.core.wsgi import get_wsgi_application\n'
+    'run(sys.argv[1], int(sys.argv[2]), get_wsgi_application(), threading=True)\n'
+)
+
+# Command and extra environment of the server of each mode, given the host and port to listen on.
+SERVERS = {
+    'wsgi': (lambda host, port: [sys.executable, '-c', WSGI_SERVER, host, str(port)], {}),
+    'asgi': (lambda host, port: [sys.executable, '-m', 'daphne', '-b', host, '-p', str(port),
+                                 'drones_musala.asgi:application'], {'DRONES_ASYNC_VIEWS': '1'}),
+}
+
+REQUEST_TIMEOUT = 30
+
+
+class Server:
+    """
+    Context manager running the server of a mode in a subprocess until exit.
+    """
+
+    def __init__(self, mode, host, port):
+        command, environment = SERVERS[mode]
+        self.command = command(host, port)
+        self.environment = {**os.environ, **environment}
+        self.address = (host, port)
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.command, env=self.environment, stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                socket.create_connection(self.address, timeout=1).close()
+                return self
+            except OSError:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.__exit__()
+                    raise RuntimeError(f'The server did not start: {" ".join(self.command)}')
+                time.sleep(0.1)
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+async def _get(reader, writer, host, path):
+    """
+    Send a GET request over an open connection and read the response. Return its status and whether the connection can
+    be reused.
+    """
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept: application/json\r\n\r\n'.encode('ascii'))
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    status_line, *header_lines = head.decode('latin1').split('\r\n')
+    headers = dict(line.lower().split(': ', 1) for line in header_lines if ': ' in line)
+
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+        keep_alive = headers.get('connection') != 'close'
+    else:
+        await reader.read()
+        keep_alive = False
+    return int(status_line.split(' ', 2)[1]), keep_alive
+
+
+async def _client(host, port, paths, remaining, latencies, errors):
+    reader = writer = None
+    while next(remaining) > 0:
+        path = next(paths)
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            status, keep_alive = await asyncio.wait_for(_get(reader, writer, host, path), REQUEST_TIMEOUT)
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ValueError):
+            errors.append(path)
+            keep_alive = False
+        else:
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(path)
+        if not keep_alive and writer is not None:
+            writer.close()
+            reader = writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def _load(host, port, paths, clients, requests):
+    # A shared countdown, so the clients stop once the requests are done whatever their speed.
+    remaining = itertools.count(requests, -1)
+    paths = itertools.cycle(paths)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, paths, remaining, latencies, errors) for _ in range(clients)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def run(mode, paths, clients=1000, requests=20000, host='127.0.0.1', port=8765):
+    """
+    Serve the API in `mode` ('wsgi' or 'asgi') and GET the `paths` in turns with `clients` concurrent clients until
+    `requests` requests are done. Return a dict with the throughput and latency percentiles.
+    """
+    with Server(mode, host, port):
+        latencies, errors, seconds = asyncio.run(_load(host, port, paths, clients, requests))
+
+    percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+    return {
+        'requests': requests,
+        'clients': clients,
+        'errors': len(errors),
+        'seconds': seconds,
+        'requests_per_second': requests / seconds,
+        'p50_ms': percentiles[49] * 1000,
+        'p99_ms': percentiles[98] * 1000,
+    }
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from drones.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Run the performance benchmarks against a throwaway test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help=f'Benchmarks to run, all by default: {", ".join(BENCHMARKS)}.')
+        parser.add_argument('--repeat', type=int, default=1, help='Number of times to run each benchmark.')
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise CommandError(f'Unknown benchmarks: {", ".join(sorted(unknown))}.')
+
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            for name in names:
+                for _ in range(options['repeat']):
+                    results = BENCHMARKS[name]()
+                    measurements = ' '.join(f'{key}={value:.4f}' if isinstance(value, float) else f'{key}={value}'
+                                            for key, value in results.items())
+                    self.stdout.write(f'{name}: {measurements}')
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
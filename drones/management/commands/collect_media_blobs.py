@@ -0,0 +1,90 @@
+import os
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from drones.dispatch import batches
+from drones.models import MediaBlob
+from drones.storage import get_medication_pictures_storage
+
+
+class Command(BaseCommand):
+    help = 'Delete the content addressed medication pictures no medication points to, and report the dedup ratio.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=3600,
+                            help='Seconds a file must have been unreferenced before deleting it, so uploads in '
+                                 'progress reusing it are not affected. Defaults to an hour.')
+        parser.add_argument('--orphans', action='store_true',
+                            help='Also delete files in storage that are not tracked at all, e.g. left by interrupted '
+                                 'tasks.')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted without deleting.')
+
+    def handle(self, *args, **options):
+        storage = get_medication_pictures_storage()
+        grace = timedelta(seconds=options['grace'])
+        dry_run = options['dry_run']
+
+        deleted, freed = 0, 0
+        released = MediaBlob.objects.filter(references__lte=0, updated_at__lt=timezone.now() - grace)
+        for blob in released.only('id', 'name', 'size').iterator(chunk_size=500):
+            if not dry_run and not self.delete_blob(storage, released, blob):
+                continue
+            deleted += 1
+            freed += blob.size
+
+        if options['orphans']:
+            modified_before = time.time() - grace.total_seconds()
+            for name in self.find_orphans(storage, modified_before):
+                try:
+                    # Unless an upload reused it meanwhile.
+                    if os.path.getmtime(storage.path(name)) >= modified_before:
+                        continue
+                    freed += storage.size(name)
+                except FileNotFoundError:
+                    continue
+                if not dry_run:
+                    storage.delete(name)
+                deleted += 1
+
+        action = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(f'{action} {deleted} unreferenced files, freeing {freed} bytes.'))
+        stats = MediaBlob.objects.stats()
+        self.stdout.write(f"Stored files: {stats['blobs']} ({stats['stored_bytes']} bytes), references: "
+                          f"{stats['references']} ({stats['referenced_bytes']} bytes), "
+                          f"dedup ratio: {stats['dedup_ratio']:.2f}")
+
+    def delete_blob(self, storage, released, blob):
+        """
+        Delete the `blob` and its file if it is still `released`. Return whether it was.
+        """
+        with transaction.atomic():
+            # Locked until the file is deleted, so an upload reusing the file (see ContentAddressedStorage.reuse())
+            # either marks it as used before, and it is kept, or finds it deleted after, and stores it again.
+            if not released.select_for_update().filter(pk=blob.pk).exists():
+                return False
+            MediaBlob.objects.filter(pk=blob.pk).delete()
+            storage.delete(blob.name)
+        return True
+
+    def find_orphans(self, storage, modified_before):
+        """
+        Return the names of the files in the content addressed storage that are not tracked, modified before the
+        given timestamp.
+        """
+        root = storage.path(storage.prefix)
+        candidates = []
+        for directory, _, files in os.walk(root):
+            for file in files:
+                path = os.path.join(directory, file)
+                if os.path.getmtime(path) < modified_before:
+                    candidates.append(os.path.relpath(path, storage.location).replace(os.sep, '/'))
+
+        orphans = []
+        for names in batches(candidates):
+            tracked = set(MediaBlob.objects.filter(name__in=names).values_list('name', flat=True))
+            orphans += [name for name in names if name not in tracked]
+        return orphans
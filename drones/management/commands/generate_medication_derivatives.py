@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from drones.models import Medication
+from drones.tasks import generate_medication_derivatives
+
+
+class Command(BaseCommand):
+    help = 'Generate the resized copies of the medication images that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Generate the derivatives of every medication image, even if they already exist.')
+        parser.add_argument('--async', action='store_true', dest='run_async',
+                            help='Enqueue a Celery task per medication instead of generating them right away.')
+
+    def handle(self, *args, **options):
+        medications = Medication.objects.exclude(image='')
+        if not options['force']:
+            missing = Q()
+            for field in Medication.DERIVATIVE_SIZES:
+                missing |= Q(**{field: ''})
+            medications = medications.filter(missing)
+
+        count = 0
+        for medication_id in medications.values_list('id', flat=True).iterator(chunk_size=500):
+            if options['run_async']:
+                generate_medication_derivatives.delay(medication_id)
+            else:
+                generate_medication_derivatives(medication_id)
+            count += 1
+
+        action = 'Enqueued' if options['run_async'] else 'Generated'
+        self.stdout.write(self.style.SUCCESS(f'{action} derivatives of {count} medication images.'))
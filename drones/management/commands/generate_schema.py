@@ -0,0 +1,27 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from drones import schema
+
+
+class Command(BaseCommand):
+    help = ('Generate the OpenAPI schema of the API and write it to the file the docs serve it from. Run it at build '
+            'time, and again whenever the API changes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.DRONES_API_SCHEMA_FILE,
+                            help='File to write, DRONES_API_SCHEMA_FILE by default.')
+
+    def handle(self, *args, **options):
+        if not settings.DRONES_API_DOCS:
+            raise CommandError('The API docs are disabled, set DRONES_API_DOCS=1 to generate their schema.')
+        content = schema.generate_schema()
+        # Written aside and moved in place, so running processes never read a partial file.
+        path = str(options['output'])
+        partial = f'{path}.partial'
+        with open(partial, 'wb') as file:
+            file.write(content)
+        os.replace(partial, path)
+        self.stdout.write(f'Wrote the API schema to {path} ({len(content)} bytes).')
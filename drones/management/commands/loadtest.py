@@ -0,0 +1,46 @@
+import resource
+
+from django.core.management.base import BaseCommand, CommandError
+
+from drones import loadtest
+from drones.models import Drone
+
+
+class Command(BaseCommand):
+    help = ('Compare the latency and throughput of the read-heavy endpoints served with WSGI and with ASGI (async '
+            'views), under many concurrent clients. Uses the configured database, which must have some drones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('modes', nargs='*',
+                            help=f'Serving modes to test, all by default: {", ".join(loadtest.SERVERS)}.')
+        parser.add_argument('--clients', type=int, default=1000, help='Number of concurrent clients.')
+        parser.add_argument('--requests', type=int, default=20000, help='Number of requests per mode.')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Path to GET, with "{id}" replaced by drone ids. Can be given several times, by '
+                                 'default the drone detail and its battery level.')
+        parser.add_argument('--port', type=int, default=8765, help='Port the servers listen on.')
+
+    def handle(self, *args, **options):
+        modes = options['modes'] or list(loadtest.SERVERS)
+        unknown = set(modes) - set(loadtest.SERVERS)
+        if unknown:
+            raise CommandError(f'Unknown modes: {", ".join(sorted(unknown))}.')
+
+        templates = options['paths'] or ['/drones/{id}/', '/drones/{id}/check_battery_level/']
+        drone_ids = list(Drone.objects.values_list('id', flat=True)[:1000])
+        if not drone_ids and any('{id}' in template for template in templates):
+            raise CommandError('There are no drones to request, create some first.')
+        paths = [template.format(id=drone_id) for drone_id in drone_ids or [None] for template in templates]
+
+        # Every client and the server connection it talks to take a file descriptor.
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = 2 * options['clients'] + 256
+        if soft != resource.RLIM_INFINITY and soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+        for mode in modes:
+            results = loadtest.run(mode, paths, clients=options['clients'], requests=options['requests'],
+                                   port=options['port'])
+            measurements = ' '.join(f'{key}={value:.2f}' if isinstance(value, float) else f'{key}={value}'
+                                    for key, value in results.items())
+            self.stdout.write(f'{mode}: {measurements}')
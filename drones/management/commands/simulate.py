@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from drones import simulation
+
+
+class Command(BaseCommand):
+    help = ('Run the simulation of the fleet: drones deliver their medications, drain their battery while flying and '
+            'charge it while idle. It changes the drones of the database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ticks', type=int, default=0, help='Number of ticks to run, until stopped by default.')
+        parser.add_argument('--interval', type=float, default=settings.DRONES_SIMULATION_TICK_SECONDS,
+                            help='Seconds between the start of two ticks.')
+
+    def handle(self, *args, **options):
+        count = 0
+        while not options['ticks'] or count < options['ticks']:
+            start = time.perf_counter()
+            result = simulation.tick()
+            seconds = time.perf_counter() - start
+            count += 1
+            self.stdout.write(f'tick {count}: drones={result["drones"]} '
+                              f'delivered_medications={result["delivered_medications"]} seconds={seconds:.3f}')
+            if not options['ticks'] or count < options['ticks']:
+                time.sleep(max(options['interval'] - seconds, 0))
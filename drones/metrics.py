@@ -0,0 +1,249 @@
+"""
+Instrumentation of the requests, exposed in the Prometheus text format at /metrics/.
+
+For each view and action (e.g. `DroneViewSet.load_with_medication`) it records histograms of the wall time, the number
+and time of the database queries, the time spent serializing and rendering the response, and the size of the response.
+Requests slower than the DRONES_SLOW_REQUEST_SECONDS setting are logged with their SQL.
+
+The measurements of a request are gathered in a `RequestMetrics` kept in a context variable, which `sync_to_async`
+passes on to the threads running the queries of async views. The queries are timed by an execute wrapper installed on
+every database connection, which does nothing outside of requests. The metrics are kept in the memory of each process:
+with several worker processes, scrape each one, e.g. through a label of its port.
+"""
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+logger = logging.getLogger('drones.metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# The most queries kept per request to log slow requests, so a request running many queries takes bounded memory.
+MAX_LOGGED_QUERIES = 50
+
+_current = ContextVar('drones_request_metrics', default=None)
+
+
+class Histogram:
+    """
+    A Prometheus histogram, with a series per value of the `labels`. Observing a value takes a lock, shared by the
+    threads of the process.
+    """
+
+    def __init__(self, name, documentation, buckets, labels=('view',)):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        with self.lock:
+            series = [(label_values, list(counts), total, count)
+                      for label_values, (counts, total, count) in sorted(self.series.items())]
+        for label_values, counts, total, count in series:
+            labels = _format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound}"}} {cumulative}'
+            yield f'{self.name}_sum{{{labels}}} {total}'
+            yield f'{self.name}_count{{{labels}}} {count}'
+
+
+class Counter:
+    """
+    A Prometheus counter, with a series per value of the `labels`.
+    """
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + 1
+
+    def collect(self):
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        with self.lock:
+            series = sorted(self.series.items())
+        for label_values, count in series:
+            yield f'{self.name}{{{_format_labels(self.labels, label_values)}}} {count}'
+
+
+def _format_labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REQUESTS = Counter('drones_requests_total', 'Requests served, by view and status code.', ('view', 'status'))
+REQUEST_SECONDS = Histogram('drones_request_duration_seconds', 'Wall time of the requests, until the response is '
+                            'rendered (the first chunk, for streamed responses).', SECONDS_BUCKETS)
+DB_QUERIES = Histogram('drones_request_db_queries', 'Database queries run by the requests.',
+                       (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144))
+DB_SECONDS = Histogram('drones_request_db_duration_seconds', 'Time spent running database queries by the requests.',
+                       SECONDS_BUCKETS)
+SERIALIZATION_SECONDS = Histogram('drones_request_serialization_duration_seconds',
+                                  'Time spent serializing and rendering the responses.', SECONDS_BUCKETS)
+RESPONSE_BYTES = Histogram('drones_response_size_bytes', 'Size of the response bodies as sent, compressed if they are, '
+                           'except for streamed responses.',
+                           (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216))
+
+METRICS = (REQUESTS, REQUEST_SECONDS, DB_QUERIES, DB_SECONDS, SERIALIZATION_SECONDS, RESPONSE_BYTES)
+
+
+def render():
+    """
+    Return all the metrics in the Prometheus text format.
+    """
+    return ''.join(f'{line}\n' for metric in METRICS for line in metric.collect())
+
+
+class RequestMetrics:
+    """
+    Measurements of a request in progress.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.queries = []
+        self.serialization_seconds = 0.0
+        self.serializing = False
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """
+    Execute wrapper timing the queries run during a request.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.db_queries += 1
+        metrics.db_seconds += seconds
+        if len(metrics.queries) < MAX_LOGGED_QUERIES:
+            metrics.queries.append((sql, seconds))
+
+
+def install_query_wrapper(connection):
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, query_wrapper)
+
+
+@contextmanager
+def serialization():
+    """
+    Count the time spent in the block as serialization time of the current request. Nested blocks, e.g. the
+    serializers of the medications of a drone, are counted once.
+    """
+    metrics = _current.get()
+    if metrics is None or metrics.serializing:
+        yield
+        return
+    metrics.serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialization_seconds += time.perf_counter() - start
+        metrics.serializing = False
+
+
+def view_label(request):
+    """
+    Name of the view that served the `request`, with the action for viewsets, e.g. `DroneViewSet.list`.
+    """
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    actions = getattr(match.func, 'actions', None)
+    if actions is not None:
+        return f'{match.func.cls.__name__}.{actions.get(request.method.lower(), request.method.lower())}'
+    view_class = getattr(match.func, 'view_class', None)
+    if view_class is not None:
+        return view_class.__name__
+    return match.view_name or f'{match.func.__module__}.{match.func.__qualname__}'
+
+
+def record(request, response, metrics):
+    seconds = time.perf_counter() - metrics.start
+    view = view_label(request)
+    REQUESTS.inc(view, response.status_code)
+    REQUEST_SECONDS.observe(seconds, view)
+    DB_QUERIES.observe(metrics.db_queries, view)
+    DB_SECONDS.observe(metrics.db_seconds, view)
+    SERIALIZATION_SECONDS.observe(metrics.serialization_seconds, view)
+    if not response.streaming:
+        RESPONSE_BYTES.observe(len(response.content), view)
+
+    if seconds >= settings.DRONES_SLOW_REQUEST_SECONDS:
+        queries = ''.join(f'\n  {query_seconds:.4f}s {sql}' for sql, query_seconds in metrics.queries)
+        if metrics.db_queries > len(metrics.queries):
+            queries += f'\n  ... and {metrics.db_queries - len(metrics.queries)} more'
+        logger.warning('Slow request %s %s (%s): %.3fs, %s queries in %.3fs, serialization %.3fs%s',
+                       request.method, request.get_full_path(), view, seconds, metrics.db_queries,
+                       metrics.db_seconds, metrics.serialization_seconds, queries)
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """
+    Measure the requests. Put it first in MIDDLEWARE to measure the rest of the middleware too.
+    """
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request):
+            metrics = RequestMetrics()
+            token = _current.set(metrics)
+            try:
+                response = await get_response(request)
+            finally:
+                _current.reset(token)
+            record(request, response, metrics)
+            return response
+    else:
+        def middleware(request):
+            metrics = RequestMetrics()
+            token = _current.set(metrics)
+            try:
+                response = get_response(request)
+            finally:
+                _current.reset(token)
+            record(request, response, metrics)
+            return response
+
+    return middleware
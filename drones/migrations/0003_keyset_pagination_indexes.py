@@ -0,0 +1,29 @@
+# Generated by Django 4.1.2 on 2026-10-18 08:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0002_alter_medication_options_alter_drone_serial_number_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='drone',
+            options={'ordering': ['-battery_capacity', 'id']},
+        ),
+        migrations.AlterModelOptions(
+            name='medication',
+            options={'ordering': ['name', 'id']},
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(fields=['-battery_capacity', 'id'], name='drone_battery_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medication',
+            index=models.Index(fields=['name', 'id'], name='medication_name_id_idx'),
+        ),
+    ]
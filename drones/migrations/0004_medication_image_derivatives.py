@@ -0,0 +1,23 @@
+# Generated by Django 4.1.2 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0003_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medication',
+            name='preview',
+            field=models.ImageField(blank=True, editable=False, upload_to='medication_pictures/derivatives/%Y/%m/%d/'),
+        ),
+        migrations.AddField(
+            model_name='medication',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='medication_pictures/derivatives/%Y/%m/%d/'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.2 on 2026-10-18 08:13
+
+from django.db import migrations, models
+import django.utils.timezone
+import drones.storage
+import drones.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0004_medication_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('references', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='medication',
+            name='image',
+            field=models.ImageField(max_length=255, storage=drones.storage.get_medication_pictures_storage, upload_to='medication_pictures/%Y/%m/%d/', validators=[drones.validators.size_validator]),
+        ),
+        migrations.AlterField(
+            model_name='medication',
+            name='preview',
+            field=models.ImageField(blank=True, editable=False, max_length=255, storage=drones.storage.get_medication_pictures_storage, upload_to='medication_pictures/derivatives/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='medication',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, max_length=255, storage=drones.storage.get_medication_pictures_storage, upload_to='medication_pictures/derivatives/%Y/%m/%d/'),
+        ),
+        migrations.AddIndex(
+            model_name='mediablob',
+            index=models.Index(fields=['references', 'updated_at'], name='media_blob_references_idx'),
+        ),
+    ]
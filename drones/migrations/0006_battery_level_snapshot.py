@@ -0,0 +1,27 @@
+# Generated by Django 4.1.2 on 2026-10-18 08:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0005_content_addressed_medication_pictures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatteryLevelSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('battery_level', models.PositiveSmallIntegerField()),
+                ('taken_at', models.DateTimeField()),
+                ('drone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='battery_snapshots', to='drones.drone')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='batterylevelsnapshot',
+            index=models.Index(fields=['drone', 'taken_at'], name='battery_snapshot_drone_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.1.2 on 2026-10-18 08:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0006_battery_level_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatteryLevelRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('min_level', models.PositiveSmallIntegerField()),
+                ('max_level', models.PositiveSmallIntegerField()),
+                ('avg_level', models.FloatField()),
+                ('samples', models.PositiveIntegerField()),
+                ('drone', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='battery_rollups', to='drones.drone')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='batterylevelrollup',
+            constraint=models.UniqueConstraint(fields=('drone', 'hour'), name='battery_rollup_drone_hour_unique'),
+        ),
+    ]
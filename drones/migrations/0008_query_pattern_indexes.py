@@ -0,0 +1,35 @@
+# Generated by Django 4.1.2 on 2026-10-18 08:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0007_battery_level_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(condition=models.Q(('state', 'idle')), fields=['-battery_capacity', 'id'], name='drone_idle_battery_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='medication',
+            index=models.Index(fields=['drone', 'name', 'id'], name='medication_drone_name_idx'),
+        ),
+        migrations.AlterField(
+            model_name='medication',
+            name='drone',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='drones.drone'),
+        ),
+        migrations.AddConstraint(
+            model_name='drone',
+            constraint=models.CheckConstraint(check=models.Q(('battery_capacity__gte', 0), ('battery_capacity__lte', 100)), name='drone_battery_capacity_range'),
+        ),
+        migrations.AddConstraint(
+            model_name='drone',
+            constraint=models.CheckConstraint(check=models.Q(('weight_limit__lte', 500)), name='drone_weight_limit_max'),
+        ),
+    ]
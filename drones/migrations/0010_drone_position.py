@@ -0,0 +1,38 @@
+# Generated by Django 4.1.2 on 2026-10-18 09:55
+
+import django.core.validators
+from django.db import migrations, models
+import drones.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0009_medication_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='drone',
+            name='grid_cell',
+            field=drones.models.GridCellField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='drone',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90, 'The minimum latitude is -90.'), django.core.validators.MaxValueValidator(90, 'The maximum latitude is 90.')]),
+        ),
+        migrations.AddField(
+            model_name='drone',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180, 'The minimum longitude is -180.'), django.core.validators.MaxValueValidator(180, 'The maximum longitude is 180.')]),
+        ),
+        migrations.AddIndex(
+            model_name='drone',
+            index=models.Index(condition=models.Q(('state', 'idle')), fields=['grid_cell'], name='drone_idle_cell_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='drone',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('latitude__isnull', True), ('longitude__isnull', True)), models.Q(('latitude__gte', -90), ('latitude__isnull', False), ('latitude__lte', 90), ('longitude__gte', -180), ('longitude__isnull', False), ('longitude__lte', 180)), _connector='OR'), name='drone_position_valid'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.2 on 2026-10-18 10:34
+
+import django.core.validators
+from django.db import migrations, models
+import drones.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('drones', '0010_drone_position'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='drone',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90, 'The minimum latitude is -90.'), django.core.validators.MaxValueValidator(90, 'The maximum latitude is 90.'), drones.validators.finite_validator]),
+        ),
+        migrations.AlterField(
+            model_name='drone',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180, 'The minimum longitude is -180.'), django.core.validators.MaxValueValidator(180, 'The maximum longitude is 180.'), drones.validators.finite_validator]),
+        ),
+    ]
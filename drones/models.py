@@ -1,8 +1,70 @@
+from collections import Counter
+
 from django.core.validators import MaxValueValidator, RegexValidator, MinValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Avg, Count, F, Max, Min, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
 from django.utils.regex_helper import _lazy_re_compile
 from django.utils.translation import gettext_lazy as _
-from .validators import size_validator
+from . import geo
+from .storage import get_medication_pictures_storage
+from .validators import finite_validator, size_validator
+
+# Battery level, in percent, a drone needs to be loaded or to take off. The battery check reports the drones below it.
+MIN_BATTERY_LEVEL = 25
+
+
+class DroneQuerySet(models.QuerySet):
+    def available(self):
+        """
+        Drones that can be loaded: idle and with more than MIN_BATTERY_LEVEL% of battery.
+        """
+        return self.filter(state=Drone.STATE_IDLE, battery_capacity__gt=MIN_BATTERY_LEVEL)
+
+    def nearest(self, latitude, longitude, k):
+        """
+        Return the `k` drones nearest to the position, as (distance in meters, id) pairs sorted by distance.
+
+        The drones are read from the cells of growing squares around the position, through the index of their cell,
+        until no drone out of the square can be nearer than the k-th found.
+        """
+        center = geo.cell(latitude, longitude)
+        drones = self.prefetch_related(None).order_by().values_list('id', 'latitude', 'longitude')
+        distances = {}
+        inner = -1
+        for outer in geo.SEARCH_RADII:
+            # A query per range of cells, joined with UNION ALL: SQLite does not seek a partial index for each term of
+            # an OR, and would read every available drone instead. The largest ring has 258 ranges, below the limit of
+            # 500 of SQLite.
+            rings = [drones.filter(grid_cell__range=cells) for cells in geo.ring_ranges(center, inner, outer)]
+            for pk, drone_latitude, drone_longitude in rings[0].union(*rings[1:], all=True):
+                distances[pk] = geo.distance(latitude, longitude, drone_latitude, drone_longitude)
+            inner = outer
+
+            nearest = sorted((distance, pk) for pk, distance in distances.items())[:k]
+            if len(nearest) == k and nearest[-1][0] <= geo.covered_distance(latitude, outer):
+                return nearest
+
+        # Too few drones around, the nearest ones may be anywhere.
+        return sorted((geo.distance(latitude, longitude, drone_latitude, drone_longitude), pk)
+                      for pk, drone_latitude, drone_longitude in drones.filter(grid_cell__isnull=False))[:k]
+
+
+class GridCellField(models.IntegerField):
+    """
+    Cell of the grid of drones/geo.py containing the position of the drone, or None if it has none.
+
+    It is computed on save() and bulk_create(), and by the bulk endpoint on bulk_update(). Queryset updates of the
+    position must set it too.
+    """
+    depends_on = ('latitude', 'longitude')
+
+    def pre_save(self, model_instance, add):
+        latitude, longitude = model_instance.latitude, model_instance.longitude
+        value = None if latitude is None or longitude is None else geo.cell(latitude, longitude)
+        setattr(model_instance, self.attname, value)
+        return value
 
 
 class Drone(models.Model):
@@ -35,9 +97,63 @@ class Drone(models.Model):
     weight_limit = models.PositiveSmallIntegerField(validators=[MaxValueValidator(500, _("The maximum weight limit of a drone is 500gr."))])
     battery_capacity = models.PositiveSmallIntegerField(validators=BATTERY_CAPACITY_VALIDATORS)
     state = models.CharField(max_length=10, choices=STATE_CHOICES)
+    latitude = models.FloatField(null=True, blank=True, validators=[
+        MinValueValidator(-90, _("The minimum latitude is -90.")), MaxValueValidator(90, _("The maximum latitude is 90.")),
+        finite_validator,
+    ])
+    longitude = models.FloatField(null=True, blank=True, validators=[
+        MinValueValidator(-180, _("The minimum longitude is -180.")),
+        MaxValueValidator(180, _("The maximum longitude is 180.")),
+        finite_validator,
+    ])
+    grid_cell = GridCellField(null=True, blank=True, editable=False)
+
+    objects = DroneQuerySet.as_manager()
 
     class Meta:
-        ordering = ['-battery_capacity']
+        ordering = ['-battery_capacity', 'id']
+        indexes = [
+            models.Index(fields=['-battery_capacity', 'id'], name='drone_battery_id_idx'),
+            # The available drones, in the order they are listed, without going through the busy ones.
+            models.Index(fields=['-battery_capacity', 'id'], name='drone_idle_battery_idx',
+                         condition=models.Q(state='idle')),
+            # The available drones near a position, see `DroneQuerySet.nearest()`.
+            models.Index(fields=['grid_cell'], name='drone_idle_cell_idx', condition=models.Q(state='idle')),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(battery_capacity__gte=0, battery_capacity__lte=100),
+                                   name='drone_battery_capacity_range'),
+            models.CheckConstraint(check=models.Q(weight_limit__lte=500), name='drone_weight_limit_max'),
+            models.CheckConstraint(check=models.Q(latitude__isnull=True, longitude__isnull=True)
+                                   | models.Q(latitude__isnull=False, longitude__isnull=False, latitude__gte=-90,
+                                              latitude__lte=90, longitude__gte=-180, longitude__lte=180),
+                                   name='drone_position_valid'),
+        ]
+
+    # Fields whose changes are streamed to the clients.
+    STREAMED_FIELDS = ('state', 'battery_capacity')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored values, to know on save which ones changed.
+        instance._loaded_values = {field: values[field_names.index(field)]
+                                   for field in cls.STREAMED_FIELDS if field in field_names}
+        return instance
+
+    def changed_fields(self):
+        """
+        Return a dict with the streamed fields changed since the drone was loaded from the database, or all of them if it
+        was not, and their current values.
+        """
+        deferred = self.get_deferred_fields()
+        loaded = getattr(self, '_loaded_values', {})
+        return {field: getattr(self, field) for field in self.STREAMED_FIELDS
+                if field not in deferred and (field not in loaded or loaded[field] != getattr(self, field))}
+
+    def mark_fields_saved(self):
+        self._loaded_values = {field: getattr(self, field)
+                               for field in self.STREAMED_FIELDS if field not in self.get_deferred_fields()}
 
 
 class Medication(models.Model):
@@ -50,12 +166,225 @@ class Medication(models.Model):
                                     code='not_allowed_characters')
     WEIGHT_VALIDATOR = MinValueValidator(1, _("The minimum weight allowed is 1g."))
 
+    # Resized copies of the image, generated in background, and the box each one must fit in.
+    DERIVATIVE_SIZES = {
+        'thumbnail': (128, 128),
+        'preview': (512, 512),
+    }
+    FILE_FIELDS = ('image', *DERIVATIVE_SIZES)
+
     # Fields
     name = models.CharField(max_length=100, validators=[NAME_VALIDATOR])
     weight = models.FloatField(validators=[WEIGHT_VALIDATOR])
     code = models.CharField(max_length=100, validators=[CODE_VALIDATOR])
-    image = models.ImageField(upload_to='medication_pictures/%Y/%m/%d/', max_length=100, validators=[size_validator])
-    drone = models.ForeignKey(Drone, on_delete=models.SET_NULL, null=True, blank=True)
+    image = models.ImageField(upload_to='medication_pictures/%Y/%m/%d/', storage=get_medication_pictures_storage,
+                              max_length=255, validators=[size_validator])
+    thumbnail = models.ImageField(upload_to='medication_pictures/derivatives/%Y/%m/%d/',
+                                  storage=get_medication_pictures_storage, max_length=255, blank=True, editable=False)
+    preview = models.ImageField(upload_to='medication_pictures/derivatives/%Y/%m/%d/',
+                                storage=get_medication_pictures_storage, max_length=255, blank=True, editable=False)
+    # Indexed by `medication_drone_name_idx`, which starts with it.
+    drone = models.ForeignKey(Drone, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
+
+    class Meta:
+        ordering = ['name', 'id']
+        indexes = [
+            models.Index(fields=['name', 'id'], name='medication_name_id_idx'),
+            # The medications loaded on a drone, already in their order.
+            models.Index(fields=['drone', 'name', 'id'], name='medication_drone_name_idx'),
+            # The filters of the list, see drones/filters.py for the indexes that depend on the database.
+            models.Index(fields=['code'], name='medication_code_idx'),
+            models.Index(fields=['weight'], name='medication_weight_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored files, to know on save which ones were replaced.
+        instance._loaded_files = {field: values[field_names.index(field)] or ''
+                                  for field in cls.FILE_FIELDS if field in field_names}
+        # And the drone it was loaded on, to know which drones a change affects.
+        if 'drone_id' in field_names:
+            instance._loaded_drone_id = values[field_names.index('drone_id')]
+        return instance
+
+    def loaded_files(self):
+        """
+        Return a dict with the names of the files stored in the database when the medication was loaded.
+        """
+        return getattr(self, '_loaded_files', {})
+
+    def changed_files(self):
+        """
+        Return a list of (field, previous name, current name) of the files set or replaced since the medication was
+        loaded from the database.
+        """
+        deferred = self.get_deferred_fields()
+        loaded = self.loaded_files()
+        changes = []
+        for field in self.FILE_FIELDS:
+            name = getattr(self, field).name or ''
+            if field not in deferred and loaded.get(field, '') != name:
+                changes.append((field, loaded.get(field, ''), name))
+        return changes
+
+    def affected_drones(self):
+        """
+        Return the ids of the drones the medication is loaded on and was loaded on when it was loaded from the database.
+        """
+        return {drone_id for drone_id in (self.drone_id, getattr(self, '_loaded_drone_id', None)) if drone_id is not None}
+
+    def mark_files_saved(self):
+        self._loaded_files = {field: getattr(self, field).name or ''
+                              for field in self.FILE_FIELDS if field not in self.get_deferred_fields()}
+
+
+class MediaBlobQuerySet(models.QuerySet):
+    def acquire(self, names):
+        """
+        Add a reference to each of the content addressed files in `names`, tracking the ones not seen before.
+        """
+        storage = get_medication_pictures_storage()
+        names = [name for name in names if storage.is_blob(name)]
+        for name in names:
+            self.get_or_create(name=name, defaults={'size': storage.size(name)})
+        self._add_references(names, 1)
+
+    def release(self, names):
+        """
+        Remove a reference from each of the content addressed files in `names`. Files left without references are
+        deleted by the `collect_media_blobs` command.
+        """
+        storage = get_medication_pictures_storage()
+        self._add_references([name for name in names if storage.is_blob(name)], -1)
+
+    def _add_references(self, names, increment):
+        for name, count in Counter(names).items():
+            self.filter(name=name).update(references=F('references') + increment * count, updated_at=timezone.now())
+
+    def stats(self):
+        """
+        Return the number of stored files and references to them, their size, and the size they would take if every
+        reference had its own copy. `dedup_ratio` is how many times bigger the latter is.
+        """
+        stats = self.filter(references__gt=0).aggregate(
+            blobs=Count('id'),
+            references=Sum('references'),
+            stored_bytes=Sum('size'),
+            referenced_bytes=Sum(F('size') * F('references')),
+        )
+        stats = {key: value or 0 for key, value in stats.items()}
+        stats['dedup_ratio'] = stats['referenced_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else 1.0
+        return stats
+
+
+class MediaBlob(models.Model):
+    """
+    A file of the content addressed storage, with the number of medication files pointing to it.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    references = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = MediaBlobQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['references', 'updated_at'], name='media_blob_references_idx'),
+        ]
+
+
+class BatteryLevelSnapshotQuerySet(models.QuerySet):
+    def take(self, taken_at, start=None, stop=None):
+        """
+        Store the current battery level of every drone with a single INSERT ... SELECT, so the levels never travel
+        through Python no matter the size of the fleet. Only the drones with ids from `start` and below `stop` are
+        included, if given. Return the number of snapshots stored.
+        """
+        snapshot, drone = self.model._meta, Drone._meta
+        quote_name = connection.ops.quote_name
+        columns = ', '.join(quote_name(snapshot.get_field(name).column) for name in ('drone', 'battery_level',
+                                                                                     'taken_at'))
+        sql = (f'INSERT INTO {quote_name(snapshot.db_table)} ({columns}) '
+               f'SELECT {quote_name(drone.pk.column)}, {quote_name(drone.get_field("battery_capacity").column)}, %s '
+               f'FROM {quote_name(drone.db_table)}')
+        params = [connection.ops.adapt_datetimefield_value(taken_at)]
+        conditions = [(f'{quote_name(drone.pk.column)} >= %s', start), (f'{quote_name(drone.pk.column)} < %s', stop)]
+        conditions = [(condition, value) for condition, value in conditions if value is not None]
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(condition for condition, _ in conditions)
+            params += [value for _, value in conditions]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def history(self, drone_id, start, end):
+        """
+        Return the battery levels of a drone between `start` and `end` as (time, min level, max level, average level,
+        samples) tuples, from its raw snapshots and from the hourly rollups of the compacted ones.
+        """
+        snapshots = self.filter(drone_id=drone_id, taken_at__gte=start, taken_at__lt=end) \
+            .values_list('taken_at', 'battery_level').order_by()
+        rollups = BatteryLevelRollup.objects.filter(drone_id=drone_id, hour__gte=start, hour__lt=end) \
+            .values_list('hour', 'min_level', 'max_level', 'avg_level', 'samples').order_by()
+        yield from rollups.iterator()
+        for taken_at, battery_level in snapshots.iterator():
+            yield taken_at, battery_level, battery_level, battery_level, 1
+
+    def compact(self, before):
+        """
+        Replace the snapshots taken before `before` with their hourly rollups, computed and stored by the database
+        itself with a single INSERT ... SELECT. Return the number of snapshots compacted.
+        """
+        old = self.filter(taken_at__lt=before)
+        rollups = old.annotate(hour=TruncHour('taken_at')).values('drone', 'hour').annotate(
+            min_level=Min('battery_level'),
+            max_level=Max('battery_level'),
+            avg_level=Avg('battery_level'),
+            samples=Count('id'),
+        ).order_by()
+
+        rollup = BatteryLevelRollup._meta
+        quote_name = connection.ops.quote_name
+        columns = ', '.join(quote_name(rollup.get_field(name).column)
+                            for name in ('drone', 'hour', 'min_level', 'max_level', 'avg_level', 'samples'))
+        select, params = rollups.query.sql_with_params()
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'INSERT INTO {quote_name(rollup.db_table)} ({columns}) {select}', params)
+            compacted, _ = old.delete()
+        return compacted
+
+
+class BatteryLevelSnapshot(models.Model):
+    """
+    Battery level of a drone at the time of a periodic battery check.
+    """
+    drone = models.ForeignKey(Drone, on_delete=models.CASCADE, related_name='battery_snapshots')
+    battery_level = models.PositiveSmallIntegerField()
+    taken_at = models.DateTimeField()
+
+    objects = BatteryLevelSnapshotQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['drone', 'taken_at'], name='battery_snapshot_drone_idx'),
+        ]
+
+
+class BatteryLevelRollup(models.Model):
+    """
+    Battery levels of a drone during an hour, compacted from its snapshots once they are older than the raw retention.
+    """
+    drone = models.ForeignKey(Drone, on_delete=models.CASCADE, related_name='battery_rollups')
+    hour = models.DateTimeField()
+    min_level = models.PositiveSmallIntegerField()
+    max_level = models.PositiveSmallIntegerField()
+    avg_level = models.FloatField()
+    samples = models.PositiveIntegerField()
 
     class Meta:
-        ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(fields=['drone', 'hour'], name='battery_rollup_drone_hour_unique'),
+        ]
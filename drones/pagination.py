@@ -0,0 +1,177 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from django.utils.encoding import force_str
+from django.utils.translation import gettext_lazy as _
+from rest_framework.compat import coreapi, coreschema
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate a queryset by filtering on the position of the last seen item instead of using OFFSET, so every page costs
+    the same no matter how deep it is, and no COUNT(*) is needed.
+
+    The `ordering` must be unique (end it with the primary key), so the position of an item is never ambiguous and pages
+    stay stable while the ordered values change.
+    """
+    ordering = None
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    page_size_query_description = _('Number of results to return per page.')
+    cursor_query_param = 'cursor'
+    cursor_query_description = _('The pagination cursor value.')
+    invalid_cursor_message = _('Invalid cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset)
+        fields = self.get_ordering_fields(reverse)
+
+        queryset = queryset.order_by(*[f'-{name}' if descending else name for name, descending in fields])
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(fields, position))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        # Going backwards we always came from a later page, going forwards we came from an earlier one if a cursor
+        # was given.
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        self.first_position = self.get_position(results[0]) if results else position
+        self.last_position = self.get_position(results[-1]) if results else position
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_ordering_fields(self, reverse=False):
+        """
+        Return the ordering as (field name, descending) pairs, flipping the directions when paginating backwards.
+        """
+        return [(name.lstrip('-'), name.startswith('-') != reverse) for name in self.ordering]
+
+    def get_position(self, instance):
+        # Instances of the model, or rows of `values()`.
+        if isinstance(instance, dict):
+            return [instance[name] for name, descending in self.get_ordering_fields()]
+        return [getattr(instance, name) for name, descending in self.get_ordering_fields()]
+
+    def get_position_filter(self, fields, position):
+        """
+        Build the lexicographic "comes after `position`" condition, e.g. for (-battery_capacity, id):
+        battery_capacity < b OR (battery_capacity = b AND id > i)
+        """
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(fields, position):
+            lookup = 'lt' if descending else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def decode_cursor(self, request, queryset):
+        """
+        Return the position and direction of the cursor of the `request`, with the values of the position converted to
+        the fields of the `queryset` they are compared with, raising NotFound if it is not a valid cursor.
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = cursor['p'], bool(cursor['r'])
+            if not isinstance(position, list) or len(position) != len(self.ordering):
+                raise ValueError
+            position = [self.decode_value(queryset, name, value)
+                        for (name, descending), value in zip(self.get_ordering_fields(), position)]
+        except (TypeError, ValueError, OverflowError, KeyError, UnicodeEncodeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def decode_value(self, queryset, name, value):
+        # The ordered fields are not nullable, so a position never holds None.
+        if value is None or isinstance(value, (list, dict)):
+            raise ValueError
+        field = queryset.model._meta.get_field(name)
+        value = field.to_python(value)
+        if value is None:
+            raise ValueError
+        # No item holds an integer out of the range of its field, and one too wide cannot even be bound to the query.
+        ranges = connections[queryset.db].ops.integer_field_ranges
+        if field.get_internal_type() in ranges:
+            minimum, maximum = ranges[field.get_internal_type()]
+            if not minimum <= value <= maximum:
+                raise ValueError
+        return value
+
+    def encode_cursor(self, position, reverse):
+        encoded = base64.urlsafe_b64encode(json.dumps({'p': position, 'r': int(reverse)}).encode('utf-8'))
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded.decode('ascii'))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self.first_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_schema_fields(self, view):
+        assert coreapi is not None, 'coreapi must be installed to use `get_schema_fields()`'
+        assert coreschema is not None, 'coreschema must be installed to use `get_schema_fields()`'
+        return [
+            coreapi.Field(name=self.cursor_query_param, required=False, location='query',
+                          schema=coreschema.String(title='Cursor',
+                                                   description=force_str(self.cursor_query_description))),
+            coreapi.Field(name=self.page_size_query_param, required=False, location='query',
+                          schema=coreschema.Integer(title='Page size',
+                                                    description=force_str(self.page_size_query_description))),
+        ]
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+
+class DronePagination(KeysetPagination):
+    ordering = ('-battery_capacity', 'id')
+
+
+class MedicationPagination(KeysetPagination):
+    ordering = ('name', 'id')
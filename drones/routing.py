@@ -0,0 +1,8 @@
+from django.urls import path
+
+from drones import consumers
+
+websocket_urlpatterns = [
+    path('ws/drones/', consumers.DroneConsumer.as_asgi()),
+    path('ws/drones/<int:pk>/', consumers.DroneConsumer.as_asgi()),
+]
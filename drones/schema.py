@@ -0,0 +1,108 @@
+"""
+The OpenAPI schema of the API, served without generating it on every request.
+
+Generating it walks every view and serializer, which takes longer than any request of the API. So it is generated at
+build time by `manage.py generate_schema`, which writes it to the DRONES_API_SCHEMA_FILE, and served from there. When
+the file is missing, e.g. in development, it is generated on first use and kept in the memory of the process, until
+the process is restarted by the next deploy. The file is read again when it changes, so a deploy that writes it anew
+needs no restart either.
+
+The schema is served with a strong ETag and a Cache-Control max-age of DRONES_API_SCHEMA_MAX_AGE, so browsers keep it
+and revalidate it with a 304 response. It leaves out the host, so the same file serves every host.
+"""
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from drf_yasg import openapi
+from drf_yasg.app_settings import swagger_settings
+from drf_yasg.codecs import OpenAPICodecJson
+from drf_yasg.views import get_schema_view
+from rest_framework import permissions
+
+CONTENT_TYPE = 'application/openapi+json'
+# The formats of the schema requested from the UI views, e.g. /api-docs/swagger/?format=openapi.
+JSON_FORMATS = ('openapi', '.json')
+
+API_INFO = openapi.Info(
+    title="Drones API",
+    default_version='v1.0.0',
+    description="API to manage drones and medications to be delivered",
+    contact=openapi.Contact(name='Leduan B. Rosell', email="leduanb@gmail.com"),
+)
+
+SchemaView = get_schema_view(API_INFO, public=True, permission_classes=[permissions.AllowAny])
+
+_lock = threading.Lock()
+# The (key, content, etag) of the schema last loaded, where the key is the state of the file it was read from, or None
+# if it was generated.
+_loaded = (None, None, None)
+
+
+def generate_schema():
+    """
+    Return the schema of every endpoint, as JSON bytes.
+    """
+    generator = swagger_settings.DEFAULT_GENERATOR_CLASS(API_INFO)
+    return OpenAPICodecJson([]).encode(generator.get_schema(request=None, public=True))
+
+
+def _file_key(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return str(path), stat.st_mtime_ns, stat.st_size
+
+
+def load_schema():
+    """
+    Return the schema as JSON bytes and its ETag: the content of the DRONES_API_SCHEMA_FILE, or the schema generated
+    the first time it is missing.
+    """
+    global _loaded
+    key = _file_key(settings.DRONES_API_SCHEMA_FILE)
+    loaded = _loaded
+    if loaded[1] is not None and loaded[0] == key:
+        return loaded[1:]
+    with _lock:
+        # Another thread may have loaded it meanwhile.
+        if _loaded[1] is None or _loaded[0] != key:
+            if key is None:
+                content = generate_schema()
+            else:
+                with open(settings.DRONES_API_SCHEMA_FILE, 'rb') as file:
+                    content = file.read()
+            _loaded = (key, content, f'"{hashlib.md5(content).hexdigest()}"')
+        return _loaded[1:]
+
+
+def schema_view(request):
+    """
+    Serve the schema, answering 304 to requests with its ETag.
+    """
+    content, etag = load_schema()
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type=CONTENT_TYPE)
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.DRONES_API_SCHEMA_MAX_AGE)
+    return response
+
+
+def ui_view(renderer):
+    """
+    Return the view of the `renderer` ('swagger' or 'redoc') UI, which reads the schema from `schema_view`. The
+    requests of the schema in JSON made to the UI view itself get it from `schema_view` too.
+    """
+    view = SchemaView.with_ui(renderer)
+
+    def ui(request, *args, **kwargs):
+        if request.GET.get('format') in JSON_FORMATS:
+            return schema_view(request)
+        return view(request, *args, **kwargs)
+
+    return ui
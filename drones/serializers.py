@@ -1,13 +1,22 @@
-import base64
 import uuid
+from collections import Counter
+from datetime import timedelta
 
-from django.core.files.base import ContentFile
+from django.core.files import File
+from django.db import models
+from django.db.models import Sum
+from django.utils import timezone
 from django.utils.translation import gettext as _
 from rest_framework import serializers
-from rest_framework.fields import Field
+from rest_framework.fields import Field, empty
+from rest_framework.settings import api_settings
 from rest_framework.validators import UniqueValidator
 
+from drones import metrics, states
+from drones.dispatch import BATCH_SIZE, batches
 from drones.models import Drone, Medication
+from drones.uploads import ImageTooLarge, decode_base64_file
+from drones.validators import finite_validator
 
 
 class Base64ContentField(Field):
@@ -19,7 +28,9 @@ class Base64ContentField(Field):
         try:
             format, datastr = data.split(';base64,')
             ext = format.split('/')[-1]
-            file = ContentFile(base64.b64decode(datastr), name=str(uuid.uuid4())+'.'+ext)
+            file = decode_base64_file(datastr, name=str(uuid.uuid4())+'.'+ext, content_type=format.split(':')[-1])
+        except ImageTooLarge as error:
+            raise serializers.ValidationError(error.detail)
         except:
             raise serializers.ValidationError('Error in decoding base64 data')
         return file
@@ -30,32 +41,289 @@ class Base64ContentField(Field):
         return value.url
 
 
+class TimedRepresentationMixin:
+    """
+    Count the time spent building the representation as serialization time of the request, see drones/metrics.py.
+    """
+
+    def to_representation(self, instance):
+        with metrics.serialization():
+            return super().to_representation(instance)
+
+
+class SparseFieldsetMixin:
+    """
+    Leave out the fields not in the `fieldset` of the context, if any (see drones/fieldsets.py), and represent the
+    `expandable_fields` of the Meta that are not expanded by the ids of their objects.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.context.get('fieldset')
+        if fieldset is None:
+            return fields
+        for name in list(fields):
+            if not fieldset.includes(name):
+                del fields[name]
+            elif name in getattr(self.Meta, 'expandable_fields', ()) and not fieldset.expands(name):
+                fields[name] = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+        return fields
+
+
 # Serializers define the API representation.
-class MedicationSerializer(serializers.HyperlinkedModelSerializer):
+class MedicationSerializer(SparseFieldsetMixin, TimedRepresentationMixin, serializers.HyperlinkedModelSerializer):
     image = Base64ContentField(required=False)
 
     class Meta:
         model = Medication
-        fields = ['id', 'url', 'name', 'weight', 'code', 'image', 'drone']
+        fields = ['id', 'url', 'name', 'weight', 'code', 'image', 'thumbnail', 'preview', 'drone']
         read_only_fields = ['drone']
 
+    def save(self, **kwargs):
+        instance = super().save(**kwargs)
+        # The decoded image is a temporary file that storage moved into place, release it now.
+        image = self.validated_data.get('image')
+        if image is not None:
+            image.close()
+        return instance
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    List serializer of the bulk endpoints, which validates many objects at once and saves them with bulk queries.
+
+    The fields in the `bulk_unique_fields` of the child Meta (which should not have their own UniqueValidator) are
+    checked with a query per batch of objects instead of one per object. To update, `instance` is a queryset and every
+    item carries the `id` of the object it updates, once. The objects are loaded with the `bulk_annotations` of the
+    child Meta, so the child can validate them without a query each. Invalid items get their errors in the same
+    position of the list.
+    """
+    default_error_messages = {
+        'unknown_id': _('Object with id={value} does not exist.'),
+        'repeated': _('This value is repeated in the request.'),
+    }
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            message = self.error_messages['not_a_list'].format(input_type=type(data).__name__)
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='not_a_list')
+        if not self.allow_empty and not data:
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [self.error_messages['empty']]},
+                                              code='empty')
+        if self.max_length is not None and len(data) > self.max_length:
+            message = self.error_messages['max_length'].format(max_length=self.max_length)
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [message]}, code='max_length')
+
+        if self.instance is not None:
+            self.item_instances, id_errors = self.get_item_instances(data)
+        else:
+            self.item_instances, id_errors = [None] * len(data), [{}] * len(data)
+        validated, errors = [], []
+        for item, instance, id_error in zip(data, self.item_instances, id_errors):
+            try:
+                if id_error:
+                    raise serializers.ValidationError(id_error)
+                # Like a serializer of a single object, the child validates the item against the object it updates.
+                self.child.instance = instance
+                validated.append(self.child.run_validation(item))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                validated.append(None)
+                errors.append(exc.detail)
+
+        self.child.instance = None
+
+        for field in getattr(self.child.Meta, 'bulk_unique_fields', ()):
+            self.check_unique(field, validated, errors)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated
+
+    def get_item_instances(self, data):
+        """
+        Return the objects the items of `data` update, and the errors of the items whose id is invalid, repeated in the
+        request or unknown (whose object is None).
+        """
+        id_field = serializers.IntegerField(min_value=1)
+        ids, errors = [], []
+        for item in data:
+            pk, error = None, {}
+            if not isinstance(item, dict):
+                message = self.child.error_messages['invalid'].format(datatype=type(item).__name__)
+                error = {api_settings.NON_FIELD_ERRORS_KEY: [message]}
+            else:
+                try:
+                    pk = id_field.run_validation(item.get('id', empty))
+                except serializers.ValidationError as exc:
+                    error = {'id': exc.detail}
+            ids.append(pk)
+            errors.append(error)
+
+        counts = Counter(pk for pk in ids if pk is not None)
+        queryset = self.instance.annotate(**getattr(self.child.Meta, 'bulk_annotations', {}))
+        instances = {}
+        for batch in batches(list(counts)):
+            instances.update(queryset.in_bulk(batch))
+        for index, pk in enumerate(ids):
+            if pk is None:
+                continue
+            if counts[pk] > 1:
+                errors[index] = {'id': [self.error_messages['repeated']]}
+            elif pk not in instances:
+                errors[index] = {'id': [self.error_messages['unknown_id'].format(value=pk)]}
+        return [None if error else instances[pk] for pk, error in zip(ids, errors)], errors
+
+    def check_unique(self, field, validated, errors):
+        """
+        Add an error to the items whose `field` is repeated in the request or taken by another object.
+        """
+        model_field = self.child.Meta.model._meta.get_field(field)
+        unique_message = model_field.error_messages['unique'] % {
+            'model_name': model_field.model._meta.verbose_name,
+            'field_label': model_field.verbose_name,
+        }
+        positions = {}
+        for index, value in enumerate(validated):
+            if value is not None and field in value:
+                positions.setdefault(value[field], []).append(index)
+
+        owners = {}
+        for batch in batches(list(positions)):
+            owners.update(self.child.Meta.model.objects.filter(**{f'{field}__in': batch}).values_list(field, 'pk'))
+
+        for value, indexes in positions.items():
+            for index in indexes:
+                instance = self.item_instances[index]
+                if len(indexes) > 1:
+                    message = self.error_messages['repeated']
+                elif value in owners and (instance is None or owners[value] != instance.pk):
+                    message = unique_message
+                else:
+                    continue
+                errors[index] = {**errors[index], field: [message]}
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        return model.objects.bulk_create([model(**attrs) for attrs in validated_data], batch_size=BATCH_SIZE)
+
+    def update(self, instance, validated_data):
+        model = self.child.Meta.model
+        fields = set()
+        for item_instance, attrs in zip(self.item_instances, validated_data):
+            for attr, value in attrs.items():
+                setattr(item_instance, attr, value)
+            fields.update(attrs)
+        for field in fields:
+            model_field = model._meta.get_field(field)
+            # bulk_update() does not store the files set, as save() does.
+            if isinstance(model_field, models.FileField):
+                for item_instance in self.item_instances:
+                    model_field.pre_save(item_instance, add=False)
+        # Nor does it compute the fields derived from the ones set, like the grid cell of the position of a drone.
+        for model_field in model._meta.concrete_fields:
+            if fields.intersection(getattr(model_field, 'depends_on', ())):
+                for item_instance in self.item_instances:
+                    model_field.pre_save(item_instance, add=False)
+                fields.add(model_field.name)
+        if fields:
+            model.objects.bulk_update(self.item_instances, list(fields), batch_size=BATCH_SIZE)
+        return self.item_instances
+
+    def save(self, **kwargs):
+        instances = super().save(**kwargs)
+        # Uploaded files are temporary files that storage copied into place, release them now.
+        for attrs in self.validated_data:
+            for value in attrs.values():
+                if isinstance(value, File):
+                    value.close()
+        return instances
+
+
+class BulkDeleteSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=10000)
+
+
+class MedicationImageSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Medication
+        fields = ['image']
+
 
-class MedicationInDroneSerializer(serializers.HyperlinkedModelSerializer):
+class MedicationInDroneSerializer(TimedRepresentationMixin, serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Medication
-        fields = ['id', 'url', 'name', 'weight', 'code', 'image']
+        fields = ['id', 'url', 'name', 'weight', 'code', 'image', 'thumbnail', 'preview']
 
 
-class DroneSerializer(serializers.HyperlinkedModelSerializer):
+class DroneSerializer(SparseFieldsetMixin, TimedRepresentationMixin, serializers.HyperlinkedModelSerializer):
     medication_set = MedicationInDroneSerializer(many=True, read_only=True)
 
     class Meta:
         model = Drone
-        fields = ['id', 'url', 'serial_number', 'model', 'weight_limit', 'battery_capacity', 'state', 'medication_set']
+        fields = ['id', 'url', 'serial_number', 'model', 'weight_limit', 'battery_capacity', 'state', 'latitude',
+                  'longitude', 'medication_set']
+        expandable_fields = ['medication_set']
+
+    def validate(self, attrs):
+        """
+        Check that a drone has both a latitude and a longitude or none, that a change of state of a drone is a
+        transition of the state machine, and that the drone passes its guards.
+        """
+        position = [attrs.get(field, getattr(self.instance, field, None)) for field in ('latitude', 'longitude')]
+        if position.count(None) == 1:
+            raise serializers.ValidationError('Set both the latitude and the longitude of the drone, or none.')
+
+        state = attrs.get('state')
+        if self.instance is not None and state is not None and state != self.instance.state:
+            drone = {
+                'state': self.instance.state,
+                'battery_capacity': attrs.get('battery_capacity', self.instance.battery_capacity),
+            }
+            if states.needs_load(state):
+                # The drones of the bulk endpoint come annotated with it.
+                loaded = getattr(self.instance, 'loaded', None)
+                drone['loaded'] = self.instance.medication_set.exists() if loaded is None else loaded
+            error = states.check_transition(drone, state)
+            if error is not None:
+                raise serializers.ValidationError({'state': [error]})
+        return attrs
+
+
+class NearestDronesQuerySerializer(serializers.Serializer):
+    latitude = serializers.FloatField(min_value=-90, max_value=90, validators=[finite_validator])
+    longitude = serializers.FloatField(min_value=-180, max_value=180, validators=[finite_validator])
+    weight = serializers.FloatField(min_value=0, default=0, validators=[finite_validator],
+                                    help_text='Weight of the medications to carry, in grams. Drones with a lower '
+                                              'weight limit are left out.')
+    k = serializers.IntegerField(min_value=1, max_value=100, default=5, help_text='Number of drones.')
+
+
+class NearestDroneSerializer(DroneSerializer):
+    distance = serializers.FloatField(read_only=True, help_text='Distance to the position, in meters.')
+
+    class Meta(DroneSerializer.Meta):
+        fields = [*DroneSerializer.Meta.fields, 'distance']
 
 
-class LoadMedicationDroneSerializer(serializers.HyperlinkedModelSerializer):
+class BulkDroneSerializer(DroneSerializer):
+
+    class Meta(DroneSerializer.Meta):
+        list_serializer_class = BulkListSerializer
+        # Checked by the list serializer for the whole batch, instead of a UniqueValidator query per drone.
+        bulk_unique_fields = ['serial_number']
+        bulk_annotations = {'loaded': states.CARRIES_MEDICATIONS}
+        extra_kwargs = {'serial_number': {'validators': []}}
+
+
+class BulkMedicationSerializer(MedicationSerializer):
+
+    class Meta(MedicationSerializer.Meta):
+        list_serializer_class = BulkListSerializer
+
+
+class LoadMedicationDroneSerializer(TimedRepresentationMixin, serializers.HyperlinkedModelSerializer):
     medication_set = serializers.PrimaryKeyRelatedField(queryset=Medication.objects.all(), many=True, required=True)
 
     class Meta:
@@ -65,13 +333,89 @@ class LoadMedicationDroneSerializer(serializers.HyperlinkedModelSerializer):
 
     def validate_medication_set(self, medications):
         """
-        Check that total weight of medications do NOT surpass weight limit of drone.
+        Check that medications are not loaded on another drone and that their total weight do NOT surpass weight limit
+        of drone.
+
+        The medication rows are locked until the end of the transaction, so it must be validated inside one (along with
+        the drone row) to prevent concurrent loads from taking the same medications.
         """
-        total_weight = 0
-        for medication in medications:
-            total_weight += medication.weight
+        ids = sorted({medication.pk for medication in medications})
+        queryset = Medication.objects.filter(pk__in=ids)
+        locked = list(queryset.select_for_update().order_by('id').values_list('id', 'drone_id'))
+
+        taken = [pk for pk, drone_id in locked if drone_id is not None and drone_id != self.instance.pk]
+        if taken:
+            raise serializers.ValidationError(f"Medications {taken} are already loaded on another drone.")
 
+        total_weight = queryset.aggregate(total_weight=Sum('weight'))['total_weight'] or 0
         if total_weight > self.instance.weight_limit:
             raise serializers.ValidationError(f"This drone has a weight limit of {self.instance.weight_limit}g. The total "
                                               f"weight of medications was {total_weight}g")
         return medications
+
+
+class DroneTransitionSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=10000)
+    state = serializers.ChoiceField(choices=Drone.STATE_CHOICES)
+
+
+class DroneTransitionFailureSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    reason = serializers.CharField()
+
+
+class DroneTransitionResultSerializer(TimedRepresentationMixin, serializers.Serializer):
+    moved = serializers.ListField(child=serializers.IntegerField(), help_text='Drones moved to the state.')
+    failed = DroneTransitionFailureSerializer(many=True,
+                                              help_text='Drones that do not exist or cannot move to the state.')
+
+
+class AssignMedicationsSerializer(serializers.Serializer):
+    medication_set = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False,
+                                           max_length=50000)
+
+
+class DroneAssignmentSerializer(serializers.Serializer):
+    drone = serializers.IntegerField()
+    medication_set = serializers.ListField(child=serializers.IntegerField())
+
+
+class AssignMedicationsResultSerializer(TimedRepresentationMixin, serializers.Serializer):
+    assignments = DroneAssignmentSerializer(many=True)
+    unassigned = serializers.ListField(child=serializers.IntegerField(),
+                                       help_text='Medications that did not fit on any available drone.')
+    rejected = serializers.ListField(child=serializers.IntegerField(),
+                                     help_text='Medications that do not exist or are already loaded on a drone.')
+
+
+class BatteryHistoryQuerySerializer(serializers.Serializer):
+    start = serializers.DateTimeField(required=False, help_text='Defaults to a day before the end.')
+    end = serializers.DateTimeField(required=False, help_text='Defaults to now.')
+    buckets = serializers.IntegerField(min_value=1, max_value=1000, default=60)
+
+    def validate(self, data):
+        data.setdefault('end', timezone.now())
+        data.setdefault('start', data['end'] - timedelta(days=1))
+        if data['start'] >= data['end']:
+            raise serializers.ValidationError({'start': 'The start must be before the end.'})
+        return data
+
+
+class BatteryHistoryBucketSerializer(serializers.Serializer):
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+    min = serializers.IntegerField()
+    avg = serializers.FloatField()
+    max = serializers.IntegerField()
+    samples = serializers.IntegerField()
+
+
+class BatteryHistorySerializer(TimedRepresentationMixin, serializers.Serializer):
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+    buckets = BatteryHistoryBucketSerializer(many=True)
+
+
+class ExportQuerySerializer(serializers.Serializer):
+    # Not named `format`, which selects the renderer of the response.
+    type = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
@@ -0,0 +1,107 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import metrics
+from .cache import invalidate_drones
+from .events import publish_deltas
+from .filters import install_search_indexes
+from .models import Drone, MediaBlob, Medication
+from .tasks import generate_medication_derivatives
+
+
+@receiver(post_save, sender=Drone)
+@receiver(post_delete, sender=Drone)
+def drone_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached responses of a drone saved or deleted, including the ones of `load_with_medication`, which saves
+    the drone along with its medications.
+    """
+    invalidate_drones([instance.pk])
+
+
+@receiver(post_save, sender=Drone)
+def drone_saved(sender, instance, **kwargs):
+    """
+    Stream the changes of the state or battery level of a drone.
+    """
+    changes = instance.changed_fields()
+    if changes:
+        publish_deltas([{'id': instance.pk, **changes}])
+        instance.mark_fields_saved()
+
+
+@receiver(post_delete, sender=Drone)
+def drone_deleted(sender, instance, **kwargs):
+    """
+    Stream the deletion of a drone.
+    """
+    publish_deltas([{'id': instance.pk, 'deleted': True}])
+
+
+@receiver(post_save, sender=Medication)
+@receiver(post_delete, sender=Medication)
+def medication_changed(sender, instance, **kwargs):
+    """
+    Invalidate the cached responses of the drones nesting a medication saved or deleted.
+    """
+    drone_ids = instance.affected_drones()
+    if drone_ids:
+        invalidate_drones(drone_ids)
+
+
+@receiver(post_save, sender=Medication)
+def medication_saved(sender, instance, update_fields=None, **kwargs):
+    """
+    Track the files of a saved medication, see `medication_files_saved()`.
+    """
+    changes = instance.changed_files()
+    if update_fields is not None:
+        changes = [change for change in changes if change[0] in update_fields]
+    if changes:
+        medication_files_saved([(instance, changes)])
+
+
+def medication_files_saved(changes):
+    """
+    Move the references of the files replaced to the new ones, and generate the derivatives of the image of the
+    medications in background once it is set or replaced. `changes` is a list of (medication, changed files) pairs.
+
+    Also called after bulk queries, which send no signals.
+    """
+    MediaBlob.objects.acquire([name for medication, files in changes for field, previous, name in files if name])
+    MediaBlob.objects.release([previous for medication, files in changes for field, previous, name in files
+                               if previous])
+    for medication, files in changes:
+        medication.mark_files_saved()
+
+    replaced = [medication.pk for medication, files in changes if any(field == 'image' for field, *_ in files)]
+    if replaced:
+        transaction.on_commit(lambda: [generate_medication_derivatives.delay(pk) for pk in replaced])
+
+
+@receiver(post_delete, sender=Medication)
+def medication_deleted(sender, instance, **kwargs):
+    """
+    Release the files of a deleted medication.
+    """
+    files = instance.loaded_files() or {field: getattr(instance, field).name for field in Medication.FILE_FIELDS}
+    MediaBlob.objects.release([name for name in files.values() if name])
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    """
+    Time the queries of the requests on every database connection.
+    """
+    metrics.install_query_wrapper(connection)
+
+
+@receiver(post_migrate)
+def migrated(sender, using, **kwargs):
+    """
+    Create the search indexes the migrations cannot declare.
+    """
+    if sender.name == 'drones':
+        install_search_indexes(using)
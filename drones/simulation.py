@@ -0,0 +1,102 @@
+"""
+Simulation of the fleet, to see drones deliver and load-test the API with realistic changes.
+
+On each tick the active drones move one step along their delivery (loaded → delivering → delivered → returning →
+idle), drones in flight drain their battery by model and idle drones charge it. All the drones change with a single
+UPDATE whose CASE expressions compute the new state and battery of each row, so a tick costs the same few queries for
+any fleet size. The medications of drones that deliver are unloaded, so they can be loaded again.
+
+Run it with `python manage.py simulate`, or with Celery beat by setting DRONES_SIMULATION=1.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest, Least
+
+from drones import states
+from drones.cache import invalidate_drones
+from drones.events import publish_deltas
+from drones.models import Drone, Medication
+
+# Battery drained per tick while flying, by model: the heavier the drone, the faster it drains.
+DRAIN_PER_TICK = {
+    'lightweight': 1,
+    'middleweight': 2,
+    'cruiserweight': 3,
+    'heavyweight': 4,
+}
+# Battery charged per tick while idle.
+CHARGE_PER_TICK = 5
+FLYING_STATES = (states.DELIVERING, states.RETURNING)
+# The state each drone moves to on a tick, if it passes the guards of the state machine. Loading drones wait to be
+# loaded through the API.
+DELIVERY_STEPS = {
+    states.LOADED: states.DELIVERING,
+    states.DELIVERING: states.DELIVERED,
+    states.DELIVERED: states.RETURNING,
+    states.RETURNING: states.IDLE,
+}
+# The drones a tick changes: the ones on a delivery, and the idle ones charging.
+ACTIVE = Q(state__in=list(DELIVERY_STEPS)) | Q(state=states.IDLE, battery_capacity__lt=100)
+
+
+def next_battery_capacity():
+    drain = Case(*[When(model=model, then=Value(drain)) for model, drain in DRAIN_PER_TICK.items()],
+                 default=Value(0), output_field=IntegerField())
+    return Case(
+        When(state__in=FLYING_STATES, then=Greatest(F('battery_capacity') - drain, Value(0))),
+        When(state=states.IDLE, then=Least(F('battery_capacity') + Value(CHARGE_PER_TICK), Value(100))),
+        default=F('battery_capacity'), output_field=IntegerField(),
+    )
+
+
+def next_state():
+    return Case(*[When(Q(state=state) & states.CONDITIONS[target], then=Value(target))
+                  for state, target in DELIVERY_STEPS.items()],
+                default=F('state'))
+
+
+def advance(drone):
+    """
+    Return the state and battery of the `drone` (a dict with its `model`, `state`, `battery_capacity` and `loaded`)
+    after a tick, as the UPDATE of `tick()` computes them.
+    """
+    state, battery_capacity = drone['state'], drone['battery_capacity']
+    if state in FLYING_STATES:
+        battery_capacity = max(battery_capacity - DRAIN_PER_TICK.get(drone['model'], 0), 0)
+    elif state == states.IDLE:
+        battery_capacity = min(battery_capacity + CHARGE_PER_TICK, 100)
+    target = DELIVERY_STEPS.get(state)
+    if target is not None and states.check_transition(drone, target) is None:
+        state = target
+    return state, battery_capacity
+
+
+def tick():
+    """
+    Advance the simulation a tick. Return the number of drones changed and of medications delivered.
+
+    The drones are read before the UPDATE to know the changes to publish, as it sends no signals.
+    """
+    with transaction.atomic():
+        # Lock the drones by id, in the same order as `states.transition()`, so that both cannot deadlock.
+        drones = Drone.objects.select_for_update().filter(ACTIVE).annotate(loaded=states.CARRIES_MEDICATIONS) \
+            .order_by('pk').values('id', 'model', 'state', 'battery_capacity', 'loaded')
+        deltas = []
+        for drone in drones.iterator(chunk_size=2000):
+            state, battery_capacity = advance(drone)
+            delta = {'id': drone['id']}
+            if state != drone['state']:
+                delta['state'] = state
+            if battery_capacity != drone['battery_capacity']:
+                delta['battery_capacity'] = battery_capacity
+            if state == states.DELIVERED:
+                delta['medication_set'] = []
+            if len(delta) > 1:
+                deltas.append(delta)
+
+        delivered = Medication.objects.filter(drone__state=states.DELIVERING).update(drone=None)
+        Drone.objects.filter(ACTIVE).update(state=next_state(), battery_capacity=next_battery_capacity())
+
+        invalidate_drones([delta['id'] for delta in deltas])
+        publish_deltas(deltas)
+    return {'drones': len(deltas), 'delivered_medications': delivered}
@@ -0,0 +1,124 @@
+"""
+State machine of the drones: the states a drone can enter each state from, and the guards it must pass to enter it.
+
+A single drone is checked with `check_transition()`. Many drones are moved at once with `transition()`, which checks
+them all with one query and moves them with one conditional UPDATE per batch, so the cost of a dispatch cycle does not
+depend on the number of drones.
+"""
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from drones.cache import invalidate_drones
+from drones.dispatch import batches
+from drones.events import publish_deltas
+from drones.models import MIN_BATTERY_LEVEL, Drone, Medication
+
+IDLE = Drone.STATE_IDLE
+LOADING = Drone.STATE_LOADING
+LOADED = Drone.STATE_LOADED
+DELIVERING = Drone.STATE_DELIVERING
+DELIVERED = Drone.STATE_DELIVERED
+RETURNING = Drone.STATE_RETURNING
+
+
+class Guard:
+    """
+    A condition a drone must meet to enter a state, checked in Python with `check()` on a dict with the `state`,
+    `battery_capacity` and `loaded` (whether it carries medications) of the drone, and in SQL with `condition`.
+    """
+
+    def __init__(self, check, condition, message):
+        self.check = check
+        self.condition = condition
+        self.message = message
+
+
+BATTERY = Guard(lambda drone: drone['battery_capacity'] >= MIN_BATTERY_LEVEL,
+                Q(battery_capacity__gte=MIN_BATTERY_LEVEL),
+                f'The battery of the drone is below {MIN_BATTERY_LEVEL}%.')
+CARRIES_MEDICATIONS = Exists(Medication.objects.filter(drone=OuterRef('pk')))
+LOAD = Guard(lambda drone: drone['loaded'], Q(CARRIES_MEDICATIONS), 'The drone carries no medications.')
+
+# For each state, the states a drone can enter it from and the guards it must pass. A loaded drone can stay loaded to
+# take more medications.
+TRANSITIONS = {
+    IDLE: ((LOADING, RETURNING), ()),
+    LOADING: ((IDLE,), (BATTERY,)),
+    LOADED: ((IDLE, LOADING, LOADED), (BATTERY, LOAD)),
+    DELIVERING: ((LOADED,), (BATTERY, LOAD)),
+    DELIVERED: ((DELIVERING,), ()),
+    RETURNING: ((DELIVERED,), ()),
+}
+
+# The states a drone can move to from each state.
+NEXT_STATES = {
+    state: frozenset(target for target, (sources, guards) in TRANSITIONS.items() if state in sources)
+    for state, label in Drone.STATE_CHOICES
+}
+
+
+def _condition(sources, guards):
+    condition = Q(state__in=sources)
+    for guard in guards:
+        condition &= guard.condition
+    return condition
+
+
+# The SQL condition of the drones that can enter each state.
+CONDITIONS = {target: _condition(sources, guards) for target, (sources, guards) in TRANSITIONS.items()}
+
+
+def needs_load(target):
+    """
+    Whether checking a transition to `target` needs to know if the drone carries medications.
+    """
+    return LOAD in TRANSITIONS[target][1]
+
+
+def check_transition(drone, target):
+    """
+    Return why the `drone` (a dict like the ones `Guard.check()` takes) cannot move to the `target` state, or None if
+    it can.
+    """
+    if target not in NEXT_STATES[drone['state']]:
+        return f'A drone cannot go from {drone["state"]} to {target}.'
+    for guard in TRANSITIONS[target][1]:
+        if not guard.check(drone):
+            return guard.message
+    return None
+
+
+def transition(drone_ids, target):
+    """
+    Move the drones with the given ids to the `target` state. Return the ids of the drones moved, and a dict with the
+    reason each one of the rest was not moved.
+
+    The drones are locked and checked with a query per batch, and moved with an UPDATE per batch that checks the
+    transition again in its WHERE clause. As the UPDATE sends no signals, it invalidates and publishes the changes.
+    """
+    moved, failed = [], {}
+    with transaction.atomic():
+        for ids in batches(sorted(set(drone_ids))):
+            drones = Drone.objects.select_for_update().filter(pk__in=ids)
+            if needs_load(target):
+                drones = drones.annotate(loaded=CARRIES_MEDICATIONS)
+                rows = drones.values('id', 'state', 'battery_capacity', 'loaded')
+            else:
+                rows = drones.values('id', 'state', 'battery_capacity')
+            rows = {row['id']: row for row in rows}
+
+            allowed = []
+            for pk in ids:
+                error = check_transition(rows[pk], target) if pk in rows else 'Drone not found.'
+                if error is None:
+                    allowed.append(pk)
+                else:
+                    failed[pk] = error
+            if allowed:
+                Drone.objects.filter(CONDITIONS[target], pk__in=allowed).update(state=target)
+                moved.extend(allowed)
+
+        if moved:
+            invalidate_drones(moved)
+            publish_deltas([{'id': pk, 'state': target} for pk in moved])
+    return moved, failed
@@ -0,0 +1,60 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage naming every file after the SHA-256 hash of its content, so identical files are stored only
+    once no matter how many times they are uploaded.
+
+    Files are sharded in two levels of directories named after the first characters of the hash, which keeps every
+    directory small: `<prefix>/ab/cd/abcd...ef.jpeg`. The name asked for is only used for its extension.
+    """
+    prefix = 'medication_pictures/blobs'
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        hexdigest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        name = f'{self.prefix}/{hexdigest[:2]}/{hexdigest[2:4]}/{hexdigest}{extension}'
+        if self.exists(name) and self.reuse(name):
+            return name
+        return super()._save(name, content)
+
+    def reuse(self, name):
+        """
+        Mark the stored file `name` as just used, so `collect_media_blobs` keeps it at least for its grace period until
+        the medication saved with it references it. Return False if the file was deleted meanwhile.
+        """
+        from drones.models import MediaBlob
+
+        with transaction.atomic():
+            # Waits for a collection of the file in progress, which deletes it holding the lock of its row.
+            MediaBlob.objects.filter(name=name).update(updated_at=timezone.now())
+            # And the files not tracked yet are collected by their modification time.
+            try:
+                os.utime(self.path(name))
+            except FileNotFoundError:
+                return False
+        return True
+
+    def is_blob(self, name):
+        """
+        Whether a file was stored by its content, as opposed to files stored before this storage was used.
+        """
+        return bool(name) and name.startswith(self.prefix + '/')
+
+
+medication_pictures_storage = ContentAddressedStorage()
+
+
+def get_medication_pictures_storage():
+    return medication_pictures_storage
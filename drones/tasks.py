@@ -1,19 +1,214 @@
+import heapq
+import json
 import logging
-from celery import shared_task
-from .models import Drone
+import time
+from datetime import datetime, timedelta
+
+from celery import chord, shared_task
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum
+from django.utils import timezone
+from PIL import UnidentifiedImageError
+
+from . import simulation
+from .cache import invalidate_drones
+from .images import render_derivatives
+from .models import MIN_BATTERY_LEVEL, BatteryLevelRollup, BatteryLevelSnapshot, Drone, MediaBlob, Medication
 
 logger = logging.getLogger('battery-level-check-logger')
+derivatives_logger = logging.getLogger('drones.derivatives')
+
+BATTERY_CHECK_CHUNK_SIZE = 2000
+# The battery check runs every 10 minutes, and should be done before the next one.
+BATTERY_CHECK_WINDOW = timedelta(minutes=10)
+# The most drones listed in the alert of a sharded battery check, the ones with the lowest battery first.
+LOW_BATTERY_ALERT_LIMIT = 1000
 
 
 @shared_task
 def log_drones_battery_levels():
-    message = '\n--------------------START OF CHECK--------------------\n'
+    """
+    Store a snapshot of the battery level of every drone and log them as JSON lines: a line with the totals, then a
+    line per chunk of drones. Drones are read in chunks and the snapshot is written by the database itself, so memory
+    use does not depend on the size of the fleet.
+
+    With the DRONES_BATTERY_CHECK_SHARD_SIZE setting, the fleet is split instead in shards of that many drones, checked
+    in parallel by the workers, see `start_battery_audit()`.
+    """
+    taken_at = timezone.now()
+    if settings.DRONES_BATTERY_CHECK_SHARD_SIZE:
+        result = start_battery_audit(taken_at, settings.DRONES_BATTERY_CHECK_SHARD_SIZE)
+        return {'audit': result.id}
+
+    totals = Drone.objects.aggregate(total_drones=Count('id'),
+                                     low_battery_drones=Count('id', filter=Q(battery_capacity__lt=MIN_BATTERY_LEVEL)))
+    BatteryLevelSnapshot.objects.take(taken_at)
+    logger.info(json.dumps({'event': 'battery_check', 'taken_at': taken_at.isoformat(), **totals}))
+    _log_battery_levels(Drone.objects.all(), taken_at)
+    return totals
+
+
+def _log_battery_levels(drones, taken_at):
+    levels = drones.order_by('pk').values_list('serial_number', 'battery_capacity')
+    chunk = {}
+    for serial_number, battery_level in levels.iterator(chunk_size=BATTERY_CHECK_CHUNK_SIZE):
+        chunk[serial_number] = battery_level
+        if len(chunk) == BATTERY_CHECK_CHUNK_SIZE:
+            _log_battery_chunk(chunk, taken_at)
+            chunk = {}
+    if chunk:
+        _log_battery_chunk(chunk, taken_at)
+
+
+def _log_battery_chunk(levels, taken_at):
+    logger.info(json.dumps({'event': 'battery_levels', 'taken_at': taken_at.isoformat(), 'levels': levels}))
+
+
+def battery_shards(size):
+    """
+    Split the drones in (start, stop) ranges of ids of `size` drones each, the first starting and the last stopping
+    at None, so the drones created meanwhile are in a range too. The boundaries are found by stepping through the
+    primary key index a shard at a time, with a query per shard that reads only the index.
+    """
+    ids = Drone.objects.order_by('pk').values_list('pk', flat=True)
+    boundaries = []
+    following = list(ids[size:size + 1])
+    while following:
+        boundaries += following
+        following = list(ids.filter(pk__gt=boundaries[-1])[size - 1:size])
+    return list(zip([None, *boundaries], [*boundaries, None]))
+
+
+def start_battery_audit(taken_at, shard_size):
+    """
+    Check the battery of the drones as a Celery chord: a task per shard of `shard_size` drones (`audit_battery_shard`),
+    run in parallel by the workers, then a task merging their results into the report (`merge_battery_audit`). Return
+    the AsyncResult of the report.
+    """
+    header = [audit_battery_shard.s(taken_at.isoformat(), start, stop) for start, stop in battery_shards(shard_size)]
+    return chord(header)(merge_battery_audit.s(taken_at.isoformat()))
+
+
+@shared_task
+def audit_battery_shard(taken_at, start, stop):
+    """
+    Store the snapshot of the battery level of the drones with ids from `start` and below `stop`, log their levels,
+    and return their statistics, the drones with the lowest battery among the low ones, and the time it took.
+    """
+    began = time.perf_counter()
+    taken_at = datetime.fromisoformat(taken_at)
     drones = Drone.objects.all()
-    message += f'Total Drones: {drones.count()}\n'
-    message += f'Total Drones with low battery: {Drone.objects.filter(battery_capacity__lt=25).count()}\n'
-    message += 'Battery level of each drone:'
-    for drone in drones:
-        message += f'  ({drone.serial_number} --> {drone.battery_capacity})'
-    message += '\n---------------------END OF CHECK--------------------'
-
-    logger.info(message)
+    if start is not None:
+        drones = drones.filter(pk__gte=start)
+    if stop is not None:
+        drones = drones.filter(pk__lt=stop)
+    low = Q(battery_capacity__lt=MIN_BATTERY_LEVEL)
+    statistics = drones.aggregate(total_drones=Count('id'), low_battery_drones=Count('id', filter=low),
+                                  battery_level_sum=Sum('battery_capacity'),
+                                  min_battery_level=Min('battery_capacity'), max_battery_level=Max('battery_capacity'))
+    lowest = drones.filter(low).order_by('battery_capacity', 'pk') \
+        .values_list('serial_number', 'battery_capacity')[:LOW_BATTERY_ALERT_LIMIT]
+    BatteryLevelSnapshot.objects.take(taken_at, start, stop)
+    _log_battery_levels(drones, taken_at)
+    return {'start': start, 'stop': stop, **statistics, 'low_battery': [list(drone) for drone in lowest],
+            'seconds': time.perf_counter() - began}
+
+
+@shared_task
+def merge_battery_audit(shards, taken_at):
+    """
+    Merge the results of the shards of a battery check into its report, logged with the totals of the whole fleet and
+    followed by an alert listing the drones with the lowest battery. It warns when the check took longer than its
+    window.
+    """
+    total = sum(shard['total_drones'] for shard in shards)
+    checked = [shard for shard in shards if shard['total_drones']]
+    low_battery = heapq.nsmallest(LOW_BATTERY_ALERT_LIMIT,
+                                  (drone for shard in shards for drone in shard['low_battery']),
+                                  key=lambda drone: drone[1])
+    seconds = (timezone.now() - datetime.fromisoformat(taken_at)).total_seconds()
+    report = {
+        'total_drones': total,
+        'low_battery_drones': sum(shard['low_battery_drones'] for shard in shards),
+        'average_battery_level': sum(shard['battery_level_sum'] for shard in checked) / total if total else None,
+        'min_battery_level': min((shard['min_battery_level'] for shard in checked), default=None),
+        'max_battery_level': max((shard['max_battery_level'] for shard in checked), default=None),
+        'seconds': seconds,
+        'shards': [{'start': shard['start'], 'stop': shard['stop'], 'drones': shard['total_drones'],
+                    'seconds': shard['seconds']} for shard in shards],
+    }
+    logger.info(json.dumps({'event': 'battery_check', 'taken_at': taken_at, **report}))
+    if low_battery:
+        logger.warning(json.dumps({'event': 'low_battery_alert', 'taken_at': taken_at,
+                                   'low_battery_drones': report['low_battery_drones'],
+                                   'drones': dict(low_battery)}))
+    if seconds > BATTERY_CHECK_WINDOW.total_seconds():
+        logger.warning(json.dumps({'event': 'battery_check_overrun', 'taken_at': taken_at, 'seconds': seconds,
+                                   'slowest_shard_seconds': max(shard['seconds'] for shard in shards)}))
+    return {**report, 'low_battery': low_battery}
+
+
+@shared_task
+def rollup_battery_history():
+    """
+    Compact the battery snapshots older than the raw retention into hourly rollups, and delete the rollups older than
+    their own retention, so the history stays the same size as it grows.
+    """
+    now = timezone.now()
+    raw_cutoff = now - timedelta(days=settings.BATTERY_HISTORY_RAW_RETENTION_DAYS)
+    compacted = BatteryLevelSnapshot.objects.compact(before=raw_cutoff.replace(minute=0, second=0, microsecond=0))
+    expired, _ = BatteryLevelRollup.objects.filter(
+        hour__lt=now - timedelta(days=settings.BATTERY_HISTORY_ROLLUP_RETENTION_DAYS)
+    ).delete()
+    return {'compacted_snapshots': compacted, 'expired_rollups': expired}
+
+
+@shared_task
+def generate_medication_derivatives(medication_id):
+    """
+    Generate the resized copies of the image of a medication (see Medication.DERIVATIVE_SIZES) and store their paths.
+    """
+    fields = list(Medication.DERIVATIVE_SIZES)
+    medication = Medication.objects.filter(pk=medication_id).only('id', 'image', 'drone', *fields).first()
+    if medication is None:
+        return
+
+    derivatives = {field: '' for field in fields}
+    if medication.image:
+        # Identical images are stored once, so their derivatives can be shared too.
+        existing = Medication.objects.filter(image=medication.image.name).exclude(pk=medication_id) \
+            .exclude(**{field: '' for field in fields}).values(*fields).first()
+        if existing is not None and all(existing.values()):
+            derivatives = existing
+        else:
+            try:
+                with medication.image.open('rb') as image:
+                    rendered = render_derivatives(image, Medication.DERIVATIVE_SIZES)
+            except (OSError, UnidentifiedImageError, SuspiciousFileOperation) as error:
+                derivatives_logger.warning('Could not generate derivatives of medication %s: %s', medication_id, error)
+                return
+            for field, content in rendered.items():
+                field_file = getattr(medication, field)
+                derivatives[field] = field_file.storage.save(
+                    field_file.field.generate_filename(medication, content.name), content
+                )
+
+    with transaction.atomic():
+        # Only store the derivatives if the image was not replaced meanwhile, which enqueues its own generation.
+        updated = Medication.objects.filter(pk=medication_id, image=medication.image.name).update(**derivatives)
+        if updated:
+            MediaBlob.objects.acquire([name for name in derivatives.values() if name])
+            MediaBlob.objects.release([getattr(medication, field).name for field in fields
+                                       if getattr(medication, field)])
+            if medication.drone_id is not None:
+                invalidate_drones([medication.drone_id])
+
+
+@shared_task
+def simulate_fleet():
+    """
+    Advance the simulation of the fleet a tick, see drones/simulation.py.
+    """
+    return simulation.tick()
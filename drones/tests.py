@@ -1,12 +1,83 @@
-from django.urls import reverse
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+from PIL import Image
 from rest_framework import status
 from rest_framework.exceptions import ErrorDetail
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APITestCase, APITransactionTestCase
+
+from drones import benchmarks, compression, geo, metrics, schema, simulation, states, tasks
+from drones.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from drones.dispatch import pack_medications
+from drones.filters import install_search_indexes
+from drones.history import downsample
+from drones.models import MIN_BATTERY_LEVEL, BatteryLevelRollup, BatteryLevelSnapshot, Drone, MediaBlob, Medication
+from drones.renderers import FastJSONRenderer
+from drones.uploads import LimitedSizeJSONParser, LimitedSizeUploadHandler
+from drones_musala.asgi import application
+
+
+class QueryCountMixin:
+    """
+    Helpers to check that the number of queries run by an endpoint does not depend on the amount of stored data.
+    """
 
-from drones.models import Drone, Medication
+    def populate_fleet(self, drones, medications_per_drone):
+        """
+        Create idle drones with enough battery to be available, each one loaded with some medications.
+        """
+        offset = Drone.objects.count()
+        for i in range(offset, offset + drones):
+            drone = Drone.objects.create(serial_number=f'DRN_FLEET_{i}', model='heavyweight', weight_limit=500,
+                                         battery_capacity=90, state='idle')
+            for j in range(medications_per_drone):
+                Medication.objects.create(name=f'Fleet-{i}-{j}', weight=1, code=f'FLT_{i}_{j}',
+                                          image='/media/fleet.jpg', drone=drone)
+
+    def assertConstantQueries(self, num, url, sizes=((1, 1), (5, 3))):
+        """
+        Ensure a GET to `url` runs exactly `num` queries, growing the fleet between requests according to `sizes`, a
+        sequence of (drones, medications per drone) pairs.
+        """
+        for drones, medications_per_drone in sizes:
+            self.populate_fleet(drones, medications_per_drone)
+            # Measure the queries of a cache miss.
+            cache.clear()
+            with self.assertNumQueries(num):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
-class DroneTests(APITestCase):
+class DroneTests(QueryCountMixin, APITestCase):
     def setUp(self):
         Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,  battery_capacity=50, state='idle')
         Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300,  battery_capacity=10, state='idle')
@@ -112,3 +183,2188 @@ class DroneTests(APITestCase):
         response = self.client.post(url, {'medication_set': [2]})  # It has a weight of 300g
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('medication_set', response.data)
+
+    def test_load_with_medication_loaded_on_another_drone(self):
+        """
+        Ensure we get a BAD REQUEST response when loading a drone with medication already loaded on another drone, and
+        that the medication stays on the first one.
+        """
+        self.client.post(reverse('drone-load-with-medication', kwargs={'pk': 1}), {'medication_set': [1]})
+        url = reverse('drone-load-with-medication', kwargs={'pk': 4})
+        response = self.client.post(url, {'medication_set': [1, 2]})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('medication_set', response.data)
+        self.assertEqual(Medication.objects.get(pk=1).drone_id, 1)
+        self.assertIsNone(Medication.objects.get(pk=2).drone_id)
+
+    def test_load_with_medication_reloading_same_drone(self):
+        """
+        Ensure a drone can be loaded again with medications it already carries.
+        """
+        url = reverse('drone-load-with-medication', kwargs={'pk': 4})
+        self.client.post(url, {'medication_set': [1]})
+        response = self.client.post(url, {'medication_set': [1, 2]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data['medication_set']), [1, 2])
+
+    def test_assign_medications(self):
+        """
+        Ensure pending medications are packed only onto available drones without surpassing their weight limit, and
+        that the drones receiving medications are marked as loaded.
+        """
+        Medication.objects.create(name='Advil-150', weight=150, code='ADV_150', image='/media/advil-150.jpg')
+        Medication.objects.create(name='Advil-600', weight=600, code='ADV_600', image='/media/advil-600.jpg')
+        url = reverse('drone-assign-medications')
+        response = self.client.post(url, {'medication_set': [1, 2, 3, 4, 20]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['unassigned'], [4])
+        self.assertEqual(response.data['rejected'], [20])
+
+        assigned = {pk for assignment in response.data['assignments'] for pk in assignment['medication_set']}
+        self.assertEqual(assigned, {1, 2, 3})
+        for drone in Drone.objects.filter(medication__isnull=False).distinct():
+            self.assertIn(drone.serial_number, ['DRN_1L', 'DRN_4H'])
+            self.assertEqual(drone.state, Drone.STATE_LOADED)
+            self.assertLessEqual(sum(drone.medication_set.values_list('weight', flat=True)), drone.weight_limit)
+
+    def test_assign_medications_already_loaded(self):
+        """
+        Ensure medications already loaded on a drone are rejected instead of being moved to another one.
+        """
+        self.client.post(reverse('drone-load-with-medication', kwargs={'pk': 1}), {'medication_set': [1]})
+        response = self.client.post(reverse('drone-assign-medications'), {'medication_set': [1]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['rejected'], [1])
+        self.assertEqual(Medication.objects.get(pk=1).drone_id, 1)
+
+    def test_assign_medications_empty(self):
+        """
+        Ensure we get a BAD REQUEST response when no medications are sent.
+        """
+        response = self.client.post(reverse('drone-assign-medications'), {'medication_set': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('medication_set', response.data)
+
+    def test_pack_medications(self):
+        """
+        Ensure heavier medications are placed first, each onto the fullest drone that can still carry it.
+        """
+        assignments, unassigned = pack_medications([(1, 50), (2, 200), (3, 100), (4, 300)], [(1, 250), (2, 300)])
+        self.assertEqual(assignments, {2: [4], 1: [2, 1]})
+        self.assertEqual(unassigned, [3])
+
+    def test_packing_benchmark(self):
+        """
+        Ensure packing 10k medications onto 1k drones takes well under a second.
+        """
+        results = benchmarks.packing(medications=10000, drones=1000)
+        self.assertLess(results['seconds'], 0.5)
+
+    def test_list_drones_query_count(self):
+        """
+        Ensure listing drones runs a fixed number of queries (drones and their medications) no matter how many drones
+        and medications exist.
+        """
+        self.assertConstantQueries(2, reverse('drone-list'))
+
+    def test_retrieve_drone_query_count(self):
+        """
+        Ensure retrieving a drone runs a fixed number of queries no matter how many medications it has loaded.
+        """
+        self.assertConstantQueries(2, reverse('drone-detail', kwargs={'pk': 5}))
+
+    def test_get_available_drones_query_count(self):
+        """
+        Ensure getting available drones runs a fixed number of queries no matter how many drones are available.
+        """
+        self.assertConstantQueries(2, reverse('drone-get-available-drones'))
+
+    def test_check_loaded_medications_query_count(self):
+        """
+        Ensure checking the loaded medications runs a fixed number of queries no matter how many there are.
+        """
+        self.assertConstantQueries(2, reverse('drone-check-loaded-medications', kwargs={'pk': 5}))
+
+    def test_check_battery_level_query_count(self):
+        """
+        Ensure checking the battery level runs a single query.
+        """
+        self.assertConstantQueries(1, reverse('drone-check-battery-level', kwargs={'pk': 1}))
+
+    def test_list_drones_keyset_pagination(self):
+        """
+        Ensure following the next links walks every drone once, ordered by highest battery capacity and then by id,
+        and that going back returns the previous page.
+        """
+        self.populate_fleet(7, 0)
+        url = reverse('drone-list') + '?page_size=3'
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            pages.append(response.data)
+            url = response.data['next']
+
+        ids = [drone['id'] for page in pages for drone in page['results']]
+        expected = list(Drone.objects.order_by('-battery_capacity', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertIsNone(pages[0]['previous'])
+
+        response = self.client.get(pages[2]['previous'])
+        self.assertEqual(response.data['results'], pages[1]['results'])
+
+    def test_list_drones_deep_page_query_count(self):
+        """
+        Ensure a deep page runs the same queries as the first one, without any COUNT(*) or OFFSET.
+        """
+        self.populate_fleet(30, 0)
+        url = reverse('drone-list')
+        while True:
+            with self.assertNumQueries(2) as queries:
+                response = self.client.get(url)
+            for query in queries.captured_queries:
+                self.assertNotIn('COUNT(', query['sql'])
+                self.assertNotIn('OFFSET', query['sql'])
+            if response.data['next'] is None:
+                break
+            url = response.data['next']
+
+    def test_list_drones_pagination_stable_when_battery_changes(self):
+        """
+        Ensure drones sharing the same battery capacity are split between pages without repetitions.
+        """
+        self.populate_fleet(5, 0)
+        url = reverse('drone-list') + '?page_size=2'
+        first_page = self.client.get(url).data
+        Drone.objects.filter(id=first_page['results'][0]['id']).update(battery_capacity=5)
+        second_page = self.client.get(first_page['next']).data
+        first_ids = {drone['id'] for drone in first_page['results']}
+        self.assertFalse(first_ids & {drone['id'] for drone in second_page['results']})
+
+    def test_list_drones_invalid_cursor(self):
+        """
+        Ensure we get a NOT FOUND response when the cursor can not be decoded.
+        """
+        response = self.client.get(reverse('drone-list') + '?cursor=invalid')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_invalid_cursor_positions(self):
+        """
+        Ensure we get a NOT FOUND response when the position of a well-formed cursor does not fit the ordered fields.
+        """
+        self.populate_fleet(2, 1)
+        cases = [('drone-list', [None, 1]), ('drone-list', [{'x': 1}, 1]), ('drone-list', ['abc', 1]),
+                 ('drone-list', [50, [1]]), ('drone-list', [10 ** 30, 1]), ('drone-list', [50, 10 ** 30]),
+                 ('drone-list', [50, -10 ** 30]), ('drone-list', [1e400, 1]), ('medication-list', [None, 1]),
+                 ('medication-list', ['abc', 'x']), ('medication-list', [['abc'], 1]),
+                 ('medication-list', ['abc', 10 ** 30])]
+        for name, position in cases:
+            with self.subTest(name=name, position=position):
+                cursor = base64.urlsafe_b64encode(json.dumps({'p': position, 'r': 0}).encode('utf-8')).decode('ascii')
+                response = self.client.get(reverse(name), {'cursor': cursor})
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+                self.assertEqual(response.data['detail'], 'Invalid cursor')
+
+    def test_list_medications_keyset_pagination(self):
+        """
+        Ensure medications are paginated ordered by name and then by id.
+        """
+        self.populate_fleet(3, 2)
+        url = reverse('medication-list') + '?page_size=4'
+        names = []
+        while url:
+            response = self.client.get(url)
+            names += [medication['name'] for medication in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(names, list(Medication.objects.order_by('name', 'id').values_list('name', flat=True)))
+
+
+def make_image(size=(32, 32), format='PNG'):
+    """
+    Return the bytes of a small valid image.
+    """
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color=(200, 30, 30)).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+class MediaRootMixin:
+    """
+    Store the files uploaded by the tests in a temporary media folder.
+    """
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class MedicationImageTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.medication = Medication.objects.create(name='Advil-200', weight=100, code='ADV_200')
+
+    def test_upload_image(self):
+        """
+        Ensure we get an OK response when uploading a valid image as multipart form data, and that it is stored.
+        """
+        content = make_image()
+        url = reverse('medication-upload-image', kwargs={'pk': self.medication.pk})
+        response = self.client.post(url, {'image': SimpleUploadedFile('advil.png', content, 'image/png')},
+                                    format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.medication.refresh_from_db()
+        self.assertEqual(response.data['image'], self.medication.image.url)
+        with self.medication.image.open('rb') as image:
+            self.assertEqual(image.read(), content)
+
+    def test_upload_image_too_large(self):
+        """
+        Ensure we get a REQUEST ENTITY TOO LARGE response when the uploaded image surpasses the maximum size, either
+        from the Content-Length or while receiving it, and that nothing is stored.
+        """
+        url = reverse('medication-upload-image', kwargs={'pk': self.medication.pk})
+        for size in (2 * 1024, 128 * 1024):
+            with mock.patch.object(LimitedSizeUploadHandler, 'max_size', 1024):
+                upload = SimpleUploadedFile('advil.png', b'0' * size, 'image/png')
+                response = self.client.post(url, {'image': upload}, format='multipart')
+            self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.medication.refresh_from_db()
+        self.assertFalse(self.medication.image)
+
+    def test_upload_invalid_image(self):
+        """
+        Ensure we get a BAD REQUEST response when the uploaded file is not an image.
+        """
+        url = reverse('medication-upload-image', kwargs={'pk': self.medication.pk})
+        upload = SimpleUploadedFile('advil.png', b'not an image', 'image/png')
+        response = self.client.post(url, {'image': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', response.data)
+
+    def test_upload_image_generates_derivatives(self):
+        """
+        Ensure the WebP thumbnail and preview of an uploaded image are generated once it is saved, and that their URLs
+        are returned.
+        """
+        url = reverse('medication-upload-image', kwargs={'pk': self.medication.pk})
+        upload = SimpleUploadedFile('advil.png', make_image(size=(1024, 768)), 'image/png')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'image': upload}, format='multipart')
+
+        self.medication.refresh_from_db()
+        for field, size in Medication.DERIVATIVE_SIZES.items():
+            with getattr(self.medication, field).open('rb') as file, Image.open(file) as image:
+                self.assertEqual(image.format, 'WEBP')
+                self.assertLessEqual(image.size, size)
+        response = self.client.get(reverse('medication-detail', kwargs={'pk': self.medication.pk}))
+        self.assertTrue(response.data['thumbnail'].endswith(self.medication.thumbnail.url))
+        self.assertTrue(response.data['preview'].endswith(self.medication.preview.url))
+
+    def test_update_without_image_keeps_derivatives(self):
+        """
+        Ensure saving a medication without replacing its image does not generate its derivatives again.
+        """
+        self.medication.image.save('advil.png', ContentFile(make_image()))
+        self.medication.refresh_from_db()
+        self.medication.name = 'Advil-400'
+        with mock.patch('drones.signals.generate_medication_derivatives') as task:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.medication.save()
+        task.delay.assert_not_called()
+
+    def test_generate_medication_derivatives_command(self):
+        """
+        Ensure the backfill command generates the derivatives of the medication images missing them.
+        """
+        self.medication.image.save('advil.png', ContentFile(make_image()))
+        self.assertFalse(self.medication.thumbnail)
+        call_command('generate_medication_derivatives', stdout=io.StringIO())
+        self.medication.refresh_from_db()
+        self.assertTrue(self.medication.thumbnail)
+        self.assertTrue(self.medication.preview)
+
+    def test_create_medication_with_base64_image(self):
+        """
+        Ensure a base64 encoded image is decoded and stored when creating a medication.
+        """
+        content = make_image()
+        data = {
+            'name': 'Aspirin',
+            'weight': 20,
+            'code': 'ASP_1',
+            'image': 'data:image/png;base64,' + base64.b64encode(content).decode(),
+        }
+        response = self.client.post(reverse('medication-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with Medication.objects.get(pk=response.data['id']).image.open('rb') as image:
+            self.assertEqual(image.read(), content)
+
+    def test_create_medication_with_base64_image_too_large(self):
+        """
+        Ensure we get a BAD REQUEST response when the base64 encoded image surpasses the maximum size.
+        """
+        data = {
+            'name': 'Aspirin',
+            'weight': 20,
+            'code': 'ASP_1',
+            'image': 'data:image/png;base64,' + base64.b64encode(b'0' * (5 * 1024 * 1024 + 1)).decode(),
+        }
+        response = self.client.post(reverse('medication-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['image'], ['The maximum file size that can be uploaded is 5MB'])
+
+
+class ContentAddressedStorageTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        # Bigger than every derivative size, so each derivative is different.
+        self.content = make_image(size=(600, 600))
+        self.medications = [Medication.objects.create(name=f'Advil-{i}', weight=100, code=f'ADV_{i}')
+                            for i in range(2)]
+
+    def upload(self, medication, content):
+        url = reverse('medication-upload-image', kwargs={'pk': medication.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {'image': SimpleUploadedFile('advil.png', content, 'image/png')}, format='multipart')
+        medication.refresh_from_db()
+
+    def collect(self):
+        output = io.StringIO()
+        call_command('collect_media_blobs', grace=0, stdout=output)
+        return output.getvalue()
+
+    def test_identical_images_stored_once(self):
+        """
+        Ensure identical images, and so their derivatives, are stored once and referenced by every medication.
+        """
+        for medication in self.medications:
+            self.upload(medication, self.content)
+
+        first, second = self.medications
+        for field in Medication.FILE_FIELDS:
+            self.assertEqual(getattr(first, field).name, getattr(second, field).name)
+            self.assertEqual(MediaBlob.objects.get(name=getattr(first, field).name).references, 2)
+        self.assertEqual(MediaBlob.objects.stats()['dedup_ratio'], 2.0)
+
+    def test_deleting_medication_releases_blob(self):
+        """
+        Ensure the files are only deleted by the garbage collection once no medication points to them.
+        """
+        for medication in self.medications:
+            self.upload(medication, self.content)
+        image = self.medications[0].image
+
+        self.medications[0].delete()
+        self.collect()
+        self.assertTrue(image.storage.exists(image.name))
+
+        self.medications[1].delete()
+        self.assertIn('Deleted 3 unreferenced files', self.collect())
+        self.assertFalse(image.storage.exists(image.name))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_replacing_image_releases_blob(self):
+        """
+        Ensure replacing the image of a medication releases the previous one and its derivatives.
+        """
+        medication = self.medications[0]
+        self.upload(medication, self.content)
+        previous = {field: getattr(medication, field).name for field in Medication.FILE_FIELDS}
+        self.upload(medication, make_image(size=(64, 64)))
+
+        for field, name in previous.items():
+            self.assertNotEqual(getattr(medication, field).name, name)
+            self.assertEqual(MediaBlob.objects.get(name=name).references, 0)
+        self.collect()
+        self.assertFalse(medication.image.storage.exists(previous['image']))
+        self.assertTrue(medication.image.storage.exists(medication.image.name))
+
+    def test_reused_blob_is_kept(self):
+        """
+        Ensure a released file stored again by an upload is kept by the garbage collection until the upload references
+        it, and stored anew if it was collected before the upload could mark it.
+        """
+        medication = self.medications[0]
+        self.upload(medication, self.content)
+        storage, name = medication.image.storage, medication.image.name
+        medication.delete()
+        MediaBlob.objects.update(updated_at=timezone.now() - timedelta(hours=2))
+
+        self.assertEqual(storage.save('advil.png', ContentFile(self.content)), name)
+        call_command('collect_media_blobs', grace=3600, stdout=io.StringIO())
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(list(MediaBlob.objects.values_list('name', flat=True)), [name])
+
+        # The collection deletes it between the upload finding it and marking it.
+        exists = storage.exists
+        with mock.patch.object(storage, 'exists', side_effect=lambda path: exists(path) or path == name):
+            storage.delete(name)
+            self.assertEqual(storage.save('advil.png', ContentFile(self.content)), name)
+        self.assertTrue(storage.exists(name))
+
+    def test_collect_orphan_files(self):
+        """
+        Ensure files in storage that are not tracked are only deleted when asked to.
+        """
+        storage = self.medications[0].image.storage
+        name = storage.save('orphan.png', ContentFile(self.content))
+        self.collect()
+        self.assertTrue(storage.exists(name))
+        call_command('collect_media_blobs', grace=0, orphans=True, stdout=io.StringIO())
+        self.assertFalse(storage.exists(name))
+
+
+class BatteryLevelCheckTests(QueryCountMixin, APITestCase):
+    def setUp(self):
+        Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,  battery_capacity=50, state='idle')
+        Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300,  battery_capacity=10, state='idle')
+
+    def test_log_drones_battery_levels(self):
+        """
+        Ensure the battery check logs the totals and the level of each drone as JSON lines, and stores a snapshot.
+        """
+        with self.assertLogs('battery-level-check-logger') as logs:
+            totals = tasks.log_drones_battery_levels()
+
+        self.assertEqual(totals, {'total_drones': 2, 'low_battery_drones': 1})
+        lines = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual(lines[0]['event'], 'battery_check')
+        self.assertEqual(lines[0]['low_battery_drones'], 1)
+        self.assertEqual(lines[1]['levels'], {'DRN_1L': 50, 'DRN_2M': 10})
+        self.assertEqual(
+            sorted(BatteryLevelSnapshot.objects.values_list('drone__serial_number', 'battery_level')),
+            [('DRN_1L', 50), ('DRN_2M', 10)]
+        )
+
+    def test_log_drones_battery_levels_query_count(self):
+        """
+        Ensure the battery check runs a fixed number of queries (totals, snapshot and levels) no matter the size of the
+        fleet, logging a line per chunk of drones.
+        """
+        self.populate_fleet(7, 0)
+        with mock.patch.object(tasks, 'BATTERY_CHECK_CHUNK_SIZE', 3):
+            with self.assertLogs('battery-level-check-logger') as logs, self.assertNumQueries(3):
+                tasks.log_drones_battery_levels()
+        self.assertEqual(len(logs.records), 1 + 3)
+        self.assertEqual(BatteryLevelSnapshot.objects.count(), 9)
+
+    def test_battery_shards(self):
+        """
+        Ensure the fleet is split in ranges of ids of the shard size covering every drone, with a query per shard.
+        """
+        self.populate_fleet(7, 0)
+        with self.assertNumQueries(3):
+            shards = tasks.battery_shards(4)
+        self.assertEqual(shards[0][0], None)
+        self.assertEqual(shards[-1][1], None)
+        sizes = [Drone.objects.filter(**{key: value for key, value in (('pk__gte', start), ('pk__lt', stop))
+                                         if value is not None}).count() for start, stop in shards]
+        self.assertEqual(sizes, [4, 4, 1])
+        self.assertEqual(tasks.battery_shards(9), [(None, None)])
+
+    @override_settings(DRONES_BATTERY_CHECK_SHARD_SIZE=1)
+    def test_sharded_battery_check(self):
+        """
+        Ensure the sharded battery check stores the snapshot of every drone, and merges the statistics of the shards
+        into a single report, with an alert listing the drones with low battery.
+        """
+        with self.assertLogs('battery-level-check-logger') as logs:
+            tasks.log_drones_battery_levels()
+
+        lines = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual([line['event'] for line in lines],
+                         ['battery_levels', 'battery_levels', 'battery_check', 'low_battery_alert'])
+        self.assertEqual({**lines[0]['levels'], **lines[1]['levels']}, {'DRN_1L': 50, 'DRN_2M': 10})
+        report = lines[2]
+        self.assertEqual((report['total_drones'], report['low_battery_drones'], report['average_battery_level'],
+                          report['min_battery_level'], report['max_battery_level']), (2, 1, 30, 10, 50))
+        self.assertEqual([shard['drones'] for shard in report['shards']], [1, 1])
+        self.assertTrue(all(shard['seconds'] >= 0 for shard in report['shards']))
+        self.assertEqual(lines[3]['drones'], {'DRN_2M': 10})
+        self.assertEqual(
+            sorted(BatteryLevelSnapshot.objects.values_list('drone__serial_number', 'battery_level')),
+            [('DRN_1L', 50), ('DRN_2M', 10)]
+        )
+        self.assertEqual(BatteryLevelSnapshot.objects.values('taken_at').distinct().count(), 1)
+
+    def test_merge_battery_audit(self):
+        """
+        Ensure merging the shards keeps the drones with the lowest battery across all of them, ignores the empty ones,
+        and warns when the check took longer than its window.
+        """
+        def shard(start, stop, low_battery, levels):
+            return {'start': start, 'stop': stop, 'total_drones': len(levels), 'low_battery_drones': len(low_battery),
+                    'battery_level_sum': sum(levels), 'min_battery_level': min(levels, default=None),
+                    'max_battery_level': max(levels, default=None), 'low_battery': low_battery, 'seconds': 0.5}
+
+        shards = [shard(None, 10, [['A', 5], ['B', 20]], [5, 20, 80]), shard(10, 20, [], []),
+                  shard(20, None, [['C', 1], ['D', 7]], [1, 7])]
+        taken_at = timezone.now() - timedelta(minutes=11)
+        with mock.patch.object(tasks, 'LOW_BATTERY_ALERT_LIMIT', 3), \
+                self.assertLogs('battery-level-check-logger') as logs:
+            report = tasks.merge_battery_audit(shards, taken_at.isoformat())
+
+        self.assertEqual(report['low_battery'], [['C', 1], ['A', 5], ['D', 7]])
+        self.assertEqual((report['total_drones'], report['low_battery_drones'], report['average_battery_level'],
+                          report['min_battery_level'], report['max_battery_level']), (5, 4, 22.6, 1, 80))
+        lines = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual([line['event'] for line in lines], ['battery_check', 'low_battery_alert',
+                                                             'battery_check_overrun'])
+        self.assertEqual(lines[1]['low_battery_drones'], 4)
+
+
+class BatteryHistoryTests(APITestCase):
+    def setUp(self):
+        self.drone = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,
+                                          battery_capacity=50, state='idle')
+        self.start = datetime(2022, 10, 1, tzinfo=dt_timezone.utc)
+
+    def add_snapshots(self, levels, step=timedelta(minutes=10)):
+        BatteryLevelSnapshot.objects.bulk_create([
+            BatteryLevelSnapshot(drone=self.drone, battery_level=level, taken_at=self.start + step * index)
+            for index, level in enumerate(levels)
+        ])
+
+    def test_downsample(self):
+        """
+        Ensure points are merged into buckets of the same duration, weighting averages by samples and skipping empty
+        buckets.
+        """
+        end = self.start + timedelta(hours=3)
+        points = [
+            (self.start, 50, 50, 50, 1),
+            (self.start + timedelta(minutes=30), 30, 40, 35, 3),
+            (self.start + timedelta(hours=2, minutes=15), 20, 20, 20, 1),
+            (end, 10, 10, 10, 1),
+        ]
+        self.assertEqual(downsample(points, self.start, end, 3), [
+            {'start': self.start, 'end': self.start + timedelta(hours=1), 'min': 30, 'avg': 38.75, 'max': 50,
+             'samples': 4},
+            {'start': self.start + timedelta(hours=2), 'end': end, 'min': 20, 'avg': 20.0, 'max': 20, 'samples': 1},
+        ])
+
+    def test_compact(self):
+        """
+        Ensure snapshots older than the cutoff are replaced by hourly rollups, and newer ones are kept.
+        """
+        self.add_snapshots([90, 80, 70, 60, 50, 40, 30, 20])
+        compacted = BatteryLevelSnapshot.objects.compact(before=self.start + timedelta(hours=1))
+
+        self.assertEqual(compacted, 6)
+        self.assertEqual(BatteryLevelSnapshot.objects.count(), 2)
+        rollup = BatteryLevelRollup.objects.get()
+        self.assertEqual((rollup.drone, rollup.hour, rollup.min_level, rollup.max_level, rollup.avg_level, rollup.samples),
+                         (self.drone, self.start, 40, 90, 65, 6))
+
+    def test_rollup_battery_history(self):
+        """
+        Ensure the retention task compacts old snapshots and deletes expired rollups.
+        """
+        # Both snapshots within the same hour, whatever the time the test runs.
+        self.start = (timezone.now() - timedelta(days=30)).replace(minute=0, second=0, microsecond=0)
+        self.add_snapshots([90, 80])
+        BatteryLevelRollup.objects.create(drone=self.drone, hour=timezone.now() - timedelta(days=400), min_level=1,
+                                          max_level=1, avg_level=1, samples=1)
+
+        result = tasks.rollup_battery_history()
+
+        self.assertEqual(result, {'compacted_snapshots': 2, 'expired_rollups': 1})
+        self.assertFalse(BatteryLevelSnapshot.objects.exists())
+        self.assertEqual(BatteryLevelRollup.objects.get().samples, 2)
+
+    def test_battery_history(self):
+        """
+        Ensure the history of a drone merges its rollups and snapshots into the requested buckets.
+        """
+        self.add_snapshots([90, 80, 70, 60, 50, 40, 30, 20])
+        BatteryLevelSnapshot.objects.compact(before=self.start + timedelta(hours=1))
+        url = reverse('drone-battery-history', args=[self.drone.id])
+
+        response = self.client.get(url, {'start': self.start.isoformat(),
+                                         'end': (self.start + timedelta(hours=2)).isoformat(), 'buckets': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(bucket['min'], bucket['avg'], bucket['max'], bucket['samples'])
+                          for bucket in response.data['buckets']], [(40, 65.0, 90, 6), (20, 25.0, 30, 2)])
+
+    def test_battery_history_invalid_range(self):
+        """
+        Ensure a history whose start is not before its end is rejected.
+        """
+        url = reverse('drone-battery-history', args=[self.drone.id])
+        response = self.client.get(url, {'start': self.start.isoformat(), 'end': self.start.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('start', response.data)
+
+class DroneCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.drone = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,
+                                          battery_capacity=50, state='idle')
+        self.other = Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300,
+                                          battery_capacity=60, state='idle')
+        self.medication = Medication.objects.create(name='Advil-200', weight=100, code='ADV_200',
+                                                    image='/media/advil-200.jpg')
+
+    def test_cached_responses(self):
+        """
+        Ensure the hot drone endpoints are served from the cache until something changes.
+        """
+        urls = [reverse('drone-detail', args=[self.drone.id]),
+                reverse('drone-check-battery-level', args=[self.drone.id]),
+                reverse('drone-get-available-drones')]
+        for url in urls:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_etag(self):
+        """
+        Ensure a request with the ETag of the current response gets an empty 304 response, and a new one once the
+        drone changes.
+        """
+        url = reverse('drone-check-battery-level', args=[self.drone.id])
+        etag = self.client.get(url)['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+        self.drone.battery_capacity = 40
+        self.drone.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'battery_level': 40})
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_invalidated_by_drone_changes(self):
+        """
+        Ensure saving or deleting a drone invalidates its responses and the available drones.
+        """
+        available_url = reverse('drone-get-available-drones')
+        self.client.get(available_url)
+        self.client.get(reverse('drone-detail', args=[self.drone.id]))
+
+        self.drone.state = 'loading'
+        self.drone.save()
+        self.assertEqual(self.client.get(reverse('drone-detail', args=[self.drone.id])).data['state'], 'loading')
+        self.assertEqual([drone['id'] for drone in self.client.get(available_url).data], [self.other.id])
+
+        self.other.delete()
+        self.assertEqual(self.client.get(available_url).data, [])
+
+    def test_invalidated_by_load_with_medication(self):
+        """
+        Ensure loading a drone invalidates its cached response and the available drones.
+        """
+        url = reverse('drone-detail', args=[self.drone.id])
+        self.assertEqual(self.client.get(url).data['medication_set'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('drone-load-with-medication', args=[self.drone.id]),
+                             {'medication_set': [self.medication.id]}, format='json')
+
+        self.assertEqual([medication['id'] for medication in self.client.get(url).data['medication_set']],
+                         [self.medication.id])
+        self.assertNotIn(self.drone.id, [drone['id'] for drone in
+                                         self.client.get(reverse('drone-get-available-drones')).data])
+
+    def test_invalidated_by_medication_changes(self):
+        """
+        Ensure changing or unloading a medication invalidates the drones it is and was loaded on.
+        """
+        self.medication.drone = self.drone
+        self.medication.save()
+        url = reverse('drone-detail', args=[self.drone.id])
+        self.client.get(url)
+
+        medication = Medication.objects.get(id=self.medication.id)
+        medication.name = 'Advil-400'
+        medication.save()
+        self.assertEqual(self.client.get(url).data['medication_set'][0]['name'], 'Advil-400')
+
+        medication.drone = self.other
+        medication.save()
+        self.assertEqual(self.client.get(url).data['medication_set'], [])
+
+    def test_invalidated_by_assign_medications(self):
+        """
+        Ensure assigning medications in bulk, which sends no signals, invalidates the drones loaded.
+        """
+        url = reverse('drone-detail', args=[self.drone.id])
+        self.client.get(url)
+
+        self.client.post(reverse('drone-assign-medications'), {'medication_set': [self.medication.id]}, format='json')
+
+        self.assertEqual(self.client.get(url).data['state'], 'loaded')
+
+@override_settings(DRONES_STREAM_COALESCE_SECONDS=0.05)
+class DroneStreamTests(APITestCase):
+    def setUp(self):
+        self.drone = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,
+                                          battery_capacity=50, state='idle')
+        self.other = Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300,
+                                          battery_capacity=60, state='idle')
+        self.medication = Medication.objects.create(name='Advil-200', weight=100, code='ADV_200',
+                                                    image='/media/advil-200.jpg')
+
+    async def connect(self, path):
+        communicator = WebsocketCommunicator(application, path, headers=[(b'origin', b'http://testserver')])
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def save_drone(self, drone, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            for field, value in fields.items():
+                setattr(drone, field, value)
+            drone.save()
+
+    async def test_fleet_stream_coalesces_changes(self):
+        """
+        Ensure the fleet stream sends the changes of every drone, merging bursts into a single message with a delta
+        per drone.
+        """
+        communicator = await self.connect('/ws/drones/')
+        await sync_to_async(self.save_drone)(self.drone, battery_capacity=40)
+        await sync_to_async(self.save_drone)(self.drone, state='loading')
+        await sync_to_async(self.save_drone)(self.other, battery_capacity=55)
+
+        message = await communicator.receive_json_from()
+        self.assertEqual(message, {'type': 'deltas', 'drones': [
+            {'id': self.drone.id, 'battery_capacity': 40, 'state': 'loading'},
+            {'id': self.other.id, 'battery_capacity': 55},
+        ]})
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_drone_stream(self):
+        """
+        Ensure the stream of a drone only sends its own changes, skipping saves that change no streamed field.
+        """
+        communicator = await self.connect(f'/ws/drones/{self.drone.id}/')
+        await sync_to_async(self.save_drone)(self.other, battery_capacity=55)
+        await sync_to_async(self.save_drone)(self.drone, serial_number='DRN_1X')
+        self.assertTrue(await communicator.receive_nothing())
+
+        await sync_to_async(self.save_drone)(self.drone, battery_capacity=30)
+        self.assertEqual(await communicator.receive_json_from(),
+                         {'type': 'deltas', 'drones': [{'id': self.drone.id, 'battery_capacity': 30}]})
+        await communicator.disconnect()
+
+    async def test_drone_stream_not_found(self):
+        """
+        Ensure the stream of a drone that does not exist is rejected.
+        """
+        communicator = WebsocketCommunicator(application, '/ws/drones/999/', headers=[(b'origin', b'http://testserver')])
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+    async def test_load_with_medication_stream(self):
+        """
+        Ensure loading a drone streams its new state and medications.
+        """
+        communicator = await self.connect(f'/ws/drones/{self.drone.id}/')
+
+        def load():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('drone-load-with-medication', args=[self.drone.id]),
+                                 {'medication_set': [self.medication.id]}, format='json')
+
+        await sync_to_async(load)()
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'deltas', 'drones': [
+            {'id': self.drone.id, 'state': 'loaded', 'medication_set': [self.medication.id]},
+        ]})
+        await communicator.disconnect()
+
+    async def test_assign_medications_stream(self):
+        """
+        Ensure assigning medications in bulk, which sends no signals, streams the drones loaded.
+        """
+        communicator = await self.connect('/ws/drones/')
+
+        def assign():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse('drone-assign-medications'), {'medication_set': [self.medication.id]},
+                                 format='json')
+
+        await sync_to_async(assign)()
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'deltas', 'drones': [
+            {'id': self.drone.id, 'state': 'loaded', 'medication_set': [self.medication.id]},
+        ]})
+        await communicator.disconnect()
+
+class BulkTests(MediaRootMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.drone = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,
+                                          battery_capacity=50, state='idle')
+        self.url = reverse('drone-bulk')
+
+    def drone_data(self, serial_number, **fields):
+        return {'serial_number': serial_number, 'model': 'lightweight', 'weight_limit': 250, 'battery_capacity': 50,
+                'state': 'idle', **fields}
+
+    def test_bulk_create_drones(self):
+        """
+        Ensure many drones are created with a query per batch instead of per drone, and returned in order.
+        """
+        data = [self.drone_data(f'DRN_BULK_{i}') for i in range(600)]
+        # Two savepoints, two serial number checks, an INSERT per batch fitting the SQLite parameter limit, and the
+        # (empty) medications of the drones.
+        with self.assertNumQueries(4 + 2 + 5 + 1):
+            response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([drone['serial_number'] for drone in response.data], [item['serial_number'] for item in data])
+        self.assertEqual(response.data[0]['medication_set'], [])
+        self.assertEqual(Drone.objects.count(), 601)
+
+    def test_bulk_create_drones_errors(self):
+        """
+        Ensure nothing is created if any drone is invalid, and the errors of each one are returned in its position,
+        including serial numbers taken or repeated in the request.
+        """
+        data = [
+            self.drone_data('DRN_NEW_1'),
+            self.drone_data('DRN_1L'),
+            self.drone_data('DRN_NEW_2', weight_limit=600),
+            self.drone_data('DRN_NEW_3'),
+            self.drone_data('DRN_NEW_3'),
+        ]
+        response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual(response.data[1], {'serial_number': ['drone with this serial number already exists.']})
+        self.assertEqual(list(response.data[2]), ['weight_limit'])
+        self.assertEqual(response.data[3], {'serial_number': ['This value is repeated in the request.']})
+        self.assertEqual(response.data[4], response.data[3])
+        self.assertEqual(Drone.objects.count(), 1)
+
+    def test_bulk_update_drones(self):
+        """
+        Ensure many drones are updated at once, keeping their own serial number, and that unknown ids are reported.
+        """
+        other = Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300,
+                                     battery_capacity=60, state='idle')
+        data = [{'id': self.drone.id, 'serial_number': 'DRN_1L', 'battery_capacity': 20},
+                {'id': other.id, 'state': 'loading'}]
+        response = self.client.patch(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Drone.objects.get(id=self.drone.id).battery_capacity, 20)
+        self.assertEqual(Drone.objects.get(id=other.id).state, 'loading')
+
+        response = self.client.patch(self.url, [{'id': 999, 'state': 'idle'},
+                                                {'id': other.id, 'serial_number': 'DRN_1L'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {'id': ['Object with id=999 does not exist.']})
+        self.assertEqual(response.data[1], {'serial_number': ['drone with this serial number already exists.']})
+
+    def test_bulk_update_drones_queries(self):
+        """
+        Ensure a bulk change of state checks whether the drones carry medications with the query that loads them,
+        instead of a query per drone.
+        """
+        drones = Drone.objects.bulk_create([
+            Drone(serial_number=f'DRN_LOADING_{i}', model='lightweight', weight_limit=250, battery_capacity=50,
+                  state='loading') for i in range(20)])
+        Medication.objects.bulk_create([Medication(name=f'Load-{i}', weight=10, code=f'LOAD_{i}', drone=drone)
+                                        for i, drone in enumerate(drones)])
+        data = [{'id': drone.id, 'state': 'loaded'} for drone in drones]
+        # Two savepoints, the drones, an UPDATE, and the medications of the drones.
+        with self.assertNumQueries(4 + 1 + 1 + 1):
+            response = self.client.patch(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Drone.objects.filter(state='loaded').count(), 20)
+
+        response = self.client.patch(self.url, [{'id': self.drone.id, 'state': 'loading'},
+                                                {'id': drones[0].id, 'state': 'delivering'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.patch(self.url, [{'id': self.drone.id, 'state': 'loaded'}], format='json')
+        self.assertEqual(response.data[0], {'state': ['The drone carries no medications.']})
+
+    def test_bulk_update_drones_ids(self):
+        """
+        Ensure the ids of a bulk update are validated as integers, and that a drone is updated once per request.
+        """
+        other = Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300,
+                                     battery_capacity=60, state='idle')
+        response = self.client.patch(self.url, [{'id': str(other.id), 'battery_capacity': 40}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Drone.objects.get(id=other.id).battery_capacity, 40)
+
+        data = [{'id': True, 'battery_capacity': 30}, {'id': 'abc'}, {'id': 0}, {'battery_capacity': 30}, 'x',
+                {'id': other.id, 'battery_capacity': 30}, {'id': str(other.id), 'battery_capacity': 20}]
+        response = self.client.patch(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {'id': ['A valid integer is required.']})
+        self.assertEqual(response.data[1], response.data[0])
+        self.assertEqual(response.data[2], {'id': ['Ensure this value is greater than or equal to 1.']})
+        self.assertEqual(response.data[3], {'id': ['This field is required.']})
+        self.assertEqual(response.data[4], {'non_field_errors': ['Invalid data. Expected a dictionary, but got str.']})
+        self.assertEqual(response.data[5], {'id': ['This value is repeated in the request.']})
+        self.assertEqual(response.data[6], response.data[5])
+        self.assertEqual(Drone.objects.get(id=other.id).battery_capacity, 40)
+        self.assertEqual(Drone.objects.get(id=self.drone.id).battery_capacity, 50)
+
+    def test_bulk_update_drones_invalidates_cache(self):
+        """
+        Ensure updating drones in bulk, which sends no signals, invalidates their cached responses.
+        """
+        url = reverse('drone-check-battery-level', args=[self.drone.id])
+        self.client.get(url)
+        self.client.patch(self.url, [{'id': self.drone.id, 'battery_capacity': 20}], format='json')
+        self.assertEqual(self.client.get(url).data, {'battery_level': 20})
+
+    def test_bulk_delete_drones(self):
+        """
+        Ensure many drones are deleted at once, and nothing is deleted if any of them does not exist.
+        """
+        other = Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300,
+                                     battery_capacity=60, state='idle')
+        response = self.client.delete(self.url, {'ids': [self.drone.id, 999]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Drone.objects.count(), 2)
+
+        response = self.client.delete(self.url, {'ids': [self.drone.id, other.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Drone.objects.exists())
+
+    def test_bulk_create_medications(self):
+        """
+        Ensure medications created in bulk store their images, counting their references and generating their
+        derivatives, as saving them one by one does.
+        """
+        image = 'data:image/png;base64,' + base64.b64encode(make_image(size=(600, 600))).decode('ascii')
+        data = [{'name': 'Advil-200', 'weight': 100, 'code': 'ADV_200', 'image': image},
+                {'name': 'Advil-300', 'weight': 300, 'code': 'ADV_300', 'image': image}]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('medication-bulk'), data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        medications = Medication.objects.order_by('id')
+        self.assertEqual(len({medication.image.name for medication in medications}), 1)
+        self.assertEqual(MediaBlob.objects.get(name=medications[0].image.name).references, 2)
+        self.assertTrue(all(medication.thumbnail and medication.preview for medication in medications))
+
+    def test_bulk_create_medications_with_many_images(self):
+        """
+        Ensure a bulk request can carry more images than a single medication request, up to its own body limit.
+        """
+        noise = Image.frombytes('RGB', (1000, 700), random.Random(0).randbytes(1000 * 700 * 3))
+        buffer = io.BytesIO()
+        noise.save(buffer, format='PNG')
+        image = 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+        data = [{'name': f'Advil-{i}', 'weight': 10, 'code': f'ADV_{i}', 'image': image} for i in range(4)]
+        body = json.dumps(data).encode('utf-8')
+        self.assertGreater(len(body), LimitedSizeJSONParser.max_size)
+
+        response = self.client.post(reverse('medication-bulk'), body, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Medication.objects.count(), 4)
+
+        with override_settings(DRONES_BULK_MAX_BODY_SIZE=len(body) - 1):
+            response = self.client.post(reverse('medication-bulk'), body, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        response = self.client.post(reverse('medication-list'), body, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+class ExportTests(QueryCountMixin, APITestCase):
+    def setUp(self):
+        self.drone = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,
+                                          battery_capacity=50, state='idle', latitude=42.5, longitude=-8.25)
+        self.empty_drone = Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300,
+                                                battery_capacity=60, state='idle')
+        self.medication = Medication.objects.create(name='Advil-200', weight=100, code='ADV_200',
+                                                    image='medications/advil.jpg', drone=self.drone)
+        self.unloaded = Medication.objects.create(name='Advil-300', weight=300, code='ADV_300',
+                                                  image='medications/advil.jpg')
+
+    def export(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_export_drones_ndjson(self):
+        """
+        Ensure the drones are exported a JSON object per line, like the drone details, with their loaded medications.
+        """
+        response, content = self.export(reverse('drone-export'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="drones.ndjson"')
+
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([record['id'] for record in records], [self.drone.id, self.empty_drone.id])
+        detail = self.client.get(reverse('drone-detail', args=[self.drone.id])).data
+        self.assertEqual(records[0]['serial_number'], detail['serial_number'])
+        self.assertEqual((records[0]['latitude'], records[0]['longitude']), (detail['latitude'], detail['longitude']))
+        self.assertEqual((records[1]['latitude'], records[1]['longitude']), (None, None))
+        self.assertEqual(records[0]['url'], 'http://testserver' + reverse('drone-detail', args=[self.drone.id]))
+        self.assertEqual(records[0]['medication_set'][0]['image'], detail['medication_set'][0]['image'])
+        self.assertEqual(records[0]['medication_set'][0]['code'], 'ADV_200')
+        self.assertEqual(records[1]['medication_set'], [])
+
+    def test_export_drones_csv(self):
+        """
+        Ensure the drones are exported a CSV row per loaded medication, or a single row with empty medication columns.
+        """
+        response, content = self.export(reverse('drone-export'), type='csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        header, *rows = csv.reader(io.StringIO(content))
+        self.assertEqual(header[:3], ['id', 'url', 'serial_number'])
+        self.assertIn('medication_code', header)
+        rows = [dict(zip(header, row)) for row in rows]
+        self.assertEqual([(row['serial_number'], row['latitude'], row['longitude'], row['medication_code'])
+                          for row in rows],
+                         [('DRN_1L', '42.5', '-8.25', 'ADV_200'), ('DRN_2M', '', '', '')])
+
+    def test_export_medications(self):
+        """
+        Ensure every medication is exported, with the id of the drone it is loaded into.
+        """
+        _, content = self.export(reverse('medication-export'))
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([(record['code'], record['drone']) for record in records],
+                         [('ADV_200', self.drone.id), ('ADV_300', None)])
+
+        response, content = self.export(reverse('medication-export'), type='csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="medications.csv"')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual([(row['code'], row['drone']) for row in rows],
+                         [('ADV_200', str(self.drone.id)), ('ADV_300', '')])
+
+    def test_export_queries(self):
+        """
+        Ensure exporting the drones runs two queries however many drones and medications there are.
+        """
+        for drones, medications_per_drone in ((1, 1), (5, 3)):
+            self.populate_fleet(drones, medications_per_drone)
+            with self.assertNumQueries(2):
+                self.export(reverse('drone-export'), type='csv')
+
+    def test_export_invalid_type(self):
+        """
+        Ensure an unknown export type is rejected.
+        """
+        response = self.client.get(reverse('drone-export'), {'type': 'xml'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('type', response.data)
+
+
+class FieldsetTests(APITestCase):
+    def setUp(self):
+        self.drone = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,
+                                          battery_capacity=50, state='idle')
+        Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300, battery_capacity=60,
+                             state='idle')
+        self.medications = [
+            Medication.objects.create(name=f'Advil-{i}', weight=10, code=f'ADV_{i}', image='/media/advil.jpg',
+                                      drone=self.drone) for i in range(2)
+        ]
+
+    def test_sparse_fields(self):
+        """
+        Ensure only the fields requested are returned, in their usual order.
+        """
+        response = self.client.get(reverse('drone-list'), {'fields': 'state,id,battery_capacity'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][1], {'id': self.drone.id, 'battery_capacity': 50, 'state': 'idle'})
+        self.assertEqual([list(drone) for drone in response.data['results']], [['id', 'battery_capacity', 'state']] * 2)
+
+        response = self.client.get(reverse('drone-detail', args=[self.drone.id]), {'fields': 'serial_number'})
+        self.assertEqual(response.data, {'serial_number': 'DRN_1L'})
+        response = self.client.get(reverse('medication-detail', args=[self.medications[0].id]),
+                                   {'fields': 'name,drone'})
+        self.assertEqual(response.data, {'name': 'Advil-0',
+                                          'drone': f'http://testserver/drones/{self.drone.id}/'})
+
+    def test_expand(self):
+        """
+        Ensure the medications of the drones are listed by id unless expanded, and nested in full by default.
+        """
+        url = reverse('drone-detail', args=[self.drone.id])
+        medication_ids = [medication.id for medication in self.medications]
+        self.assertEqual(self.client.get(url, {'fields': 'medication_set'}).data, {'medication_set': medication_ids})
+
+        expanded = self.client.get(url, {'fields': 'id', 'expand': 'medication_set'}).data
+        self.assertEqual(list(expanded), ['id', 'medication_set'])
+        self.assertEqual([medication['name'] for medication in expanded['medication_set']], ['Advil-0', 'Advil-1'])
+        self.assertEqual(expanded['medication_set'], self.client.get(url).data['medication_set'])
+
+    def test_sparse_fields_prune_queries(self):
+        """
+        Ensure the columns of the fields left out are not read, nor the medications when they are not requested.
+        """
+        for fast in (True, False):
+            with self.subTest(fast=fast), override_settings(DRONES_FAST_SERIALIZERS=fast):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse('drone-list'), {'fields': 'id,state'})
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(len(queries), 1)
+                self.assertNotIn('serial_number', queries[0]['sql'])
+
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(reverse('drone-list'), {'fields': 'medication_set'})
+                self.assertEqual(len(queries), 2)
+                self.assertNotIn('"drones_medication"."name"', queries[1]['sql'].split(' FROM ')[0])
+
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get(reverse('medication-list'), {'fields': 'code'})
+                self.assertNotIn('"drones_medication"."image"', queries[0]['sql'])
+
+    def test_sparse_pages(self):
+        """
+        Ensure the pages of a sparse fieldset follow each other, without the fields the pagination orders by.
+        """
+        response = self.client.get(reverse('drone-list'), {'fields': 'serial_number', 'page_size': 1})
+        self.assertEqual(response.data['results'], [{'serial_number': 'DRN_2M'}])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.data['results'], [{'serial_number': 'DRN_1L'}])
+
+    def test_invalid_fields(self):
+        """
+        Ensure unknown fields and relations that cannot be expanded are rejected.
+        """
+        for url, query, error in (
+            (reverse('drone-list'), {'fields': 'id,color'}, {'fields': ['Unknown fields: color.']}),
+            (reverse('drone-list'), {'fields': 'distance'}, {'fields': ['Unknown fields: distance.']}),
+            (reverse('drone-detail', args=[self.drone.id]), {'expand': 'state'}, {'expand': ['Cannot expand: state.']}),
+            (reverse('medication-list'), {'expand': 'drone'}, {'expand': ['Cannot expand: drone.']}),
+        ):
+            with self.subTest(url=url, **query):
+                response = self.client.get(url, query)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertEqual(response.data, error)
+
+
+class CompressionTests(APITestCase):
+    def setUp(self):
+        for i in range(20):
+            Drone.objects.create(serial_number=f"DRN_{i}", model="lightweight", weight_limit=250, battery_capacity=50,
+                                 state='idle')
+        self.url = reverse('drone-list')
+
+    def test_choose_encoding(self):
+        """
+        Ensure the encoding the client prefers is chosen, Brotli over gzip when it accepts both as much.
+        """
+        for header, encoding in (('gzip, deflate, br', 'br'), ('gzip', 'gzip'), ('br;q=0.5, gzip', 'gzip'),
+                                 ('*', 'br'), ('*, br;q=0', 'gzip'), ('identity', None), ('', None),
+                                 ('gzip;q=0', None), ('gzip;q=abc, br', 'br')):
+            with self.subTest(header=header):
+                self.assertEqual(compression.choose_encoding(header), encoding)
+        with mock.patch('drones.compression.brotli', None):
+            self.assertEqual(compression.choose_encoding('gzip, deflate, br'), 'gzip')
+            self.assertIsNone(compression.choose_encoding('br'))
+
+    def test_gzip(self):
+        """
+        Ensure large responses are compressed with gzip, and short ones are not.
+        """
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertLess(len(response.content), len(plain.content) / 4)
+
+        response = self.client.get(self.url, {'fields': 'id', 'page_size': 1}, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    @skipUnless(compression.brotli, 'The brotli package is not installed.')
+    def test_brotli(self):
+        """
+        Ensure large responses are compressed with Brotli when the client accepts it, also when streamed.
+        """
+        plain = self.client.get(self.url)
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(response.content), plain.content)
+
+        plain = b''.join(self.client.get(reverse('drone-export')).streaming_content)
+        response = self.client.get(reverse('drone-export'), HTTP_ACCEPT_ENCODING='br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli.decompress(b''.join(response.streaming_content)), plain)
+
+    def test_etag(self):
+        """
+        Ensure compressed responses have a weak ETag, which conditional requests still match.
+        """
+        url = reverse('drone-get-available-drones')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class SchemaTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'api-schema.json')
+        settings_override = override_settings(DRONES_API_SCHEMA_FILE=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # Forget the schema loaded by other tests.
+        loaded = mock.patch.object(schema, '_loaded', (None, None, None))
+        loaded.start()
+        self.addCleanup(loaded.stop)
+        self.url = reverse('api-schema')
+
+    def test_generate_schema(self):
+        """
+        Ensure the command writes the schema of every endpoint, for any host.
+        """
+        call_command('generate_schema', stdout=io.StringIO())
+        with open(self.path, 'rb') as file:
+            document = json.load(file)
+        self.assertIn('/drones/nearest/', document['paths'])
+        self.assertIn('/medications/{id}/', document['paths'])
+        self.assertNotIn('host', document)
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['api-schema.json'])
+
+    def test_served_from_file(self):
+        """
+        Ensure the schema is served from the file with a strong ETag and a long max-age, and read again when the file
+        changes.
+        """
+        call_command('generate_schema', stdout=io.StringIO())
+        with open(self.path, 'rb') as file:
+            content = file.read()
+        with mock.patch('drones.schema.generate_schema') as generate_schema:
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.content, content)
+            self.assertEqual(response['Content-Type'], schema.CONTENT_TYPE)
+            self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+            etag = response['ETag']
+            self.assertTrue(etag.startswith('"'))
+
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            response = self.client.get(reverse('schema-swagger-ui'), {'format': 'openapi'})
+            self.assertEqual(response.content, content)
+
+            with open(self.path, 'wb') as file:
+                file.write(b'{"swagger": "2.0"}')
+            stat = os.stat(self.path)
+            os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.content, b'{"swagger": "2.0"}')
+            self.assertNotEqual(response['ETag'], etag)
+            generate_schema.assert_not_called()
+
+    def test_generated_once_without_file(self):
+        """
+        Ensure the schema is generated on the first request when the file is missing, and kept for the next ones.
+        """
+        with mock.patch('drones.schema.generate_schema', wraps=schema.generate_schema) as generate_schema:
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+        self.assertEqual(generate_schema.call_count, 1)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertIn('/drones/', json.loads(first.content)['paths'])
+
+    def test_ui_reads_served_schema(self):
+        """
+        Ensure the UIs load the schema from its own URL, without generating it.
+        """
+        with mock.patch('drones.schema.generate_schema') as generate_schema:
+            for name in ('schema-swagger-ui', 'schema-redoc'):
+                with self.subTest(name=name):
+                    response = self.client.get(reverse(name))
+                    self.assertEqual(response.status_code, status.HTTP_200_OK)
+                    self.assertContains(response, self.url)
+        generate_schema.assert_not_called()
+
+    def test_docs_disabled(self):
+        """
+        Ensure drf_yasg is not imported when the docs are disabled.
+        """
+        code = ('import sys, django; django.setup(); '
+                'import drones_musala.urls, drones.views, drones.async_views, drones.tasks; '
+                'print(",".join(name for name in sys.modules if name.startswith("drf_yasg")))')
+        environment = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'drones_musala.settings', 'DRONES_API_DOCS': '0'}
+        result = subprocess.run([sys.executable, '-c', code], env=environment, capture_output=True, text=True,
+                                cwd=settings.BASE_DIR, check=True)
+        self.assertEqual(result.stdout.strip(), '')
+
+
+class FastSerializerTests(APITestCase):
+    def setUp(self):
+        self.drone = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,
+                                          battery_capacity=50, state='idle', latitude=52.52, longitude=13.405)
+        Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300, battery_capacity=60,
+                             state='idle')
+        self.medication = Medication.objects.create(name='Advil-200', weight=100.5, code='ADV_200',
+                                                    image='medication_pictures/advil.jpg',
+                                                    thumbnail='medication_pictures/derivatives/advil.jpg',
+                                                    drone=self.drone)
+        Medication.objects.create(name='Ácido-\u2028', weight=3, code='ACD_1', image='')
+
+    def assertSameResponses(self, url):
+        """
+        Ensure a GET to `url` returns the same bytes with and without the fast serializers and renderer.
+        """
+        cache.clear()
+        fast = self.client.get(url)
+        cache.clear()
+        # Without orjson the renderer falls back to DRF's.
+        with override_settings(DRONES_FAST_SERIALIZERS=False), mock.patch('drones.renderers.orjson', None):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_float_exponents(self):
+        """
+        Ensure floats written with an exponent, e.g. huge or tiny weights, only differ in the format of the exponent.
+        """
+        Medication.objects.create(name='Heavy-1', weight=1e16, code='HVY_1', image='')
+        Medication.objects.create(name='Light-1', weight=1e-7, code='LGT_1', image='')
+        self.assertEqual(FastJSONRenderer().render({'weights': [1e16, 1e-7, 100.5]}), b'{"weights":[1e16,1e-7,100.5]}')
+        self.assertEqual(JSONRenderer().render({'weights': [1e16, 1e-7, 100.5]}),
+                         b'{"weights":[1e+16,1e-07,100.5]}')
+
+        url = reverse('medication-list')
+        fast = self.client.get(url)
+        with override_settings(DRONES_FAST_SERIALIZERS=False), mock.patch('drones.renderers.orjson', None):
+            slow = self.client.get(url)
+        self.assertIn(b'"weight":1e16', fast.content)
+        self.assertIn(b'"weight":1e+16', slow.content)
+        self.assertEqual(json.loads(fast.content), json.loads(slow.content))
+
+    def test_same_drone_responses(self):
+        """
+        Ensure the fast path renders the drone lists and details exactly like the serializers.
+        """
+        self.assertSameResponses(reverse('drone-list'))
+        self.assertSameResponses(reverse('drone-list') + '?page_size=1')
+        self.assertSameResponses(reverse('drone-detail', args=[self.drone.id]))
+        self.assertSameResponses(reverse('drone-get-available-drones'))
+        self.assertSameResponses(reverse('drone-nearest') + '?latitude=52.5&longitude=13.4')
+
+    def test_same_medication_responses(self):
+        """
+        Ensure the fast path renders the medication lists and details exactly like the serializers.
+        """
+        self.assertSameResponses(reverse('medication-list'))
+        self.assertSameResponses(reverse('medication-detail', args=[self.medication.id]))
+
+    def test_same_sparse_responses(self):
+        """
+        Ensure the fast path renders the sparse fieldsets exactly like the serializers.
+        """
+        for query in ('fields=id,state,battery_capacity', 'fields=url,medication_set', 'fields=model&expand=medication_set',
+                      'expand=medication_set', 'fields=latitude,longitude&page_size=1'):
+            with self.subTest(query=query):
+                self.assertSameResponses(reverse('drone-list') + '?' + query)
+                self.assertSameResponses(reverse('drone-detail', args=[self.drone.id]) + '?' + query)
+                self.assertSameResponses(reverse('drone-get-available-drones') + '?' + query)
+                self.assertSameResponses(reverse('drone-nearest') + '?latitude=52.5&longitude=13.4&' + query)
+        self.assertSameResponses(reverse('drone-nearest') + '?latitude=52.5&longitude=13.4&fields=id,distance')
+        for query in ('fields=name,drone', 'fields=url,image,thumbnail,preview&code=ADV'):
+            with self.subTest(query=query):
+                self.assertSameResponses(reverse('medication-list') + '?' + query)
+                self.assertSameResponses(reverse('medication-detail', args=[self.medication.id]) + '?' + query)
+
+    def test_fast_path_pagination(self):
+        """
+        Ensure the pages of the fast path follow each other like the ones of the serializers.
+        """
+        response = self.client.get(reverse('drone-list'), {'page_size': 1})
+        self.assertEqual(response.data['results'][0]['serial_number'], 'DRN_2M')
+        self.assertSameResponses(response.data['next'])
+
+    def test_fast_path_not_found(self):
+        """
+        Ensure the fast path answers unknown drones and medications with a not found error.
+        """
+        self.assertEqual(self.client.get(reverse('drone-detail', args=[999])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(reverse('medication-detail', args=[999])).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_fast_renderer(self):
+        """
+        Ensure the fast renderer gives the same output as DRF's JSON renderer, including the types orjson encodes
+        differently.
+        """
+        data = {'taken_at': datetime(2022, 10, 1, 12, 30, tzinfo=dt_timezone.utc), 'weight': Decimal('1.50'),
+                'name': 'Ácido-\u2028\u2029', 'levels': (1, 2.5, None), 'ids': {3}, 1: 'non-string key'}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+
+class MedicationFilterTests(APITestCase):
+    def setUp(self):
+        drone = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=500, battery_capacity=50,
+                                     state='loaded')
+        for name, code, weight, loaded in [('Advil-200', 'ADV_200', 200, True), ('Advil-400', 'ADV_400', 400, False),
+                                           ('Tylenol-500', 'TYL_500', 500, False), ('advanced-care', 'ACR_1', 20, True)]:
+            Medication.objects.create(name=name, weight=weight, code=code, image='/media/medication.jpg',
+                                      drone=drone if loaded else None)
+        self.url = reverse('medication-list')
+
+    def names(self, **query):
+        response = self.client.get(self.url, query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [medication['name'] for medication in response.data['results']]
+
+    def test_filters(self):
+        """
+        Ensure the medications are filtered by name and code prefix, weight range and whether they are loaded.
+        """
+        self.assertEqual(self.names(code='ADV'), ['Advil-200', 'Advil-400'])
+        self.assertEqual(self.names(code='ADV_4'), ['Advil-400'])
+        self.assertEqual(self.names(code='adv'), [])
+        self.assertEqual(self.names(name='Adv'), ['Advil-200', 'Advil-400'])
+        self.assertEqual(self.names(min_weight=200, max_weight=400), ['Advil-200', 'Advil-400'])
+        self.assertEqual(self.names(max_weight=100), ['advanced-care'])
+        self.assertEqual(self.names(loaded='false'), ['Advil-400', 'Tylenol-500'])
+        self.assertEqual(self.names(loaded='true', code='ADV'), ['Advil-200'])
+        self.assertEqual(len(self.names()), 4)
+
+    def test_prefix_ending_in_highest_characters(self):
+        """
+        Ensure prefixes ending in the highest code point, or in the one before the surrogates, filter the medications.
+        """
+        highest = chr(sys.maxunicode)
+        Medication.objects.create(name=f'Zinc{highest}', weight=10, code=f'ZNC{highest}', image='/media/medication.jpg')
+        Medication.objects.create(name='Zinc\ud7ff', weight=10, code='ZNC\ud7ff', image='/media/medication.jpg')
+        for field in ('name', 'code'):
+            with self.subTest(field=field):
+                self.assertEqual(self.names(**{field: highest}), [])
+                self.assertEqual(self.names(**{field: highest * 2}), [])
+        self.assertEqual(self.names(name=f'Zinc{highest}'), [f'Zinc{highest}'])
+        self.assertEqual(self.names(code=f'ZNC{highest}'), [f'Zinc{highest}'])
+        self.assertEqual(self.names(name='Zinc\ud7ff'), ['Zinc\ud7ff'])
+        self.assertEqual(self.names(name='Zinc'), ['Zinc\ud7ff', f'Zinc{highest}'])
+
+    def test_search(self):
+        """
+        Ensure the search finds the medications whose name or code contain the text, ignoring case.
+        """
+        self.assertEqual(self.names(search='adv'), ['Advil-200', 'Advil-400', 'advanced-care'])
+        self.assertEqual(self.names(search='L-4'), ['Advil-400'])
+        self.assertEqual(self.names(search='TYL_5'), ['Tylenol-500'])
+        self.assertEqual(self.names(search='"x"'), [])
+        self.assertEqual(self.names(search='adv', loaded='false'), ['Advil-400'])
+
+    def test_search_follows_changes(self):
+        """
+        Ensure the search sees the medications created, renamed and deleted, also by bulk queries.
+        """
+        Medication.objects.filter(code='TYL_500').update(name='Paracetamol-500')
+        Medication.objects.filter(code='ADV_200').delete()
+        Medication.objects.bulk_create([Medication(name='Paracetamol-1000', weight=100, code='PAR_1000',
+                                                   image='/media/medication.jpg')])
+        self.assertEqual(self.names(search='paracetamol'), ['Paracetamol-1000', 'Paracetamol-500'])
+        self.assertEqual(self.names(search='tylenol'), [])
+        self.assertEqual(self.names(search='advil'), ['Advil-400'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'The search table and its triggers are specific to SQLite.')
+    def test_install_search_indexes(self):
+        """
+        Ensure the search table is filled again when a trigger was missing, e.g. after a migration rebuilt the table.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER drones_medication_search_update')
+        Medication.objects.filter(code='TYL_500').update(name='Paracetamol-500')
+        install_search_indexes()
+        Medication.objects.filter(code='ADV_400').update(name='Ibuprofen-400')
+        self.assertEqual(self.names(search='paracetamol'), ['Paracetamol-500'])
+        self.assertEqual(self.names(search='ibuprofen'), ['Ibuprofen-400'])
+
+    def test_search_without_trigram_tokenizer(self):
+        """
+        Ensure that on SQLite versions without the trigram tokenizer no search table is created, and the search scans
+        the medications instead.
+        """
+        with mock.patch('drones.filters.sqlite_trigram_available', return_value=False):
+            with self.assertNumQueries(0):
+                install_search_indexes()
+            self.assertEqual(self.names(search='adv'), ['Advil-200', 'Advil-400', 'advanced-care'])
+            self.assertEqual(self.names(search='L-4'), ['Advil-400'])
+            self.assertEqual(self.names(search='TYL_5'), ['Tylenol-500'])
+            self.assertEqual(self.names(search='A_V'), [])
+
+    def test_invalid_filters(self):
+        """
+        Ensure invalid filters are rejected.
+        """
+        for query, field in (({'search': 'ad'}, 'search'), ({'min_weight': 'heavy'}, 'min_weight'),
+                             ({'min_weight': 300, 'max_weight': 200}, 'min_weight'), ({'loaded': 'maybe'}, 'loaded')):
+            with self.subTest(**query):
+                response = self.client.get(self.url, query)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn(field, response.data)
+
+class NearestDroneTests(APITestCase):
+    def setUp(self):
+        # Around the Brandenburg Gate, in Berlin.
+        self.latitude, self.longitude = 52.5163, 13.3777
+        self.url = reverse('drone-nearest')
+
+    def create_drone(self, serial_number, latitude, longitude, **fields):
+        fields = {'model': 'heavyweight', 'weight_limit': 500, 'battery_capacity': 90, 'state': 'idle', **fields}
+        return Drone.objects.create(serial_number=serial_number, latitude=latitude, longitude=longitude, **fields)
+
+    def nearest(self, **query):
+        response = self.client.get(self.url, {'latitude': self.latitude, 'longitude': self.longitude, **query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [drone['serial_number'] for drone in response.data]
+
+    def test_nearest(self):
+        """
+        Ensure the nearest available drones that can carry the weight are returned nearest first, with their distance.
+        """
+        self.create_drone('DRN_FAR', 52.53, 13.3777)
+        self.create_drone('DRN_NEAR', 52.5164, 13.3777)
+        self.create_drone('DRN_MIDDLE', 52.52, 13.39)
+        self.create_drone('DRN_LIGHT', 52.5163, 13.3778, weight_limit=100)
+        self.create_drone('DRN_LOW_BATTERY', 52.5163, 13.3778, battery_capacity=20)
+        self.create_drone('DRN_BUSY', 52.5163, 13.3778, state='loaded')
+        Drone.objects.create(serial_number='DRN_NOWHERE', model='heavyweight', weight_limit=500, battery_capacity=90,
+                             state='idle')
+
+        response = self.client.get(self.url, {'latitude': self.latitude, 'longitude': self.longitude, 'weight': 200})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([drone['serial_number'] for drone in response.data], ['DRN_NEAR', 'DRN_MIDDLE', 'DRN_FAR'])
+        self.assertAlmostEqual(response.data[0]['distance'], 11.1, places=1)
+        self.assertEqual(response.data[0]['latitude'], 52.5164)
+        self.assertEqual(self.nearest(k=2), ['DRN_LIGHT', 'DRN_NEAR'])
+
+    def test_nearest_matches_scan(self):
+        """
+        Ensure the lookup through the grid finds the same drones as computing the distance to every one of them,
+        around the city, across the antimeridian, near the poles, and far from any drone.
+        """
+        rng = random.Random(0)
+        positions = [(rng.uniform(52.4, 52.6), rng.uniform(13.2, 13.6)) for _ in range(200)]
+        positions += [(rng.uniform(-1, 1), rng.choice([rng.uniform(179, 180), rng.uniform(-180, -179)]))
+                      for _ in range(50)]
+        positions += [(rng.uniform(89.5, 90), rng.uniform(-180, 180)) for _ in range(20)]
+        positions += [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(30)]
+        Drone.objects.bulk_create([
+            Drone(serial_number=f'DRN_{i}', model='heavyweight', weight_limit=500, battery_capacity=90, state='idle',
+                  latitude=latitude, longitude=longitude) for i, (latitude, longitude) in enumerate(positions)
+        ])
+        drones = list(Drone.objects.values_list('id', 'latitude', 'longitude'))
+
+        for latitude, longitude in [(52.5, 13.4), (52.45, 13.25), (0, 180), (0.5, -179.99), (89.9, 0), (-60, 100)]:
+            for k in (1, 5, 40):
+                with self.subTest(latitude=latitude, longitude=longitude, k=k):
+                    expected = sorted((geo.distance(latitude, longitude, drone_latitude, drone_longitude), pk)
+                                      for pk, drone_latitude, drone_longitude in drones)[:k]
+                    self.assertEqual(Drone.objects.nearest(latitude, longitude, k), expected)
+
+    def test_grid_cell_follows_position(self):
+        """
+        Ensure the grid cell of a drone is kept up to date when its position changes, also by the bulk endpoints.
+        """
+        drone = self.create_drone('DRN_1', 52.5, 13.4)
+        self.assertEqual(drone.grid_cell, geo.cell(52.5, 13.4))
+        drone.latitude, drone.longitude = None, None
+        drone.save()
+        self.assertIsNone(Drone.objects.get(pk=drone.pk).grid_cell)
+
+        response = self.client.post(reverse('drone-bulk'), [
+            {'serial_number': 'DRN_2', 'model': 'lightweight', 'weight_limit': 250, 'battery_capacity': 50,
+             'state': 'idle', 'latitude': -33.86, 'longitude': 151.21},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        created = Drone.objects.get(serial_number='DRN_2')
+        self.assertEqual(created.grid_cell, geo.cell(-33.86, 151.21))
+
+        response = self.client.patch(reverse('drone-bulk'), [
+            {'id': drone.pk, 'latitude': 40.71, 'longitude': -74.01}, {'id': created.pk, 'battery_capacity': 60},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Drone.objects.get(pk=drone.pk).grid_cell, geo.cell(40.71, -74.01))
+        self.assertEqual(Drone.objects.get(pk=created.pk).grid_cell, geo.cell(-33.86, 151.21))
+
+    def test_position_validation(self):
+        """
+        Ensure a drone has both a latitude and a longitude or none, within their ranges.
+        """
+        drone = self.create_drone('DRN_1', 52.5, 13.4)
+        url = reverse('drone-detail', args=[drone.id])
+        self.assertEqual(self.client.patch(url, {'longitude': 13.5}, format='json').status_code, status.HTTP_200_OK)
+        response = self.client.patch(url, {'latitude': None}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['non_field_errors'],
+                         ['Set both the latitude and the longitude of the drone, or none.'])
+        self.assertEqual(self.client.patch(url, {'latitude': None, 'longitude': None}, format='json').status_code,
+                         status.HTTP_200_OK)
+        response = self.client.patch(url, {'latitude': 91, 'longitude': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('latitude', response.data)
+        response = self.client.patch(url, {'latitude': 'nan', 'longitude': 0}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['latitude'], ['Enter a finite number.'])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Drone.objects.filter(pk=drone.pk).update(latitude=10)
+
+    def test_invalid_query(self):
+        """
+        Ensure invalid positions, weights and numbers of drones are rejected.
+        """
+        for query, field in (({'longitude': 13.4}, 'latitude'), ({'latitude': 52.5, 'longitude': 181}, 'longitude'),
+                             ({'latitude': 52.5, 'longitude': 13.4, 'weight': -1}, 'weight'),
+                             ({'latitude': 52.5, 'longitude': 13.4, 'k': 0}, 'k'),
+                             ({'latitude': 'nan', 'longitude': 0}, 'latitude'),
+                             ({'latitude': 0, 'longitude': 'nan'}, 'longitude'),
+                             ({'latitude': 0, 'longitude': '-inf'}, 'longitude'),
+                             ({'latitude': 0, 'longitude': 0, 'weight': 'inf'}, 'weight'),
+                             ({'latitude': 0, 'longitude': 0, 'weight': 'nan'}, 'weight')):
+            with self.subTest(**query):
+                response = self.client.get(self.url, query)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn(field, response.data)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Reads the SQLite query plans.')
+class QueryPlanTests(QueryCountMixin, APITestCase):
+    def setUp(self):
+        self.populate_fleet(20, 2)
+        Drone.objects.filter(id__in=Drone.objects.order_by('id').values('id')[:10]).update(state='loaded',
+                                                                                           battery_capacity=10)
+        self.drone = Drone.objects.first()
+
+    def assertNoTableScans(self, url):
+        """
+        Ensure every query run by a GET to `url` reads its tables through an index, instead of scanning all of them.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for query in queries.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plan = [row[-1] for row in cursor.fetchall()]
+            scans = [step for step in plan if re.fullmatch(r'SCAN \S+', step)]
+            self.assertEqual(scans, [], f'{url} scans a whole table in: {query["sql"]}')
+
+    def test_drone_queries_use_indexes(self):
+        """
+        Ensure the drone endpoints read the drones and their medications through indexes.
+        """
+        cache.clear()
+        self.assertNoTableScans(reverse('drone-list'))
+        next_page = self.client.get(reverse('drone-list'), {'page_size': 5}).data['next']
+        self.assertNoTableScans(next_page)
+        self.assertNoTableScans(reverse('drone-detail', args=[self.drone.id]))
+        self.assertNoTableScans(reverse('drone-get-available-drones'))
+        self.assertNoTableScans(reverse('drone-check-loaded-medications', args=[self.drone.id]))
+
+    def test_nearest_drones_use_cell_index(self):
+        """
+        Ensure the nearest drones are looked up through the index of the cells of the available drones.
+        """
+        for i, drone in enumerate(Drone.objects.order_by('id')):
+            drone.latitude, drone.longitude = 52.5 + i * 0.001, 13.4
+            drone.save()
+        url = reverse('drone-nearest') + '?latitude=52.5&longitude=13.4'
+        self.assertNoTableScans(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + queries.captured_queries[0]['sql'])
+            self.assertIn('USING INDEX drone_idle_cell_idx', cursor.fetchall()[-1][-1])
+
+    def test_medication_queries_use_indexes(self):
+        """
+        Ensure the medication pages are read through an index.
+        """
+        self.assertNoTableScans(reverse('medication-list'))
+        next_page = self.client.get(reverse('medication-list'), {'page_size': 5}).data['next']
+        self.assertNoTableScans(next_page)
+
+    def test_medication_filters_use_indexes(self):
+        """
+        Ensure the filtered medication pages are read through an index.
+        """
+        for query in ({'code': 'FLT_1'}, {'name': 'Fleet-1'}, {'min_weight': 1, 'max_weight': 2}, {'loaded': 'false'},
+                      {'search': 'leet-1'}):
+            with self.subTest(**query):
+                self.assertNoTableScans(f'{reverse("medication-list")}?{urlencode(query)}')
+
+    def test_query_plans(self):
+        """
+        Ensure the available drones are read from the partial index of idle drones, and the drones low on battery from
+        the battery index.
+        """
+        plan = Drone.objects.available().explain()
+        self.assertIn('USING INDEX drone_idle_battery_idx', plan)
+        plan = Drone.objects.filter(battery_capacity__lt=MIN_BATTERY_LEVEL).explain()
+        self.assertIn('SEARCH drones_drone USING INDEX drone_battery_id_idx', plan)
+
+    def test_check_constraints(self):
+        """
+        Ensure the database itself rejects battery levels out of 0-100 and weight limits above 500.
+        """
+        for fields in ({'battery_capacity': 101}, {'weight_limit': 501}):
+            with self.subTest(**fields), self.assertRaises(IntegrityError), transaction.atomic():
+                Drone.objects.filter(id=self.drone.id).update(**fields)
+
+
+class SettingsTests(SimpleTestCase):
+    def test_settings_do_not_depend_on_the_command(self):
+        """
+        Ensure the shipped settings use Redis whatever the command, the tests running with their own settings instead.
+        """
+        code = ('import sys; sys.argv = ["manage.py", "test"]; from drones_musala import settings; '
+                'print(settings.CACHES["default"]["BACKEND"], settings.CHANNEL_LAYERS["default"]["BACKEND"], '
+                'getattr(settings, "CELERY_TASK_ALWAYS_EAGER", False))')
+        environment = {**os.environ, 'REDIS_CACHE_URL': 'redis://redis:6379/1'}
+        result = subprocess.run([sys.executable, '-c', code], env=environment, capture_output=True, text=True,
+                                cwd=settings.BASE_DIR, check=True)
+        self.assertEqual(result.stdout.split(), ['django_redis.cache.RedisCache',
+                                                 'channels_redis.core.RedisChannelLayer', 'False'])
+        self.assertEqual(settings.CACHES['default']['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertTrue(settings.CELERY_TASK_ALWAYS_EAGER)
+
+
+class SQLiteBackendTests(SimpleTestCase):
+    def test_pragmas_and_transaction_mode(self):
+        """
+        Ensure the SQLite backend runs the configured pragmas on every connection, and takes the write lock when a
+        transaction begins in IMMEDIATE mode.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        name = os.path.join(directory, 'db.sqlite3')
+        options = {'timeout': 0, 'pragmas': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+                   'transaction_mode': 'IMMEDIATE'}
+        database = SQLiteDatabaseWrapper({**connection.settings_dict, 'NAME': name, 'OPTIONS': options}, 'tuned')
+        self.addCleanup(database.close)
+
+        with database.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+        other = sqlite3.connect(name, timeout=0, isolation_level=None)
+        self.addCleanup(other.close)
+        database._start_transaction_under_autocommit()
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'database is locked'):
+            other.execute('BEGIN IMMEDIATE')
+        database.connection.rollback()
+
+
+class DroneStateTests(QueryCountMixin, APITestCase):
+    def setUp(self):
+        self.idle = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,
+                                         battery_capacity=50, state='idle')
+        self.loaded = Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300,
+                                           battery_capacity=60, state='loaded')
+        self.empty = Drone.objects.create(serial_number="DRN_3C", model="cruiserweight", weight_limit=400,
+                                          battery_capacity=70, state='loaded')
+        self.low_battery = Drone.objects.create(serial_number="DRN_4H", model="heavyweight", weight_limit=500,
+                                                battery_capacity=10, state='loaded')
+        for drone in (self.loaded, self.low_battery):
+            Medication.objects.create(name=f'Advil-{drone.id}', weight=100, code='ADV_200', image='/media/advil.jpg',
+                                      drone=drone)
+        self.url = reverse('drone-transition')
+
+    def test_transition(self):
+        """
+        Ensure the drones that can enter the state are moved to it, and the rest are reported with the reason.
+        """
+        ids = [self.idle.id, self.loaded.id, self.empty.id, self.low_battery.id, 999]
+        with mock.patch('drones.states.publish_deltas') as publish_deltas:
+            response = self.client.post(self.url, {'ids': ids, 'state': 'delivering'}, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['moved'], [self.loaded.id])
+        self.assertEqual(response.data['failed'], [
+            {'id': self.idle.id, 'reason': 'A drone cannot go from idle to delivering.'},
+            {'id': self.empty.id, 'reason': 'The drone carries no medications.'},
+            {'id': self.low_battery.id, 'reason': 'The battery of the drone is below 25%.'},
+            {'id': 999, 'reason': 'Drone not found.'},
+        ])
+        self.assertEqual(dict(Drone.objects.values_list('serial_number', 'state')),
+                         {'DRN_1L': 'idle', 'DRN_2M': 'delivering', 'DRN_3C': 'loaded', 'DRN_4H': 'loaded'})
+        publish_deltas.assert_called_once_with([{'id': self.loaded.id, 'state': 'delivering'}])
+
+    def test_transition_queries(self):
+        """
+        Ensure moving drones runs the same queries however many drones move.
+        """
+        for drones in (1, 50):
+            self.populate_fleet(drones, 1)
+            ids = list(Drone.objects.filter(state='idle').values_list('id', flat=True))
+            # A savepoint, the locking read, the UPDATE and the savepoint release.
+            with self.assertNumQueries(4):
+                response = self.client.post(self.url, {'ids': ids, 'state': 'loaded'}, format='json')
+            self.assertEqual(len(response.data['moved']), drones)
+
+    def test_transition_invalid(self):
+        """
+        Ensure an unknown state is rejected.
+        """
+        response = self.client.post(self.url, {'ids': [self.idle.id], 'state': 'lost'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('state', response.data)
+
+    def test_update_state(self):
+        """
+        Ensure updating a drone only changes its state along the transitions of the state machine.
+        """
+        url = reverse('drone-detail', args=[self.idle.id])
+        response = self.client.patch(url, {'state': 'returning'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['state'], ['A drone cannot go from idle to returning.'])
+
+        response = self.client.patch(url, {'state': 'loading', 'battery_capacity': 20}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['state'], ['The battery of the drone is below 25%.'])
+
+        response = self.client.patch(url, {'state': 'loading'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.patch(reverse('drone-bulk'), [{'id': self.loaded.id, 'state': 'idle'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0]['state'], ['A drone cannot go from loaded to idle.'])
+
+    def test_load_delivering_drone(self):
+        """
+        Ensure a drone that is not idle, loading or loaded can not be loaded with medication.
+        """
+        Drone.objects.filter(id=self.idle.id).update(state='delivering')
+        medication = Medication.objects.create(name='Advil-300', weight=100, code='ADV_300', image='/media/advil.jpg')
+        url = reverse('drone-load-with-medication', args=[self.idle.id])
+        response = self.client.post(url, {'medication_set': [medication.id]})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn('state', response.data)
+
+
+
+class SimulationTests(QueryCountMixin, APITestCase):
+    def setUp(self):
+        self.fleet = {}
+        for serial_number, model, battery_capacity, state in [
+            ('DRN_LOADED', 'lightweight', 50, 'loaded'),
+            ('DRN_EMPTY', 'lightweight', 50, 'loaded'),
+            ('DRN_LOW', 'lightweight', 20, 'loaded'),
+            ('DRN_DELIVERING', 'heavyweight', 50, 'delivering'),
+            ('DRN_DELIVERED', 'middleweight', 40, 'delivered'),
+            ('DRN_RETURNING', 'cruiserweight', 2, 'returning'),
+            ('DRN_IDLE', 'lightweight', 98, 'idle'),
+            ('DRN_LOADING', 'lightweight', 30, 'loading'),
+        ]:
+            self.fleet[serial_number] = Drone.objects.create(serial_number=serial_number, model=model,
+                                                             weight_limit=500, battery_capacity=battery_capacity,
+                                                             state=state)
+        for serial_number in ('DRN_LOADED', 'DRN_LOW', 'DRN_DELIVERING'):
+            Medication.objects.create(name=f'Advil-{serial_number}', weight=100, code='ADV_200',
+                                      image='/media/advil.jpg', drone=self.fleet[serial_number])
+
+    def test_tick(self):
+        """
+        Ensure a tick moves the drones a step along their delivery when they pass the guards, drains the battery of the
+        flying drones by model, charges the idle ones and unloads the delivered medications.
+        """
+        with mock.patch('drones.simulation.publish_deltas') as publish_deltas:
+            result = simulation.tick()
+
+        self.assertEqual(result, {'drones': 5, 'delivered_medications': 1})
+        self.assertEqual({drone.serial_number: (drone.state, drone.battery_capacity) for drone in Drone.objects.all()}, {
+            'DRN_LOADED': ('delivering', 50),
+            'DRN_EMPTY': ('loaded', 50),
+            'DRN_LOW': ('loaded', 20),
+            'DRN_DELIVERING': ('delivered', 46),
+            'DRN_DELIVERED': ('returning', 40),
+            'DRN_RETURNING': ('idle', 0),
+            'DRN_IDLE': ('idle', 100),
+            'DRN_LOADING': ('loading', 30),
+        })
+        self.assertFalse(Medication.objects.filter(drone=self.fleet['DRN_DELIVERING']).exists())
+        publish_deltas.assert_called_once_with([
+            {'id': self.fleet['DRN_LOADED'].id, 'state': 'delivering'},
+            {'id': self.fleet['DRN_DELIVERING'].id, 'state': 'delivered', 'battery_capacity': 46,
+             'medication_set': []},
+            {'id': self.fleet['DRN_DELIVERED'].id, 'state': 'returning'},
+            {'id': self.fleet['DRN_RETURNING'].id, 'state': 'idle', 'battery_capacity': 0},
+            {'id': self.fleet['DRN_IDLE'].id, 'battery_capacity': 100},
+        ])
+
+    def test_tick_matches_advance(self):
+        """
+        Ensure the UPDATE of a tick computes the same states and batteries as `advance()`, over many ticks.
+        """
+        for _ in range(6):
+            drones = Drone.objects.annotate(loaded=states.CARRIES_MEDICATIONS) \
+                .values('id', 'model', 'state', 'battery_capacity', 'loaded')
+            expected = {drone['id']: simulation.advance(drone) for drone in drones}
+            with mock.patch('drones.simulation.publish_deltas'):
+                simulation.tick()
+            self.assertEqual(dict((pk, (state, battery_capacity)) for pk, state, battery_capacity
+                                  in Drone.objects.values_list('id', 'state', 'battery_capacity')), expected)
+
+    def test_tick_queries(self):
+        """
+        Ensure a tick runs the same queries however many drones change.
+        """
+        for drones in (1, 50):
+            self.populate_fleet(drones, 1)
+            Drone.objects.update(state='loaded')
+            # A savepoint, the locking read, the UPDATE of the medications, the UPDATE of the drones and the release.
+            with self.assertNumQueries(5), mock.patch('drones.simulation.publish_deltas'):
+                simulation.tick()
+
+    def test_simulate_command(self):
+        """
+        Ensure the simulate command runs the given number of ticks.
+        """
+        output = io.StringIO()
+        with mock.patch('drones.simulation.publish_deltas'):
+            call_command('simulate', ticks=2, interval=0, stdout=output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('tick 1: drones=5 delivered_medications=1 '))
+        self.assertEqual(Drone.objects.get(serial_number='DRN_DELIVERING').state, 'returning')
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.drone = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,
+                                          battery_capacity=50, state='idle')
+        Medication.objects.create(name='Advil-200', weight=100, code='ADV_200', image='/media/advil-200.jpg',
+                                  drone=self.drone)
+
+    def sample(self, name, **labels):
+        """
+        Return the value of a sample of the metrics endpoint, or 0 if it has none yet.
+        """
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        selector = ','.join(f'{label}="{value}"' for label, value in labels.items())
+        match = re.search(rf'^{name}{{{re.escape(selector)}}} (\S+)$', response.content.decode(), re.MULTILINE)
+        return float(match.group(1)) if match else 0
+
+    def test_request_metrics(self):
+        """
+        Ensure the requests are measured by view and action: wall time, queries, serialization time and response size.
+        """
+        view = 'DroneViewSet.list'
+        before = {name: self.sample(name, view=view) for name in (
+            'drones_request_duration_seconds_count', 'drones_request_db_queries_sum',
+            'drones_request_serialization_duration_seconds_sum', 'drones_response_size_bytes_sum')}
+        requests = self.sample('drones_requests_total', view=view, status=200)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('drone-list'), HTTP_ACCEPT='application/json')
+        # Each request clears the queries logged.
+        num_queries = len(queries)
+
+        self.assertEqual(self.sample('drones_requests_total', view=view, status=200), requests + 1)
+        self.assertEqual(self.sample('drones_request_duration_seconds_count', view=view),
+                         before['drones_request_duration_seconds_count'] + 1)
+        self.assertEqual(self.sample('drones_request_db_queries_sum', view=view),
+                         before['drones_request_db_queries_sum'] + num_queries)
+        self.assertGreater(self.sample('drones_request_serialization_duration_seconds_sum', view=view),
+                           before['drones_request_serialization_duration_seconds_sum'])
+        self.assertEqual(self.sample('drones_response_size_bytes_sum', view=view),
+                         before['drones_response_size_bytes_sum'] + len(response.content))
+
+    def test_action_label(self):
+        """
+        Ensure the extra actions of the viewsets are measured under their own name.
+        """
+        view = 'DroneViewSet.load_with_medication'
+        requests = self.sample('drones_requests_total', view=view, status=404)
+        self.client.post(reverse('drone-load-with-medication', args=[999]), {})
+        self.assertEqual(self.sample('drones_requests_total', view=view, status=404), requests + 1)
+
+    def test_histogram(self):
+        """
+        Ensure the histograms are rendered with cumulative buckets.
+        """
+        histogram = metrics.Histogram('test_seconds', 'Test.', (0.1, 1), labels=('view', ))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, 'a"b')
+        self.assertEqual(list(histogram.collect()), [
+            '# HELP test_seconds Test.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="a\\"b",le="0.1"} 1',
+            'test_seconds_bucket{view="a\\"b",le="1"} 3',
+            'test_seconds_bucket{view="a\\"b",le="+Inf"} 4',
+            'test_seconds_sum{view="a\\"b"} 6.05',
+            'test_seconds_count{view="a\\"b"} 4',
+        ])
+
+    @override_settings(DRONES_SLOW_REQUEST_SECONDS=0)
+    def test_slow_request_log(self):
+        """
+        Ensure the requests slower than the threshold are logged with their SQL.
+        """
+        with self.assertLogs('drones.metrics', 'WARNING') as logs:
+            self.client.get(reverse('drone-check-battery-level', args=[self.drone.id]))
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn(f'Slow request GET /drones/{self.drone.id}/check_battery_level/ '
+                      f'(DroneViewSet.check_battery_level)', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(ROOT_URLCONF='drones.tests')
+    async def test_async_views(self):
+        """
+        Ensure the queries of the async views, run in other threads, are measured too.
+        """
+        view = 'drones.async_views.check_battery_level'
+        queries = await sync_to_async(self.sample)('drones_request_db_queries_sum', view=view)
+        response = await self.async_client.get(f'/drones/{self.drone.id}/check_battery_level/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(await sync_to_async(self.sample)('drones_request_db_queries_sum', view=view), queries)
+
+# URLs of the async serving mode, for the tests of the async views.
+urlpatterns = [
+    path('', include('drones.async_views')),
+    path('', include('drones_musala.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF='drones.tests')
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.drone = Drone.objects.create(serial_number="DRN_1L", model="lightweight", weight_limit=250,
+                                          battery_capacity=50, state='idle')
+        Drone.objects.create(serial_number="DRN_2M", model="middleweight", weight_limit=300, battery_capacity=10,
+                             state='idle')
+        Medication.objects.create(name='Advil-200', weight=100, code='ADV_200', image='/media/advil-200.jpg',
+                                  drone=self.drone)
+
+    async def test_same_responses_as_sync_views(self):
+        """
+        Ensure the async views answer the same data and ETags as the sync ones.
+        """
+        urls = [f'/drones/{self.drone.id}/', f'/drones/{self.drone.id}/check_battery_level/',
+                f'/drones/{self.drone.id}/check_loaded_medications/', '/drones/get_available_drones/',
+                f'/drones/{self.drone.id}/?fields=id,state,medication_set',
+                '/drones/get_available_drones/?fields=serial_number&expand=medication_set']
+        for url in urls:
+            with self.settings(ROOT_URLCONF='drones_musala.urls'):
+                expected = await sync_to_async(self.client.get)(url, HTTP_ACCEPT='application/json')
+            await sync_to_async(cache.clear)()
+
+            response = await self.async_client.get(url)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.json(), expected.json())
+            self.assertEqual(response.get('ETag'), expected.get('ETag'))
+
+    async def test_etag(self):
+        """
+        Ensure the async views answer 304 to a request with the ETag of the current response.
+        """
+        url = f'/drones/{self.drone.id}/check_battery_level/'
+        etag = (await self.async_client.get(url))['ETag']
+        # The async client takes the headers by their own name.
+        response = await self.async_client.get(url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_not_found(self):
+        """
+        Ensure the async views answer a JSON 404 error for a drone that does not exist.
+        """
+        response = await self.async_client.get('/drones/999/check_battery_level/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json(), {'detail': 'Not found.'})
+
+    async def test_invalid_fields(self):
+        """
+        Ensure the async views answer a JSON 400 error for unknown fields.
+        """
+        response = await self.async_client.get(f'/drones/{self.drone.id}/', {'fields': 'id,color'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'fields': ['Unknown fields: color.']})
+
+    async def test_writes_served_by_sync_views(self):
+        """
+        Ensure other methods than GET on the URLs of the async views are served by the sync views.
+        """
+        response = await self.async_client.patch(f'/drones/{self.drone.id}/', {'state': 'loading'},
+                                                 content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((await self.async_client.get(f'/drones/{self.drone.id}/')).json()['state'], 'loading')
+
+        response = await self.async_client.post(f'/drones/{self.drone.id}/check_battery_level/')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+@skipUnless(connection.features.has_select_for_update,
+            'The loads lock their rows with select_for_update(), which the test SQLite database ignores: its concurrent '
+            'writers fail with "database table is locked".')
+class LoadWithMedicationConcurrencyTests(APITransactionTestCase):
+    """
+    Fire parallel loads against the API to check loading stays consistent under concurrent requests.
+    """
+    WORKERS = 8
+
+    def setUp(self):
+        self.drones = [
+            Drone.objects.create(serial_number=f'DRN_C{i}', model='heavyweight', weight_limit=300,
+                                 battery_capacity=90, state='idle')
+            for i in range(self.WORKERS)
+        ]
+        self.medications = [
+            Medication.objects.create(name=f'Contested-{i}', weight=100, code=f'CNT_{i}')
+            for i in range(3)
+        ]
+
+    def load(self, drone, medications):
+        """
+        Load a drone from a separate thread, returning the response status.
+        """
+        try:
+            url = reverse('drone-load-with-medication', kwargs={'pk': drone.pk})
+            client = APIClient(raise_request_exception=False)
+            response = client.post(url, {'medication_set': [medication.pk for medication in medications]})
+            return response.status_code
+        finally:
+            connection.close()
+
+    def test_parallel_loads_with_same_medications(self):
+        """
+        Ensure exactly one of several parallel loads of the same medications succeeds, that the others are refused
+        for taking medications already loaded, and that all of them end on that drone.
+        """
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            results = list(executor.map(lambda drone: self.load(drone, self.medications), self.drones))
+
+        self.assertEqual(sorted(results), [status.HTTP_200_OK] + [status.HTTP_400_BAD_REQUEST] * (self.WORKERS - 1))
+        loaded = [drone for drone, result in zip(self.drones, results) if result == status.HTTP_200_OK]
+        drone_ids = set(Medication.objects.values_list('drone_id', flat=True))
+        self.assertEqual(drone_ids, {loaded[0].pk})
+        self.assertEqual(Drone.objects.filter(state=Drone.STATE_LOADED).count(), 1)
+
+    def test_parallel_loads_never_overload_drone(self):
+        """
+        Ensure parallel loads of the same drone, each within its weight limit, all succeed one after the other and
+        never leave it carrying more than its weight limit.
+        """
+        drone = self.drones[0]
+        loads = [self.medications[:i % 3 + 1] for i in range(self.WORKERS)]
+        with ThreadPoolExecutor(max_workers=self.WORKERS) as executor:
+            results = list(executor.map(lambda medications: self.load(drone, medications), loads))
+
+        self.assertEqual(results, [status.HTTP_200_OK] * self.WORKERS)
+
+        weights = Medication.objects.filter(drone=drone).values_list('weight', flat=True)
+        self.assertLessEqual(sum(weights), drone.weight_limit)
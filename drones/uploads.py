@@ -0,0 +1,104 @@
+import base64
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import JSONParser
+
+from .validators import MAX_IMAGE_SIZE
+
+# Room for the multipart boundaries and part headers around the uploaded file.
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Size of the base64 slices decoded at once, a multiple of 4 so every slice decodes on its own.
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+class ImageTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = _('The maximum file size that can be uploaded is 5MB')
+    default_code = 'image_too_large'
+
+
+class LimitedSizeUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream uploaded files chunk by chunk into a temporary file, which storage then moves into place instead of copying
+    it. Uploads bigger than `max_size` are rejected as soon as that is known: before reading the body if the
+    Content-Length says so, or while counting the bytes received otherwise.
+    """
+    max_size = MAX_IMAGE_SIZE
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length > self.max_size + MULTIPART_OVERHEAD:
+            raise ImageTooLarge()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            self.upload_interrupted()
+            raise ImageTooLarge()
+        super().receive_data_chunk(raw_data, start)
+
+
+class BodyTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = _('The request body is too large.')
+    default_code = 'body_too_large'
+
+
+class LimitedSizeJSONParser(JSONParser):
+    """
+    JSON parser refusing bodies that can not hold a valid medication, so a request never holds more than a base64
+    encoded image of the maximum size in memory.
+    """
+    max_size = MAX_IMAGE_SIZE * 4 // 3 + MULTIPART_OVERHEAD
+    too_large = ImageTooLarge
+
+    def get_max_size(self):
+        return self.max_size
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = (parser_context or {}).get('request')
+        if request is not None and int(request.META.get('CONTENT_LENGTH') or 0) > self.get_max_size():
+            raise self.too_large()
+        return super().parse(stream, media_type, parser_context)
+
+
+class BulkJSONParser(LimitedSizeJSONParser):
+    """
+    JSON parser of the bulk requests, which may carry many images, refusing bodies larger than the
+    DRONES_BULK_MAX_BODY_SIZE setting.
+    """
+    too_large = BodyTooLarge
+
+    def get_max_size(self):
+        return settings.DRONES_BULK_MAX_BODY_SIZE
+
+
+def decode_base64_file(data, name, content_type=None, max_size=MAX_IMAGE_SIZE):
+    """
+    Decode a base64 string into a temporary file, slice by slice, so the decoded content is never held in memory.
+
+    The decoded size is known from the length of the string, so oversized files are rejected before decoding anything.
+    """
+    # Whitespace would shift the slices out of their 4 characters alignment.
+    if any(char in data for char in ' \t\r\n'):
+        data = ''.join(data.split())
+
+    size = len(data) // 4 * 3 - data[-2:].count('=')
+    if size > max_size:
+        raise ImageTooLarge()
+
+    file = TemporaryUploadedFile(name, content_type, size, None)
+    try:
+        for start in range(0, len(data), BASE64_CHUNK_SIZE):
+            file.write(base64.b64decode(data[start:start + BASE64_CHUNK_SIZE]))
+    except Exception:
+        file.close()
+        raise
+    file.seek(0)
+    return file
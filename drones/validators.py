@@ -1,8 +1,21 @@
+import math
+
 from django.core.exceptions import ValidationError
 
+# Maximum size of a medication picture, in bytes.
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+
 
 def size_validator(file):
-    if file.size > 5 * 1024 * 1024:
+    if file.size > MAX_IMAGE_SIZE:
         raise ValidationError("The maximum file size that can be uploaded is 5MB")
     else:
         return file
+
+
+def finite_validator(value):
+    """
+    Reject NaN and infinity, which pass any minimum and maximum value.
+    """
+    if value is not None and not math.isfinite(value):
+        raise ValidationError('Enter a finite number.')
@@ -1,16 +1,142 @@
-from drf_yasg import openapi
-from drf_yasg.openapi import Schema
-from drf_yasg.utils import swagger_auto_schema
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Prefetch, Sum, Value, When, prefetch_related_objects
+from django.http import HttpResponse
+from django.utils.encoding import force_str
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-from drones.serializers import DroneSerializer, MedicationSerializer, LoadMedicationDroneSerializer
-from drones.models import Drone, Medication
+from drones import exports, metrics, representations, states
+from drones.cache import FLEET_VERSION_KEY, cached_drone_response, cached_response, invalidate_drones
+from drones.dispatch import assignment_batches, batches, pack_medications
+from drones.docs import openapi, swagger_auto_schema
+from drones.events import publish_deltas
+from drones.fieldsets import ALL, FieldsetQuerySerializer, get_fieldset, only_columns
+from drones.filters import MedicationFilter
+from drones.pagination import DronePagination, MedicationPagination
+from drones.serializers import DroneSerializer, MedicationSerializer, LoadMedicationDroneSerializer, \
+    AssignMedicationsSerializer, AssignMedicationsResultSerializer, MedicationImageSerializer, \
+    BatteryHistoryQuerySerializer, BatteryHistorySerializer, BulkDeleteSerializer, BulkDroneSerializer, \
+    BulkMedicationSerializer, ExportQuerySerializer, DroneTransitionSerializer, DroneTransitionResultSerializer, \
+    NearestDronesQuerySerializer, NearestDroneSerializer
+from drones.history import downsample
+from drones.models import BatteryLevelSnapshot, Drone, Medication
+from drones.signals import medication_files_saved
+from drones.uploads import BulkJSONParser, LimitedSizeJSONParser, LimitedSizeUploadHandler
 
+# The query parameters of the responses with a sparse fieldset, for the docs.
+FIELDSET_PARAMETERS = [
+    openapi.Parameter(name, openapi.IN_QUERY, description=force_str(field.help_text), type=openapi.TYPE_STRING)
+    for name, field in FieldsetQuerySerializer().fields.items()
+]
 
-class DroneViewSet(viewsets.ModelViewSet):
+
+class BulkModelMixin:
+    """
+    Create (POST), update (PATCH) or delete (DELETE) many objects with a single request to the `bulk` endpoint.
+
+    The objects are validated in batches with the `bulk_serializer_class`, and saved with bulk queries inside a
+    transaction. Nothing is saved if any of them is invalid, and the errors of each one are returned in its position of
+    the list. As bulk queries send no signals, `bulk_saved()` gets the objects saved.
+    """
+    bulk_serializer_class = None
+
+    def get_bulk_serializer_class(self):
+        if getattr(self.request, 'method', None) == 'DELETE':
+            return BulkDeleteSerializer
+        return self.bulk_serializer_class
+
+    @swagger_auto_schema(method='delete', request_body=BulkDeleteSerializer,
+                         responses={204: 'Objects deleted', 400: 'Invalid or unknown ids', 413: 'Body too large'})
+    @swagger_auto_schema(methods=['post', 'patch'], responses={400: 'List of the errors of each object',
+                                                                413: 'Body too large'})
+    @action(methods=['post', 'patch', 'delete'], detail=False, parser_classes=[BulkJSONParser])
+    def bulk(self, request):
+        """
+        Create, update or delete many objects at once.
+        """
+        if request.method == 'DELETE':
+            return self.bulk_destroy(request)
+
+        updating = request.method == 'PATCH'
+        with transaction.atomic():
+            serializer = self.get_serializer(self.get_queryset() if updating else None, data=request.data, many=True,
+                                             partial=updating)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            try:
+                with transaction.atomic():
+                    objects = serializer.save()
+            except IntegrityError:
+                # Another request took a unique value after the validation.
+                error = {api_settings.NON_FIELD_ERRORS_KEY: ['The objects conflict with a concurrent change, retry.']}
+                return Response(error, status=status.HTTP_409_CONFLICT)
+            self.bulk_saved(objects)
+
+        prefetch_related_objects(objects, *self.get_bulk_prefetch_related())
+        data = self.serializer_class(objects, many=True, context=self.get_serializer_context()).data
+        return Response(data, status=status.HTTP_200_OK if updating else status.HTTP_201_CREATED)
+
+    def bulk_destroy(self, request):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        ids = set(serializer.validated_data['ids'])
+
+        with transaction.atomic():
+            queryset = self.get_queryset().filter(pk__in=ids)
+            unknown = ids - set(queryset.values_list('pk', flat=True))
+            if unknown:
+                return Response({'ids': [f'Objects {sorted(unknown)} do not exist.']},
+                                status=status.HTTP_400_BAD_REQUEST)
+            queryset.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def get_bulk_prefetch_related(self):
+        """
+        Return the lookups to prefetch for the response of the objects saved.
+        """
+        return []
+
+    def bulk_saved(self, objects):
+        pass
+
+
+class FieldsetMixin:
+    """
+    Answer the `fieldset_actions` with the fields requested with `?fields=` and `?expand=` (see drones/fieldsets.py),
+    reading only the columns they need. Unknown fields are answered with a 400 error.
+    """
+    fieldset_actions = ('list', 'retrieve')
+    fieldset = ALL
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.action in self.fieldset_actions:
+            self.fieldset = get_fieldset(request.query_params, self.get_serializer_class())
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in self.fieldset_actions:
+            context['fieldset'] = self.fieldset
+        return context
+
+    def get_required_columns(self):
+        """
+        Return the columns read whatever the fieldset: the primary key, and the ordering the pagination reads.
+        """
+        ordering = self.paginator.ordering if self.paginator is not None else []
+        return ['id', *(name.lstrip('-') for name in ordering)]
+
+    def only_fieldset_columns(self, queryset):
+        return only_columns(queryset, self.fieldset, self.get_required_columns())
+
+
+class DroneViewSet(FieldsetMixin, BulkModelMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows Drones to be viewed or edited.
 
@@ -23,36 +149,123 @@ class DroneViewSet(viewsets.ModelViewSet):
     """
     queryset = Drone.objects.all()
     serializer_class = DroneSerializer
+    bulk_serializer_class = BulkDroneSerializer
+    pagination_class = DronePagination
+
+    # Actions whose response nests the medications loaded on each drone.
+    MEDICATION_SET_ACTIONS = ('list', 'retrieve', 'get_available_drones', 'nearest')
+    MEDICATION_SET_FIELDS = ('id', 'name', 'weight', 'code', 'image', 'thumbnail', 'preview', 'drone')
+    fieldset_actions = MEDICATION_SET_ACTIONS
+
+    def get_queryset(self):
+        """
+        Tailor the queryset to the current action, so nested medications are fetched with one extra query instead of
+        one query per drone, and actions that only need a few columns do not load the whole row.
+        """
+        queryset = super().get_queryset()
+
+        if self.action in self.MEDICATION_SET_ACTIONS:
+            queryset = self.only_fieldset_columns(self.prefetch_medication_set(queryset, self.fieldset))
+        elif self.action in ('check_battery_level', 'check_loaded_medications', 'battery_history'):
+            queryset = queryset.only('id', 'battery_capacity')
+
+        return queryset
+
+    @classmethod
+    def prefetch_medication_set(cls, queryset, fieldset):
+        """
+        Prefetch the medications of the drones the `fieldset` includes: the fields nested, or only their ids if they are
+        not expanded.
+        """
+        if fieldset.expands('medication_set'):
+            medications = Medication.objects.only(*cls.MEDICATION_SET_FIELDS)
+        elif fieldset.includes('medication_set'):
+            medications = Medication.objects.only('id', 'drone')
+        else:
+            return queryset
+        return queryset.prefetch_related(Prefetch('medication_set', queryset=medications))
 
     def get_serializer_class(self):
         serializer_class = self.serializer_class
 
         if self.action == 'load_with_medication':
             serializer_class = LoadMedicationDroneSerializer
+        elif self.action == 'assign_medications':
+            serializer_class = AssignMedicationsSerializer
+        elif self.action == 'transition':
+            serializer_class = DroneTransitionSerializer
+        elif self.action == 'nearest':
+            serializer_class = NearestDroneSerializer
+        elif self.action == 'bulk':
+            serializer_class = self.get_bulk_serializer_class()
 
         return serializer_class
 
+    def get_bulk_prefetch_related(self):
+        return [Prefetch('medication_set', queryset=Medication.objects.only(*self.MEDICATION_SET_FIELDS))]
+
+    def bulk_saved(self, drones):
+        invalidate_drones([drone.pk for drone in drones])
+        deltas = []
+        for drone in drones:
+            changes = drone.changed_fields()
+            if changes:
+                deltas.append({'id': drone.pk, **changes})
+                drone.mark_fields_saved()
+        publish_deltas(deltas)
+
+    @swagger_auto_schema(manual_parameters=FIELDSET_PARAMETERS)
+    def list(self, request, *args, **kwargs):
+        if not settings.DRONES_FAST_SERIALIZERS:
+            return super().list(request, *args, **kwargs)
+        drones = representations.drone_values(self.filter_queryset(self.get_queryset()), self.fieldset,
+                                              self.get_required_columns())
+        page = self.paginate_queryset(drones)
+        return self.get_paginated_response(representations.represent_drones(request, page, self.fieldset))
+
+    @swagger_auto_schema(manual_parameters=FIELDSET_PARAMETERS)
+    def retrieve(self, request, *args, **kwargs):
+        if settings.DRONES_FAST_SERIALIZERS:
+            def render():
+                drones = representations.drone_values(self.get_queryset(), self.fieldset)
+                drone = get_object_or_404(drones, pk=kwargs['pk'])
+                return representations.represent_drones(request, [drone], self.fieldset)[0]
+        else:
+            def render():
+                return super(DroneViewSet, self).retrieve(request, *args, **kwargs).data
+
+        return cached_drone_response(request, kwargs['pk'], 'retrieve', render)
+
     @swagger_auto_schema(responses={200: openapi.Response('Drone loaded with medications',
                                                           schema=LoadMedicationDroneSerializer
                                                           ),
-                                    404: 'Drone not found'})
+                                    404: 'Drone not found', 409: 'Low battery, or the drone cannot be loaded'})
     @action(methods=['post'], detail=True)
     def load_with_medication(self, request, pk=None):
         """
         Load a drone with medication.
         """
-        drone = get_object_or_404(self.get_queryset(), id=pk)
-        if drone.battery_capacity < 25:
-            error = {
-                'battery_capacity': [
-                    'This drone has less than 25% of battery, so it can not be loaded with medication.'
-                ]
-            }
-            return Response(error, status=status.HTTP_409_CONFLICT)
-        serializer = self.get_serializer_class()(drone, data=request.data, context={'request': request})
-        if serializer.is_valid():
-            serializer.save(state=Drone.STATE_LOADED)
-            return Response(serializer.data)
+        # The drone and the medication rows stay locked until the load is saved, so concurrent loads can neither
+        # overload the drone nor take the same medications.
+        with transaction.atomic():
+            drone = get_object_or_404(self.get_queryset().select_for_update(), id=pk)
+            if drone.battery_capacity < states.MIN_BATTERY_LEVEL:
+                error = {
+                    'battery_capacity': [
+                        f'This drone has less than {states.MIN_BATTERY_LEVEL}% of battery, so it can not be loaded '
+                        f'with medication.'
+                    ]
+                }
+                return Response(error, status=status.HTTP_409_CONFLICT)
+            if Drone.STATE_LOADED not in states.NEXT_STATES[drone.state]:
+                error = {'state': [f'This drone is {drone.state}, so it can not be loaded with medication.']}
+                return Response(error, status=status.HTTP_409_CONFLICT)
+            serializer = self.get_serializer_class()(drone, data=request.data, context={'request': request})
+            if serializer.is_valid():
+                serializer.save(state=Drone.STATE_LOADED)
+                medication_set = sorted(medication.pk for medication in serializer.validated_data['medication_set'])
+                publish_deltas([{'id': drone.pk, 'medication_set': medication_set}])
+                return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @swagger_auto_schema(responses={200: MedicationSerializer(many=True), 404: 'Drone not found'})
@@ -66,12 +279,13 @@ class DroneViewSet(viewsets.ModelViewSet):
         return Response(medications_serializer.data)
 
     @swagger_auto_schema(responses={200: openapi.Response('Battery level of drone',
-                                                          schema=Schema(title='battery level',
-                                                                        type=openapi.TYPE_OBJECT,
-                                                                        properties={'battery_level': Schema(
-                                                                            type=openapi.TYPE_INTEGER)
-                                                                        }
-                                                                        )
+                                                          schema=openapi.Schema(
+                                                              title='battery level',
+                                                              type=openapi.TYPE_OBJECT,
+                                                              properties={'battery_level': openapi.Schema(
+                                                                  type=openapi.TYPE_INTEGER)
+                                                              }
+                                                          )
                                                           ),
                                     404: 'Drone not found'})
     @action(methods=['get'], detail=True)
@@ -79,25 +293,163 @@ class DroneViewSet(viewsets.ModelViewSet):
         """
         Check battery level of a specified drone.
         """
+        def render():
+            drone = get_object_or_404(self.get_queryset(), id=pk)
+            return {'battery_level': drone.battery_capacity}
+
+        return cached_drone_response(request, pk, 'check_battery_level', render)
+
+    @swagger_auto_schema(query_serializer=BatteryHistoryQuerySerializer,
+                         responses={200: BatteryHistorySerializer, 400: 'Invalid time range', 404: 'Drone not found'})
+    @action(methods=['get'], detail=True)
+    def battery_history(self, request, pk=None):
+        """
+        Get the battery levels of a specified drone over a time range, downsampled to a number of buckets with the
+        min, average and max level of each.
+        """
         drone = get_object_or_404(self.get_queryset(), id=pk)
-        data = {'battery_level': drone.battery_capacity}
-        return Response(data)
+        query = BatteryHistoryQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        start, end, buckets = (query.validated_data[key] for key in ('start', 'end', 'buckets'))
+        points = BatteryLevelSnapshot.objects.history(drone.pk, start, end)
+        data = {'start': start, 'end': end, 'buckets': downsample(points, start, end, buckets)}
+        return Response(BatteryHistorySerializer(data).data)
+
+    @swagger_auto_schema(query_serializer=ExportQuerySerializer,
+                         responses={200: 'Stream of the drones', 400: 'Invalid export type'})
+    @action(methods=['get'], detail=False)
+    def export(self, request):
+        """
+        Stream every drone with its loaded medications, as NDJSON (a drone per line) or CSV (a row per drone and loaded
+        medication).
+        """
+        query = ExportQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        export_type = query.validated_data['type']
+        rows = exports.drones_ndjson(request) if export_type == 'ndjson' else exports.drones_csv(request)
+        return exports.streaming_response('drones', export_type, rows)
 
+    @swagger_auto_schema(manual_parameters=FIELDSET_PARAMETERS)
     @action(methods=['get'], detail=False)
     def get_available_drones(self, request):
         """
         Get available drones for loading.
         """
-        available_drones = self.get_queryset().filter(state=Drone.STATE_IDLE, battery_capacity__gt=25)
-        serializer = self.get_serializer_class()(available_drones, many=True, context={'request': request})
-        return Response(serializer.data)
+        def render():
+            available_drones = self.get_queryset().available()
+            if settings.DRONES_FAST_SERIALIZERS:
+                rows = list(representations.drone_values(available_drones, self.fieldset))
+                return representations.represent_drones(request, rows, self.fieldset)
+            return self.get_serializer(available_drones, many=True).data
+
+        return cached_response(request, 'get_available_drones', [FLEET_VERSION_KEY], render)
+
+    @swagger_auto_schema(query_serializer=NearestDronesQuerySerializer, manual_parameters=FIELDSET_PARAMETERS,
+                         responses={200: NearestDroneSerializer(many=True), 400: 'Invalid position, weight or k'})
+    @action(methods=['get'], detail=False, pagination_class=None)
+    def nearest(self, request):
+        """
+        Get the available drones nearest to a position that can carry a weight, nearest first, with their distance to
+        it.
+        """
+        query = NearestDronesQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        latitude, longitude, weight, k = (query.validated_data[key] for key in ('latitude', 'longitude', 'weight', 'k'))
+        eligible = self.get_queryset().available().filter(weight_limit__gte=weight)
+        distances = {pk: distance for distance, pk in eligible.nearest(latitude, longitude, k)}
+        drones = self.get_queryset().filter(pk__in=distances)
+        if settings.DRONES_FAST_SERIALIZERS:
+            rows = sorted(representations.drone_values(drones, self.fieldset),
+                          key=lambda row: (distances[row['id']], row['id']))
+            data = representations.represent_drones(request, rows, self.fieldset)
+            if self.fieldset.includes('distance'):
+                for row, drone in zip(rows, data):
+                    drone['distance'] = distances[row['id']]
+        else:
+            drones = sorted(drones, key=lambda drone: (distances[drone.pk], drone.pk))
+            for drone in drones:
+                drone.distance = distances[drone.pk]
+            data = self.get_serializer(drones, many=True).data
+        return Response(data)
+
+    @swagger_auto_schema(responses={200: DroneTransitionResultSerializer, 400: 'Invalid ids or state'})
+    @action(methods=['post'], detail=False)
+    def transition(self, request):
+        """
+        Move many drones to a state at once, reporting the ones that cannot move to it.
+        """
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        moved, failed = states.transition(serializer.validated_data['ids'], serializer.validated_data['state'])
+        result = {
+            'moved': moved,
+            'failed': [{'id': pk, 'reason': reason} for pk, reason in sorted(failed.items())],
+        }
+        return Response(DroneTransitionResultSerializer(result).data)
+
+    @swagger_auto_schema(responses={200: AssignMedicationsResultSerializer, 400: 'Invalid list of medications'})
+    @action(methods=['post'], detail=False)
+    def assign_medications(self, request):
+        """
+        Pack pending medications onto the available drones, without surpassing the weight limit of any of them.
+        """
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        requested = sorted(set(serializer.validated_data['medication_set']))
+
+        with transaction.atomic():
+            available_drones = self.get_queryset().available()
+            capacities = dict(available_drones.select_for_update().values_list('id', 'weight_limit'))
+            loaded_weights = Medication.objects.filter(drone__in=available_drones.values('id')).values('drone') \
+                .annotate(loaded_weight=Sum('weight')).values_list('drone', 'loaded_weight')
+            for drone_id, loaded_weight in loaded_weights:
+                capacities[drone_id] -= loaded_weight
+
+            pending = {}
+            for ids in batches(requested):
+                pending.update(Medication.objects.select_for_update().filter(pk__in=ids, drone__isnull=True)
+                               .values_list('id', 'weight'))
+            assignments, unassigned = pack_medications(pending.items(), capacities.items())
+
+            # Like bulk_update(), but with one CASE branch per drone instead of one per medication.
+            for batch in assignment_batches(assignments):
+                medication_ids = [pk for medication_ids in batch.values() for pk in medication_ids]
+                Medication.objects.filter(pk__in=medication_ids).update(drone_id=Case(
+                    *[When(pk__in=medication_ids, then=Value(drone_id)) for drone_id, medication_ids in batch.items()]
+                ))
+                Drone.objects.filter(pk__in=list(batch)).update(state=Drone.STATE_LOADED)
+            # Bulk updates send no signals.
+            invalidate_drones(assignments)
+            medication_sets = {}
+            for drone_ids in batches(list(assignments)):
+                for drone_id, medication_id in Medication.objects.filter(drone__in=drone_ids).order_by('id') \
+                        .values_list('drone', 'id'):
+                    medication_sets.setdefault(drone_id, []).append(medication_id)
+            publish_deltas({'id': drone_id, 'state': Drone.STATE_LOADED, 'medication_set': medication_ids}
+                           for drone_id, medication_ids in medication_sets.items())
+
+        result = {
+            'assignments': [{'drone': drone_id, 'medication_set': sorted(medication_ids)}
+                            for drone_id, medication_ids in sorted(assignments.items())],
+            'unassigned': sorted(unassigned),
+            'rejected': [medication_id for medication_id in requested if medication_id not in pending],
+        }
+        return Response(AssignMedicationsResultSerializer(result).data)
 
 
-class MedicationViewSet(viewsets.ModelViewSet):
+class MedicationViewSet(FieldsetMixin, BulkModelMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows Medications to be viewed or edited.
 
-    list: Return all medications, ordered by highest battery capacity.
+    list: Return the medications, ordered by name. Filter them by `name` or `code` prefix, by weight with `min_weight` and
+    `max_weight`, by `loaded` on a drone or not, and search the ones whose name or code contain a text with `search`.
     retrieve: Return a medication instance.
     create: Create a new medication instance.
     update: Update a medication instance.
@@ -106,3 +458,89 @@ class MedicationViewSet(viewsets.ModelViewSet):
     """
     queryset = Medication.objects.all()
     serializer_class = MedicationSerializer
+    bulk_serializer_class = BulkMedicationSerializer
+    pagination_class = MedicationPagination
+    filter_backends = [MedicationFilter]
+    parser_classes = [LimitedSizeJSONParser, FormParser, MultiPartParser]
+
+    def initialize_request(self, request, *args, **kwargs):
+        drf_request = super().initialize_request(request, *args, **kwargs)
+        if self.action == 'upload_image':
+            # Installed before anything reads the body, e.g. the CSRF check of the session authentication.
+            request.upload_handlers = [LimitedSizeUploadHandler(request)]
+        return drf_request
+
+    def get_serializer_class(self):
+        serializer_class = self.serializer_class
+
+        if self.action == 'upload_image':
+            serializer_class = MedicationImageSerializer
+        elif self.action == 'bulk':
+            serializer_class = self.get_bulk_serializer_class()
+
+        return serializer_class
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.fieldset_actions:
+            queryset = self.only_fieldset_columns(queryset)
+        return queryset
+
+    @swagger_auto_schema(manual_parameters=FIELDSET_PARAMETERS)
+    def list(self, request, *args, **kwargs):
+        if not settings.DRONES_FAST_SERIALIZERS:
+            return super().list(request, *args, **kwargs)
+        medications = representations.medication_values(self.filter_queryset(self.get_queryset()), self.fieldset,
+                                                        self.get_required_columns())
+        page = self.paginate_queryset(medications)
+        return self.get_paginated_response(representations.represent_medications(request, page, self.fieldset))
+
+    @swagger_auto_schema(manual_parameters=FIELDSET_PARAMETERS)
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.DRONES_FAST_SERIALIZERS:
+            return super().retrieve(request, *args, **kwargs)
+        medications = representations.medication_values(self.get_queryset(), self.fieldset)
+        medication = get_object_or_404(medications, pk=kwargs['pk'])
+        return Response(representations.represent_medications(request, [medication], self.fieldset)[0])
+
+    def bulk_saved(self, medications):
+        medication_files_saved([(medication, files) for medication in medications
+                                if (files := medication.changed_files())])
+        drone_ids = {drone_id for medication in medications for drone_id in medication.affected_drones()}
+        if drone_ids:
+            invalidate_drones(drone_ids)
+
+    @swagger_auto_schema(query_serializer=ExportQuerySerializer,
+                         responses={200: 'Stream of the medications', 400: 'Invalid export type'})
+    @action(methods=['get'], detail=False)
+    def export(self, request):
+        """
+        Stream every medication, as NDJSON (a medication per line) or CSV.
+        """
+        query = ExportQuerySerializer(data=request.query_params)
+        if not query.is_valid():
+            return Response(query.errors, status=status.HTTP_400_BAD_REQUEST)
+        export_type = query.validated_data['type']
+        rows = exports.medications_ndjson(request) if export_type == 'ndjson' else exports.medications_csv(request)
+        return exports.streaming_response('medications', export_type, rows)
+
+    @swagger_auto_schema(responses={200: MedicationSerializer, 400: 'Invalid image', 404: 'Medication not found',
+                                    413: 'Image too large'})
+    @action(methods=['post'], detail=True, parser_classes=[MultiPartParser])
+    def upload_image(self, request, pk=None):
+        """
+        Upload the image of a medication as multipart form data, streaming it to storage.
+        """
+        medication = self.get_object()
+        serializer = self.get_serializer(medication, data=request.data)
+        if serializer.is_valid():
+            serializer.save()
+            return Response(MedicationSerializer(medication, context=self.get_serializer_context()).data)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+def metrics_view(request):
+    """
+    Metrics of the requests served by this process, in the Prometheus text format.
+    """
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
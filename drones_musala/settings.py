@@ -13,6 +13,7 @@ import os
 from pathlib import Path
 
 from celery.schedules import crontab
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -40,11 +41,13 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
-    'drf_yasg',
+    'channels',
     'drones.apps.DronesConfig',
 ]
 
 MIDDLEWARE = [
+    'drones.metrics.metrics_middleware',
+    'drones.compression.compression_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,17 +77,76 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'drones_musala.wsgi.application'
+ASGI_APPLICATION = 'drones_musala.asgi.application'
+
+# Serve the read-heavy endpoints with async views. Only worth it when served with ASGI, e.g. with daphne.
+DRONES_ASYNC_VIEWS = os.environ.get('DRONES_ASYNC_VIEWS') == '1'
+
+# Render the drone and medication lists and details from `values()` rows instead of with their serializers, which
+# gives the same output faster (see drones/representations.py).
+DRONES_FAST_SERIALIZERS = os.environ.get('DRONES_FAST_SERIALIZERS', '1') == '1'
+
+# Requests taking longer than this many seconds are logged with their SQL by the metrics middleware, which serves the
+# metrics of all the requests at /metrics/ (see drones/metrics.py).
+DRONES_SLOW_REQUEST_SECONDS = float(os.environ.get('DRONES_SLOW_REQUEST_SECONDS', 1))
+
+# Largest body, in bytes, of the requests to the bulk endpoints, which may carry many base64 encoded images (the other
+# JSON requests are limited to a single image of the maximum size).
+DRONES_BULK_MAX_BODY_SIZE = int(os.environ.get('DRONES_BULK_MAX_BODY_SIZE', 100 * 1024 * 1024))
+
+# Serve the API docs at /api-docs/. Set DRONES_API_DOCS=0 to leave them out, and drf_yasg with them, e.g. on workers.
+# The schema is read from DRONES_API_SCHEMA_FILE, written by `manage.py generate_schema`, and browsers may keep it
+# DRONES_API_SCHEMA_MAX_AGE seconds (see drones/schema.py).
+DRONES_API_DOCS = os.environ.get('DRONES_API_DOCS', '1') == '1'
+DRONES_API_SCHEMA_FILE = Path(os.environ.get('DRONES_API_SCHEMA_FILE', BASE_DIR / 'api-schema.json'))
+DRONES_API_SCHEMA_MAX_AGE = int(os.environ.get('DRONES_API_SCHEMA_MAX_AGE', 24 * 60 * 60))
+if DRONES_API_DOCS:
+    INSTALLED_APPS.append('drf_yasg')
 
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_PROFILE selects the database: 'sqlite' (the default) for a single node, or 'postgresql' for concurrent
+# writers, configured with the POSTGRES_* variables.
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+if DATABASE_PROFILE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'drones'),
+            'USER': os.environ.get('POSTGRES_USER', 'drones'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'postgres'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            # Keep the connections open across requests instead of connecting for every one, checking they still work
+            # before reusing them.
+            'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', 600)),
+            'CONN_HEALTH_CHECKS': True,
+            # Set POSTGRES_POOLER=1 when connecting through a transaction pooler such as PgBouncer, which cannot keep
+            # the server-side cursors of iterator() across transactions. Iterated querysets are then fetched whole.
+            'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('POSTGRES_POOLER') == '1',
+        }
     }
-}
+elif DATABASE_PROFILE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'drones.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Seconds a writer waits for the lock held by another one.
+                'timeout': 20,
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+    # Set SQLITE_WAL=1 so readers do not block the writer nor the other way around, and commits are only synced to disk
+    # at checkpoints, which can lose the last commits on power loss but never corrupts the database. The journal mode
+    # is stored in the database file, so it is left unchanged by default, not to rewrite the sample database.
+    if os.environ.get('SQLITE_WAL') == '1':
+        DATABASES['default']['OPTIONS']['pragmas'] = {'journal_mode': 'WAL', 'synchronous': 'NORMAL'}
+else:
+    raise ImproperlyConfigured(f'Unknown DATABASE_PROFILE: {DATABASE_PROFILE}')
 
 
 # Password validation
@@ -132,8 +194,63 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
+    'DEFAULT_RENDERER_CLASSES': [
+        'drones.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+}
+
+# API documentation configuration
+SWAGGER_SETTINGS = {
+    'DEFAULT_PAGINATOR_INSPECTORS': [
+        'drones.inspectors.KeysetPaginationInspector',
+        'drf_yasg.inspectors.DjangoRestResponsePagination',
+        'drf_yasg.inspectors.CoreAPICompatInspector',
+    ],
+    # The UIs read the schema served from the file or memory, rather than generating it again.
+    'SPEC_URL': 'api-schema',
 }
 
+REDOC_SETTINGS = {
+    'SPEC_URL': 'api-schema',
+}
+
+# Cache configuration
+# Set REDIS_CACHE_URL to an empty value to use a local in-memory cache instead of Redis.
+REDIS_CACHE_URL = os.environ.get('REDIS_CACHE_URL', 'redis://redis:6379/1')
+if REDIS_CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_CACHE_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+                # Serve from the database while Redis is down.
+                'IGNORE_EXCEPTIONS': True,
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Seconds the responses of the hot drone endpoints stay cached, unless a change invalidates them first.
+DRONES_CACHE_TIMEOUT = 60
+
+# Channels configuration
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            'hosts': [('redis', 6379)],
+        },
+    }
+}
+# Seconds the drone changes are held by each WebSocket to be sent together, so bursts become a single message.
+DRONES_STREAM_COALESCE_SECONDS = 0.2
+
 # Celery configuration
 CELERY_BROKER_URL = 'redis://redis:6379'
 CELERY_RESULT_BACKEND = 'redis://redis:6379'
@@ -147,17 +264,43 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'drones.tasks.log_drones_battery_levels',
         'schedule': crontab(minute='*/10'),
     },
+    'rollup-battery-history': {
+        'task': 'drones.tasks.rollup_battery_history',
+        'schedule': crontab(minute=5),
+    },
 }
 
+# Check the battery of the fleet in shards of this many drones, in parallel across the Celery workers, instead of in a
+# single task. 0 keeps a single task, enough for fleets checked well within the 10 minutes between two checks.
+DRONES_BATTERY_CHECK_SHARD_SIZE = int(os.environ.get('DRONES_BATTERY_CHECK_SHARD_SIZE', 0))
+
+# Simulation of the fleet, for demos and load tests. Set DRONES_SIMULATION=1 to advance it a tick every
+# DRONES_SIMULATION_TICK_SECONDS with Celery beat. It changes the drones of the database, never enable it in production.
+DRONES_SIMULATION = os.environ.get('DRONES_SIMULATION') == '1'
+DRONES_SIMULATION_TICK_SECONDS = float(os.environ.get('DRONES_SIMULATION_TICK_SECONDS', 10))
+if DRONES_SIMULATION:
+    CELERY_BEAT_SCHEDULE['simulate-fleet'] = {
+        'task': 'drones.tasks.simulate_fleet',
+        'schedule': DRONES_SIMULATION_TICK_SECONDS,
+    }
+
+# Battery history configuration
+# Snapshots are kept for this many days, then compacted into hourly rollups kept for BATTERY_HISTORY_ROLLUP_RETENTION_DAYS.
+BATTERY_HISTORY_RAW_RETENTION_DAYS = 7
+BATTERY_HISTORY_ROLLUP_RETENTION_DAYS = 365
+
 # Logging configuration
+# The battery levels logged by the periodic battery check.
+DRONES_BATTERY_LOG_FILE = Path(os.environ.get('DRONES_BATTERY_LOG_FILE', BASE_DIR / 'battery-level-check.log'))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     # Formatters ##############################################################
     'formatters': {
         'battery-level-check': {
-            'format': '[%(levelname)s] BATTERY CHECK DONE ON --> %(asctime)s %(message)s',
-            'datefmt': '%Y %b %d, %H:%M:%S',
+            # Messages are JSON objects, one per line.
+            'format': '%(message)s',
         },
     },
     # Handlers ##############################################################
@@ -166,7 +309,9 @@ LOGGING = {
             'level': 'INFO',
             'class': 'logging.handlers.RotatingFileHandler',
             'formatter': 'battery-level-check',
-            'filename': 'battery-level-check.log',
+            'filename': DRONES_BATTERY_LOG_FILE,
+            # Created on the first line logged, not by every process that configures logging.
+            'delay': True,
             'backupCount': 30,
             'maxBytes': 1024 * 1024 * 50  # 50 mb
         },
@@ -181,5 +326,10 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'drones.metrics': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
@@ -0,0 +1,29 @@
+"""
+Settings of the tests and benchmarks, which run on their own, with no Redis nor Celery workers.
+
+`manage.py test` and `manage.py benchmark` use them unless DJANGO_SETTINGS_MODULE is set. With any other runner, set
+DJANGO_SETTINGS_MODULE=drones_musala.settings_test.
+"""
+from .settings import *  # noqa: F401,F403
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# The in-memory channel layer needs no Redis, but only works within a single process.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    }
+}
+
+# The tasks run synchronously, without a broker.
+CELERY_TASK_ALWAYS_EAGER = True
+
+# The tests check the battery levels logged with assertLogs(), and leave no log file behind.
+LOGGING = {
+    **LOGGING,
+    'handlers': {**LOGGING['handlers'], 'battery-level-check': {'class': 'logging.NullHandler'}},
+}
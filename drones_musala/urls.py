@@ -18,9 +18,7 @@ from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include, re_path
-from drf_yasg import openapi
-from drf_yasg.views import get_schema_view
-from rest_framework import routers, permissions
+from rest_framework import routers
 
 from drones import views
 
@@ -32,24 +30,22 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include(router.urls)),
     path('accounts/', include('rest_framework.urls')),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
 
-# Documentation
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Drones API",
-        default_version='v1.0.0',
-        description="API to manage drones and medications to be delivered",
-        contact=openapi.Contact(name='Leduan B. Rosell', email="leduanb@gmail.com"),
-    ),
-    public=True,
-    permission_classes=[permissions.AllowAny],
-)
-
-urlpatterns += [
-   re_path(r'^api-docs/swagger/$', schema_view.with_ui('swagger'), name='schema-swagger-ui'),
-   re_path(r'^api-docs/redoc/$', schema_view.with_ui('redoc'), name='schema-redoc'),
-]
+if settings.DRONES_ASYNC_VIEWS:
+    # Serve the read-heavy endpoints with the async views, ahead of the router.
+    urlpatterns.insert(1, path('', include('drones.async_views')))
+
+if settings.DRONES_API_DOCS:
+    # Imported only here, so drf_yasg is not loaded without the docs.
+    from drones import schema
+
+    urlpatterns += [
+        path('api-docs/schema.json', schema.schema_view, name='api-schema'),
+        re_path(r'^api-docs/swagger/$', schema.ui_view('swagger'), name='schema-swagger-ui'),
+        re_path(r'^api-docs/redoc/$', schema.ui_view('redoc'), name='schema-redoc'),
+    ]
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -6,7 +6,11 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drones_musala.settings')
+    if sys.argv[1:2] in (['test'], ['benchmark']):
+        # The tests and benchmarks run with no Redis nor Celery workers.
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drones_musala.settings_test')
+    else:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'drones_musala.settings')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: